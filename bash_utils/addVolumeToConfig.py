@@ -15,22 +15,22 @@ def main(alias:str, uuid:str)->None:
         "volumeType": "unused"
     }
 
-    # Add new volume to configuration using the volume's UUID as the key
-    configData["multipathData"]["multipathVolumes"][uuid] = volumeData
-    
-    # Write updated configuration back to file
-    writeConfigFile(configData)
+    # Add new volume to configuration using the volume's UUID as the key.
+    # In a cluster sharing its config this goes to /etc/pve for every node.
+    from sharedConfig import set_volume
+    set_volume(uuid, volumeData)
     print(f"Successfully added volume: {alias} with UUID: {uuid}")
 
-def readConfigFile()->dict:
+def readConfigFile(configPath:str="/opt/hitachi/etc/hitachi_config.json")->dict:
     """
     Reads the configuration file and returns its contents as a dictionary
+    Args:
+        configPath (str): Path to the configuration file
     Returns:
         dict: The configuration data
     Raises:
         Exception: If there is an error reading or parsing the file
     """
-    configPath = "/opt/hitachi/etc/hitachi_config.json"
     configData = {}
     try:
         with open(configPath, "r") as f:
@@ -41,16 +41,16 @@ def readConfigFile()->dict:
     finally:
         return configData
     
-def writeConfigFile(configData:dict)->None:
+def writeConfigFile(configData:dict, configPath:str="/opt/hitachi/etc/hitachi_config.json")->None:
     """
     Writes the given configuration data to the configuration file
     Args:
         configData (dict): The configuration data to write
-        
+        configPath (str): Path to the configuration file
+
     Raises:
         Exception: If there is an error writing the file
     """
-    configPath = "/opt/hitachi/etc/hitachi_config.json"
     try:
         with open(configPath, "w") as f:
             f.write(json.dumps(configData, indent=4))
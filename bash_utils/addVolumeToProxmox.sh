@@ -62,52 +62,27 @@ make_gpt_partition() {
 rescan_disks() {
     rescan=/usr/bin/rescan-scsi-bus.sh
     echo "Rescanning SCSI bus for new disks and multipath devices..."
-    # Create a single GPT partition on the disk
-    $rescan --multipath --largelun --color
+    # Scan the known FC targets without a LIP, fall back to a full scan on other transports
+    python3 "$(dirname "$(realpath "$0")")/fcRescan.py" || $rescan --multipath --largelun --color
 }
 
 #######################################################
-# Handle multipath devices and get user to select disks
+# Ask the user for the multipath alias of a disk
 # Returns:
-#  None
+#  The alias
 #######################################################
-configure_multipath_for_disk() {
-    ready="n"
+get_alias_for_disk() {
     aliasCorrect="n"
     aliasName=""
-    multipathFile="/etc/multipath.conf"
-    # multipathFile="/root/hitachi/multipath.conf"
-    multipathEntry=("\tmultipath {")
-    
+
     uuid=$(/usr/lib/udev/scsi_id --whitelisted --replace-whitespace --device="$1")
     echo "Configuring multipath for new disk $1 with UUID $uuid..." >&2
-    
+
     while [[ "$aliasCorrect" != "Y" && "$aliasCorrect" != "y" ]]; do
         read -p "Enter alias for new multipath device (e.g., mpatha): " aliasName
         read -p "Is '$aliasName' correct? (Y/N): " aliasCorrect
     done
-
-    read -p "Ready to configure multipath device? (Y/N): " ready
-    
-    if [[ "$ready" == "Y" || "$ready" == "y" ]]; then
-        multipathEntry+=($'\t\twwid'" $uuid")
-        multipathEntry+=($'\t\talias'" $aliasName")
-        multipathEntry+=($'\t}')
-        echo "Adding multipath entry for disk $1 with UUID $uuid..." >&2
-        multipath -a $uuid
-        echo "Creating multipath configuration for disk $1 with alias '$aliasName'..." >&2
-        for line in "${multipathEntry[@]}"; do
-            echo "$line" >&2
-            sed -i "/# End of multipath devices/i\ $line" $multipathFile
-        done
-        
-        # Restart multipath service to apply changes
-        echo "Reloading multipath service..." >&2
-        systemctl reload multipathd.service
-        echo $aliasName
-    else
-        echo "Skipping multipath configuration for disk $1." >&2
-    fi
+    echo $aliasName
 }
 
 rescan=/usr/bin/rescan-scsi-bus.sh
@@ -256,17 +231,27 @@ while [[ "$valid_disks_correct" != "Y" && "$valid_disks_correct" != "y" ]]; do
     echo
 done
 
+# Ask for everything first, then add all disks with one edit of multipath.conf and one multipathd reload
+disk_specs=()
 for disk in ${valid_disks[@]}; do
-    configure_multipath_for_disk "$disk"
-    
-    read -p "waiting here..." wait
+    aliasName=$(get_alias_for_disk "$disk")
     disk_usage=$(get_disk_usage "$disk")
     echo "Selected usage: $disk_usage"
-    echo "$disk"
+    disk_specs+=("$disk:$aliasName:$disk_usage")
+done
 
-    if [[ "$disk_usage" == "datastore" ]]; then
+read -p "Ready to configure ${#disk_specs[@]} multipath device(s)? (Y/N): " ready
+if [[ "$ready" != "Y" && "$ready" != "y" ]]; then
+    echo "Skipping multipath configuration."
+    exit 0
+fi
+python3 "$(dirname "$(realpath "$0")")/batchAddVolumes.py" "${disk_specs[@]}" || exit 1
+
+for spec in ${disk_specs[@]}; do
+    disk=${spec%%:*}
+    if [[ "${spec##*:}" == "datastore" ]]; then
         echo "Creating GPT partition on $disk..."
         make_gpt_partition "$disk"
         echo "Partition created."
     fi
-done
\ No newline at end of file
+done
@@ -0,0 +1,296 @@
+import os, sys, json, re, argparse, subprocess
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+from clusterInfo import get_cluster_info
+from hitachiInventory import scan_block_devices
+from sharedConfig import set_volumes, CONFIG_PATH
+
+MULTIPATH_CONF = "/etc/multipath.conf"
+WWIDS_FILE = "/etc/multipath/wwids"
+END_MARKER = "# End of multipath devices"
+
+VOLUME_TYPES = ["unused", "datastore", "rdm"]
+FILE_SYSTEMS = ["gfs2", "xfs"]
+
+def parse_disk_spec(spec:str) -> dict:
+    """
+    Parses a disk given on the command line as device[:alias[:type[:fileSystem]]]
+
+    Args:
+        spec (str): e.g. /dev/sdb:Proxmox-Vol1:datastore:xfs, sdc or a WWID
+
+    Returns:
+        dict: {'disk': str, 'alias': str, 'volumeType': str, 'fileSystem': str}, fileSystem is
+              empty if not given
+
+    Raises:
+        ValueError: If the type or the file system is unknown
+    """
+    parts = spec.split(":")
+    volumeType = parts[2] if len(parts) > 2 and parts[2] else "unused"
+    if volumeType not in VOLUME_TYPES:
+        raise ValueError(f"unknown volume type '{volumeType}' in '{spec}'")
+    fileSystem = parts[3] if len(parts) > 3 else ""
+    if fileSystem and fileSystem not in FILE_SYSTEMS:
+        raise ValueError(f"unknown file system '{fileSystem}' in '{spec}'")
+    return {"disk": parts[0].replace("/dev/", ""), "alias": parts[1] if len(parts) > 1 else "",
+            "volumeType": volumeType, "fileSystem": fileSystem}
+
+def resolve_wwids(disks:list, luns:dict) -> tuple:
+    """
+    Resolves sd devices (or WWIDs) to the WWIDs of their LUNs with one inventory
+
+    Args:
+        disks (list): From parse_disk_spec()
+        luns (dict): From scan_block_devices()
+
+    Returns:
+        tuple: ([disk with 'wwid' added], [str] errors)
+    """
+    deviceToWwid = {}
+    for wwid, lun in luns.items():
+        for path in lun["paths"]:
+            deviceToWwid[path["device"]] = wwid
+
+    resolved = []
+    errors = []
+    seen = set()
+    for disk in disks:
+        wwid = deviceToWwid.get(disk["disk"], disk["disk"] if disk["disk"] in luns else None)
+        if wwid is None:
+            errors.append(f"{disk['disk']} is not a known disk or WWID")
+        elif wwid in seen:
+            # Several paths of the same LUN were selected
+            continue
+        else:
+            seen.add(wwid)
+            resolved.append(dict(disk, wwid=wwid))
+    return resolved, errors
+
+def find_section(content:str, name:str) -> tuple:
+    """
+    Finds a top level section of multipath.conf, e.g. multipaths { ... }
+
+    Args:
+        content (str): Content of multipath.conf
+        name (str): Section name
+
+    Returns:
+        tuple: (start, end) of the section body between its braces, None if there is no such section
+    """
+    section = re.search(rf"^{name}\s*\{{", content, re.MULTILINE)
+    if not section:
+        return None
+    depth = 0
+    for index in range(section.end() - 1, len(content)):
+        if content[index] == "{":
+            depth += 1
+        elif content[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return section.end(), index
+    return section.end(), len(content)
+
+def get_section_wwids(content:str, name:str) -> set:
+    """
+    Gets the WWIDs listed in a section of multipath.conf
+
+    Args:
+        content (str): Content of multipath.conf
+        name (str): Section name, e.g. multipaths or blacklist
+
+    Returns:
+        set: WWIDs of the section
+    """
+    bounds = find_section(content, name)
+    if bounds is None:
+        return set()
+    return set(re.findall(r"^\s*wwid\s+\"?([^\s\"]+)\"?", content[bounds[0]:bounds[1]], re.MULTILINE))
+
+def add_multipath_entries(content:str, entries:dict) -> tuple:
+    """
+    Adds multipath sections to the content of multipath.conf in one edit.
+    Entries go in front of the "# End of multipath devices" marker, or at the
+    end of the multipaths section if there is no marker.
+
+    Args:
+        content (str): Current content of multipath.conf
+        entries (dict): {wwid: alias}
+
+    Returns:
+        tuple: (new content, [str] WWIDs that were added). WWIDs already in the multipaths section are left alone.
+    """
+    present = get_section_wwids(content, "multipaths")
+    added = [wwid for wwid in entries if wwid not in present]
+    if not added:
+        return content, []
+
+    block = "".join(f"\tmultipath {{\n\t\twwid {wwid}\n\t\talias {entries[wwid]}\n\t}}\n" for wwid in added)
+    markerIndex = content.find(END_MARKER)
+    if markerIndex >= 0:
+        lineStart = content.rfind("\n", 0, markerIndex) + 1
+        return content[:lineStart] + block + content[lineStart:], added
+
+    bounds = find_section(content, "multipaths")
+    if bounds and bounds[1] < len(content):
+        lineStart = content.rfind("\n", 0, bounds[1]) + 1
+        return content[:lineStart] + block + content[lineStart:], added
+
+    if content and not content.endswith("\n"):
+        content += "\n"
+    return content + "multipaths {\n" + block + f"\t{END_MARKER}\n}}\n", added
+
+def write_file_atomic(path:str, content:str, backup:bool=True) -> None:
+    """
+    Replaces a file atomically, keeping the old one as .bak
+
+    Args:
+        path (str): File to replace
+        content (str): New content
+        backup (bool): Keep a copy of the old file
+    """
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmpPath = target.with_name(f".{target.name}.tmp")
+    with open(tmpPath, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    if target.exists():
+        os.chmod(tmpPath, target.stat().st_mode & 0o777)
+        if backup:
+            # A crashed run may have left the temporary link behind
+            try:
+                os.unlink(str(target) + ".bak.tmp")
+            except FileNotFoundError:
+                pass
+            os.link(target, str(target) + ".bak.tmp")
+            os.replace(str(target) + ".bak.tmp", str(target) + ".bak")
+    os.replace(tmpPath, target)
+
+def add_to_wwids_file(content:str, wwids:list) -> str:
+    """
+    Adds WWIDs to the content of /etc/multipath/wwids, what "multipath -a" does one at a time
+
+    Args:
+        content (str): Current content of the wwids file
+        wwids (list): WWIDs to add
+
+    Returns:
+        str: New content
+    """
+    present = set(re.findall(r"^/([^/]+)/", content, re.MULTILINE))
+    if not content:
+        content = "# Multipath wwids, Version : 1.0\n"
+    elif not content.endswith("\n"):
+        content += "\n"
+    return content + "".join(f"/{wwid}/\n" for wwid in wwids if wwid not in present)
+
+def read_file(path:str) -> str:
+    """Reads a text file, empty if it does not exist."""
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+def batch_add(disks:list, configPath:str=CONFIG_PATH, multipathConf:str=MULTIPATH_CONF, wwidsFile:str=WWIDS_FILE,
+              reload:bool=True, dryRun:bool=False) -> bool:
+    """
+    Adds a set of new disks: resolves every WWID in one pass, edits multipath.conf
+    and the wwids file once, registers all volumes in the config in one write and
+    reloads multipathd once.
+
+    Args:
+        disks (list): From parse_disk_spec()
+        configPath (str): Path to Hitachi configuration JSON file
+        multipathConf (str): Path of multipath.conf
+        wwidsFile (str): Path of the multipath wwids file
+        reload (bool): Reload multipathd at the end, otherwise reconcile only the new maps
+        dryRun (bool): Print what would be done without changing anything
+
+    Returns:
+        bool: True if all disks were added, False otherwise
+    """
+    resolved, errors = resolve_wwids(disks, scan_block_devices())
+    configData = readConfigFile(configPath)
+    mountRoot = configData.get("mountRoot", "/mnt")
+    configured = configData.get("multipathData", {}).get("multipathVolumes", {})
+
+    # multipath never builds a map for these, so they must not be registered either
+    currentConf = read_file(multipathConf)
+    blacklisted = get_section_wwids(currentConf, "blacklist")
+    for volume in configData.get("multipathData", {}).get("blacklistedVolumes", []):
+        blacklisted.add(volume.get("scsi_id", volume.get("wwid", "")))
+    errors.extend(f"{disk['disk']} ({disk['wwid']}) is blacklisted" for disk in resolved if disk["wwid"] in blacklisted)
+    for error in errors:
+        print(f"ERROR: {error}")
+    if errors:
+        return False
+
+    # Like install.py: GFS2 needs DLM, a standalone node gets XFS
+    defaultFileSystem = "gfs2" if get_cluster_info().isClusterNode else "xfs"
+
+    volumes = {}
+    aliases = {}
+    for disk in resolved:
+        existing = configured.get(disk["wwid"], {})
+        alias = disk["alias"] or existing.get("alias", existing.get("friendlyName")) or f"hitachi-{disk['wwid'][-6:]}"
+        aliases[disk["wwid"]] = alias
+        if existing:
+            print(f"Volume {disk['wwid']} is already configured as {alias}")
+            continue
+        volume = {"scsi_id": disk["wwid"], "alias": alias, "volumeType": disk["volumeType"]}
+        if disk["volumeType"] == "datastore":
+            fileSystem = disk.get("fileSystem") or defaultFileSystem
+            volume["datastoreInfo"] = {"fileSystem": fileSystem, "mountPoint": f"{mountRoot}/{alias}", "datastoreName": alias}
+            if fileSystem == "gfs2":
+                volume["datastoreInfo"]["performanceProfile"] = "vmImages"
+        volumes[disk["wwid"]] = volume
+
+    multipathContent, added = add_multipath_entries(currentConf, aliases)
+    wwidsContent = add_to_wwids_file(read_file(wwidsFile), list(aliases))
+    for wwid in added:
+        print(f"Adding multipath entry for {wwid} with alias '{aliases[wwid]}'")
+    if dryRun:
+        print(multipathContent)
+        print(json.dumps(volumes, indent=4))
+        return True
+
+    write_file_atomic(multipathConf, multipathContent)
+    write_file_atomic(wwidsFile, wwidsContent, backup=False)
+    if volumes:
+        set_volumes(volumes, configPath)
+        print(f"Registered {len(volumes)} volume(s) in the config")
+
+    if reload:
+        print("Reloading multipath service...")
+        result = subprocess.run(["systemctl", "reload", "multipathd.service"], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: 'systemctl reload multipathd.service' failed: {result.stderr.strip()}")
+            return False
+        return True
+
+    from multipathReconcile import reconcile
+    try:
+        return reconcile(readConfigFile(configPath), onlyWwids=aliases)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adds a set of new disks to multipath and the Hitachi config in one pass.")
+    parser.add_argument("disks", nargs="+", help="device[:alias[:type[:fileSystem]]], e.g. sdb:Proxmox-Vol1:datastore:xfs; a WWID works in place of the device. "
+                        "Datastores default to gfs2 on a cluster node and xfs otherwise")
+    parser.add_argument("--no-reload", action="store_true", help="Reconcile only the new maps instead of reloading multipathd")
+    parser.add_argument("--dry-run", action="store_true", help="Print the changes without making them")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to Hitachi configuration JSON file")
+    parser.add_argument("--multipath-conf", default=MULTIPATH_CONF, help="Path of multipath.conf")
+    args = parser.parse_args()
+
+    try:
+        disks = [parse_disk_spec(spec) for spec in args.disks]
+    except ValueError as e:
+        parser.error(str(e))
+    sys.exit(0 if batch_add(disks, args.config, args.multipath_conf, reload=not args.no_reload, dryRun=args.dry_run) else 1)
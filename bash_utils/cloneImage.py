@@ -0,0 +1,221 @@
+import os, sys, json, errno, fcntl, struct, argparse, subprocess, tempfile, time
+from pathlib import Path
+
+# From linux/fs.h
+FICLONE = 0x40049409
+FICLONERANGE = 0x4020940d
+
+# Errors meaning the file system (or the pair of files) can not share extents
+REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS)
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+def reflink_file(srcFd:int, dstFd:int) -> bool:
+    """
+    Shares all extents of the source file with the destination file (FICLONE)
+
+    Args:
+        srcFd (int): File descriptor of the source, open for reading
+        dstFd (int): File descriptor of the destination, open for writing
+
+    Returns:
+        bool: True if the file was cloned, False if the file system does not support it
+
+    Raises:
+        OSError: On any other error
+    """
+    try:
+        fcntl.ioctl(dstFd, FICLONE, srcFd)
+        return True
+    except OSError as e:
+        if e.errno in REFLINK_UNSUPPORTED:
+            return False
+        raise
+
+def reflink_range(srcFd:int, dstFd:int, srcOffset:int, length:int, dstOffset:int) -> bool:
+    """
+    Shares a range of extents of the source file with the destination file (FICLONERANGE).
+    Offsets and length must be aligned to the file system block size.
+
+    Args:
+        srcFd (int): File descriptor of the source, open for reading
+        dstFd (int): File descriptor of the destination, open for writing
+        srcOffset (int): Offset in the source
+        length (int): Bytes to clone
+        dstOffset (int): Offset in the destination
+
+    Returns:
+        bool: True if the range was cloned, False if the file system does not support it
+
+    Raises:
+        OSError: On any other error
+    """
+    cloneRange = struct.pack("qQQQ", srcFd, srcOffset, length, dstOffset)
+    try:
+        fcntl.ioctl(dstFd, FICLONERANGE, cloneRange)
+        return True
+    except OSError as e:
+        if e.errno in REFLINK_UNSUPPORTED:
+            return False
+        raise
+
+def copy_range(srcFd:int, dstFd:int, offset:int, length:int) -> None:
+    """
+    Copies a range at the same offset in the kernel with copy_file_range, which
+    lets the file system offload the copy (e.g. server side copy) when it can
+
+    Args:
+        srcFd (int): File descriptor of the source, open for reading
+        dstFd (int): File descriptor of the destination, open for writing
+        offset (int): Offset of the range in both files
+        length (int): Bytes to copy
+    """
+    end = offset + length
+    while offset < end:
+        copied = os.copy_file_range(srcFd, dstFd, min(COPY_CHUNK_SIZE, end - offset), offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+
+def iter_data_extents(fd:int, size:int):
+    """
+    Walks the allocated ranges of a file with SEEK_DATA/SEEK_HOLE. File systems
+    that do not track holes report the whole file as data.
+
+    Args:
+        fd (int): File descriptor of the file
+        size (int): Size of the file
+
+    Yields:
+        tuple: (offset, length) of each data extent
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a hole is left
+                return
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, min(end, size) - start
+        offset = end
+
+def clone_file(srcPath:str, dstPath:str, allowReflink:bool=True) -> str:
+    """
+    Clones an image. Uses a reflink when the file system supports it (XFS with
+    reflink=1), which is near instant regardless of the image size. Otherwise
+    only the data extents are copied with copy_file_range, so holes of a thin
+    image stay holes.
+
+    Args:
+        srcPath (str): Image to clone
+        dstPath (str): New image, must not exist
+        allowReflink (bool): Set to False to force the copy (used by the benchmark)
+
+    Returns:
+        str: Method used, "reflink" or "copy_file_range"
+
+    Raises:
+        OSError: If the clone failed. A partially written destination is removed.
+    """
+    srcFd = os.open(srcPath, os.O_RDONLY)
+    try:
+        size = os.fstat(srcFd).st_size
+        dstFd = os.open(dstPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o640)
+        try:
+            if allowReflink and reflink_file(srcFd, dstFd):
+                method = "reflink"
+            else:
+                method = "copy_file_range"
+                os.ftruncate(dstFd, size)
+                for offset, length in iter_data_extents(srcFd, size):
+                    copy_range(srcFd, dstFd, offset, length)
+            os.fsync(dstFd)
+        except BaseException:
+            os.close(dstFd)
+            os.unlink(dstPath)
+            raise
+        os.close(dstFd)
+    finally:
+        os.close(srcFd)
+    return method
+
+def _run(command:list) -> str:
+    """Runs a command for the benchmark, raising if it fails."""
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"'{' '.join(command)}' failed: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+def run_benchmark(sizeMb:int, workDir:str=None) -> dict:
+    """
+    Compares reflink and copy_file_range clones of a file on a loopback XFS
+    file system created with reflink=1. Needs root.
+
+    Args:
+        sizeMb (int): Size of the test image in MiB
+        workDir (str): Directory for the loopback image, a temporary directory if not given
+
+    Returns:
+        dict: {'sizeMb': int, 'reflinkSeconds': float, 'copySeconds': float}
+    """
+    tmpDir = tempfile.mkdtemp(prefix="hitachi-clone-bench-", dir=workDir)
+    backingFile = Path(tmpDir) / "xfs.img"
+    mountPoint = Path(tmpDir) / "mnt"
+    mountPoint.mkdir()
+    loopDevice = None
+    mounted = False
+    try:
+        with open(backingFile, "wb") as f:
+            f.truncate((sizeMb * 3 + 512) * 1024 * 1024)
+        loopDevice = _run(["losetup", "--find", "--show", str(backingFile)])
+        _run(["mkfs.xfs", "-q", "-m", "reflink=1", loopDevice])
+        _run(["mount", loopDevice, str(mountPoint)])
+        mounted = True
+
+        source = mountPoint / "template.raw"
+        with open(source, "wb") as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(sizeMb):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+
+        results = {"sizeMb": sizeMb}
+        for key, allowReflink in [("reflinkSeconds", True), ("copySeconds", False)]:
+            target = mountPoint / f"clone-{key}.raw"
+            start = time.perf_counter()
+            method = clone_file(str(source), str(target), allowReflink)
+            results[key] = round(time.perf_counter() - start, 4)
+            print(f"{method:<16} {sizeMb} MiB in {results[key]:.4f}s")
+        return results
+    finally:
+        if mounted:
+            subprocess.run(["umount", str(mountPoint)], check=False)
+        if loopDevice:
+            subprocess.run(["losetup", "--detach", loopDevice], check=False)
+        if backingFile.exists():
+            backingFile.unlink()
+        mountPoint.rmdir()
+        os.rmdir(tmpDir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clones VM images with a reflink, falling back to copy_file_range.")
+    parser.add_argument("source", nargs="?", help="Image to clone")
+    parser.add_argument("target", nargs="?", help="New image, must not exist")
+    parser.add_argument("--benchmark", type=int, metavar="SIZE_MB", help="Compare reflink and copy_file_range on a loopback XFS image of this size")
+    parser.add_argument("--work-dir", help="Directory for the benchmark's loopback image")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(run_benchmark(args.benchmark, args.work_dir), indent=4))
+    elif args.source and args.target:
+        try:
+            print(clone_file(args.source, args.target))
+        except OSError as e:
+            print(f"ERROR: Could not clone {args.source} to {args.target}: {e}")
+            sys.exit(1)
+    else:
+        parser.error("source and target are required")
@@ -0,0 +1,233 @@
+import os, sys, json, re, socket, argparse
+from pathlib import Path
+from typing import NamedTuple
+
+PVE_DIR = "/etc/pve"
+
+class ClusterNode(NamedTuple):
+    nodeId: int
+    nodeName: str
+    online: bool
+    ip: str
+    votes: int
+    isLocal: bool
+
+class ClusterInfo(NamedTuple):
+    clusterName: str
+    isClusterNode: bool
+    quorate: bool
+    nodeCount: int
+    expectedVotes: int
+    configVersion: int
+    localNode: str
+    nodes: list
+
+# Parsed corosync.conf keyed on its path and mtime, and the result of the last call keyed
+# on the content it was built from. .members and .version are pmxcfs virtual files whose
+# mtime never changes, so they are read on every call.
+_cache = {"corosyncKey": None, "corosync": None, "key": None, "info": None}
+
+def parse_members(text:str) -> dict:
+    """
+    Parses /etc/pve/.members, the membership view pmxcfs keeps current
+
+    Args:
+        text (str): Content of the .members file
+
+    Returns:
+        dict: The decoded file, empty if it is not valid JSON
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return {}
+
+def parse_corosync_conf(text:str) -> dict:
+    """
+    Parses corosync.conf into nested dictionaries. Sections that appear more
+    than once (e.g. "node") become lists.
+
+    Args:
+        text (str): Content of corosync.conf
+
+    Returns:
+        dict: Parsed configuration
+    """
+    root = {}
+    stack = [root]
+    for line in text.split("\n"):
+        line = re.sub(r"#.*$", "", line).strip()
+        if not line:
+            continue
+        if line.endswith("{"):
+            name = line[:-1].strip()
+            section = {}
+            parent = stack[-1]
+            if name in parent:
+                if not isinstance(parent[name], list):
+                    parent[name] = [parent[name]]
+                parent[name].append(section)
+            else:
+                parent[name] = section
+            stack.append(section)
+        elif line == "}":
+            if len(stack) > 1:
+                stack.pop()
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            stack[-1][key.strip()] = value.strip()
+    return root
+
+def build_cluster_info(members:dict, corosync:dict, versions:dict, hostname:str=None) -> ClusterInfo:
+    """
+    Combines the parsed cluster files into a ClusterInfo
+
+    Args:
+        members (dict): Parsed .members
+        corosync (dict): Parsed corosync.conf
+        versions (dict): Parsed .version
+        hostname (str): Name of this node if .members does not name it
+
+    Returns:
+        ClusterInfo: Cluster information with one ClusterNode per configured node
+    """
+    localNode = members.get("nodename", hostname or socket.gethostname())
+    cluster = members.get("cluster", {})
+
+    # corosync.conf knows every configured node and its votes, .members knows who is online
+    configuredNodes = corosync.get("nodelist", {}).get("node", [])
+    if isinstance(configuredNodes, dict):
+        configuredNodes = [configuredNodes]
+    memberNodes = members.get("nodelist", {})
+
+    nodes = []
+    seen = set()
+    for node in configuredNodes:
+        name = node.get("name", "")
+        member = memberNodes.get(name, {})
+        nodes.append(ClusterNode(
+            nodeId=int(node.get("nodeid", member.get("id", 0))),
+            nodeName=name,
+            online=bool(member.get("online", 0)),
+            ip=member.get("ip", node.get("ring0_addr", "")),
+            votes=int(node.get("quorum_votes", 1)),
+            isLocal=name == localNode
+        ))
+        seen.add(name)
+    for name, member in memberNodes.items():
+        if name not in seen:
+            nodes.append(ClusterNode(int(member.get("id", 0)), name, bool(member.get("online", 0)),
+                                     member.get("ip", ""), 1, name == localNode))
+    nodes.sort(key=lambda node: node.nodeId)
+
+    totem = corosync.get("totem", {})
+    quorum = corosync.get("quorum", {})
+    return ClusterInfo(
+        clusterName=cluster.get("name", totem.get("cluster_name", "")),
+        isClusterNode="cluster" in members or "totem" in corosync,
+        quorate=bool(cluster.get("quorate", 0)),
+        nodeCount=len(nodes),
+        expectedVotes=int(quorum.get("expected_votes", sum(node.votes for node in nodes))),
+        configVersion=int(totem.get("config_version", versions.get("corosync.conf", 0))),
+        localNode=localNode,
+        nodes=nodes
+    )
+
+def get_cluster_info(pveDir:str=PVE_DIR) -> ClusterInfo:
+    """
+    Gets the cluster membership and quorum of this node straight from the
+    pmxcfs files, without forking pvecm. Only corosync.conf is cached, the
+    small membership files are read on every call so online and quorate are current.
+
+    Args:
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        ClusterInfo: Cluster information
+    """
+    def read(path):
+        try:
+            with open(path, "r") as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    corosyncPath = Path(pveDir) / "corosync.conf"
+    try:
+        stat = os.stat(corosyncPath)
+        corosyncKey = (str(corosyncPath), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        corosyncKey = (str(corosyncPath), None, None)
+    if _cache["corosyncKey"] != corosyncKey:
+        _cache["corosync"] = parse_corosync_conf(read(corosyncPath))
+        _cache["corosyncKey"] = corosyncKey
+
+    members = read(Path(pveDir) / ".members")
+    versions = read(Path(pveDir) / ".version")
+    key = (corosyncKey, members, versions)
+    if _cache["key"] == key and _cache["info"] is not None:
+        return _cache["info"]
+
+    info = build_cluster_info(parse_members(members), _cache["corosync"], parse_members(versions))
+    _cache["key"] = key
+    _cache["info"] = info
+    return info
+
+def read_vmlist(pveDir:str=PVE_DIR) -> dict:
+    """
+    Reads /etc/pve/.vmlist, where pmxcfs keeps the node of every guest
+
+    Args:
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        dict: {vmid: {'node': str, 'type': str, 'version': int}}, empty if it can not be read
+    """
+    try:
+        with open(Path(pveDir) / ".vmlist", "r") as f:
+            return json.load(f).get("ids", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+def parse_storage_cfg(text:str) -> dict:
+    """
+    Parses /etc/pve/storage.cfg
+
+    Args:
+        text (str): Content of storage.cfg
+
+    Returns:
+        dict: {storeid: {'type': str, <option>: str}}
+    """
+    storages = {}
+    current = None
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        if not line[0].isspace():
+            storageType, _, storeid = line.partition(":")
+            current = storages[storeid.strip()] = {"type": storageType.strip()}
+        elif current is not None:
+            key, _, value = line.strip().partition(" ")
+            current[key] = value.strip()
+    return storages
+
+def cluster_info_to_dict(info:ClusterInfo) -> dict:
+    """
+    Converts a ClusterInfo to plain dictionaries for JSON output
+
+    Args:
+        info (ClusterInfo): Cluster information
+
+    Returns:
+        dict: Cluster information with the nodes as dictionaries
+    """
+    result = info._asdict()
+    result["nodes"] = [node._asdict() for node in info.nodes]
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the Proxmox cluster membership and quorum read from /etc/pve.")
+    parser.add_argument("--pve-dir", default=PVE_DIR, help="Directory of the Proxmox cluster file system")
+    args = parser.parse_args()
+    print(json.dumps(cluster_info_to_dict(get_cluster_info(args.pve_dir)), indent=4))
@@ -0,0 +1,131 @@
+import os, sys, json, argparse
+from pathlib import Path
+
+def _read_sysfs(path:Path) -> str:
+    """Reads a sysfs attribute, returning an empty string if it can not be read."""
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def format_wwn(wwn:str) -> str:
+    """
+    Formats a WWN read from sysfs for display (0x21000024ff123456 -> 21000024FF123456)
+
+    Args:
+        wwn (str): WWN as sysfs reports it
+
+    Returns:
+        str: WWN without the 0x prefix in upper case, empty if unknown
+    """
+    return wwn.replace("0x", "").upper()
+
+def read_fc_hosts(sysfsRoot:str="/sys") -> dict:
+    """
+    Reads the local Fibre Channel HBA ports
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        dict: {scsiHost: {
+            'scsiHost': str,     # e.g. host1
+            'wwpn': str,
+            'wwnn': str,
+            'portState': str,    # Online, Linkdown, ...
+            'speed': str,        # e.g. 16 Gbit
+            'supportedSpeeds': str,
+            'fabricName': str
+        }}
+    """
+    hosts = {}
+    fcHostPath = Path(sysfsRoot) / "class" / "fc_host"
+    if not fcHostPath.exists():
+        return hosts
+
+    for hostDir in sorted(fcHostPath.glob("host*"), key=lambda path: int(path.name[4:])):
+        hosts[hostDir.name] = {
+            "scsiHost": hostDir.name,
+            "wwpn": format_wwn(_read_sysfs(hostDir / "port_name")),
+            "wwnn": format_wwn(_read_sysfs(hostDir / "node_name")),
+            "portState": _read_sysfs(hostDir / "port_state"),
+            "speed": _read_sysfs(hostDir / "speed"),
+            "supportedSpeeds": _read_sysfs(hostDir / "supported_speeds"),
+            "fabricName": format_wwn(_read_sysfs(hostDir / "fabric_name"))
+        }
+    return hosts
+
+def read_fc_host_statistics(scsiHost:str, sysfsRoot:str="/sys") -> dict:
+    """
+    Reads the counters of an HBA port from /sys/class/fc_host/hostN/statistics
+
+    Args:
+        scsiHost (str): SCSI host of the HBA port, e.g. host1
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        dict: {counter: int or None}, keyed by the sysfs file name. Counters the
+              driver does not maintain (all bits set) are None.
+    """
+    statistics = {}
+    statisticsPath = Path(sysfsRoot) / "class" / "fc_host" / scsiHost / "statistics"
+    if not statisticsPath.is_dir():
+        return statistics
+
+    for counterFile in sorted(statisticsPath.iterdir()):
+        value = _read_sysfs(counterFile)
+        try:
+            value = int(value, 0)
+        except ValueError:
+            # reset_statistics is write only
+            continue
+        statistics[counterFile.name] = None if value == 0xffffffffffffffff else value
+    return statistics
+
+def read_fc_remote_ports(sysfsRoot:str="/sys") -> dict:
+    """
+    Reads the remote ports (array target ports) the HBAs are logged in to
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        dict: {rport: {
+            'rport': str,        # e.g. rport-1:0-2
+            'scsiHost': str,     # Local HBA the port is seen through
+            'channel': int,
+            'scsiTargetId': int, # SCSI target number on the host, -1 if the port is no target
+            'wwpn': str,
+            'wwnn': str,
+            'portState': str,
+            'roles': str         # e.g. FCP Target
+        }}
+    """
+    ports = {}
+    rportPath = Path(sysfsRoot) / "class" / "fc_remote_ports"
+    if not rportPath.exists():
+        return ports
+
+    for rportDir in sorted(rportPath.glob("rport-*")):
+        # rport-<host>:<channel>-<number>
+        host, _, rest = rportDir.name[6:].partition(":")
+        channel = rest.split("-")[0]
+        targetId = _read_sysfs(rportDir / "scsi_target_id")
+        ports[rportDir.name] = {
+            "rport": rportDir.name,
+            "scsiHost": "host" + host,
+            "channel": int(channel) if channel.isdigit() else 0,
+            "scsiTargetId": int(targetId) if targetId.lstrip("-").isdigit() else -1,
+            "wwpn": format_wwn(_read_sysfs(rportDir / "port_name")),
+            "wwnn": format_wwn(_read_sysfs(rportDir / "node_name")),
+            "portState": _read_sysfs(rportDir / "port_state"),
+            "roles": _read_sysfs(rportDir / "roles")
+        }
+    return ports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the local Fibre Channel HBA ports and the remote ports they see.")
+    parser.add_argument("--sysfs", default="/sys", help="Root of the sysfs tree")
+    args = parser.parse_args()
+    print(json.dumps({"hosts": read_fc_hosts(args.sysfs), "remotePorts": read_fc_remote_ports(args.sysfs)}, indent=4))
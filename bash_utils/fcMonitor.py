@@ -0,0 +1,235 @@
+import os, sys, json, argparse, time
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+from fcHosts import read_fc_hosts, read_fc_host_statistics
+
+STATE_PATH = "/run/hitachi/fc_monitor_state.json"
+
+# Error counters that point at optics, cabling or a switch port. Maps the
+# config key of the alert threshold to the statistics file.
+ERROR_COUNTERS = {
+    "invalidCrcPerMinute": "invalid_crc_count",
+    "linkFailuresPerMinute": "link_failure_count",
+    "lossOfSyncPerMinute": "loss_of_sync_count",
+    "lossOfSignalPerMinute": "loss_of_signal_count",
+    "invalidTxWordsPerMinute": "invalid_tx_word_count",
+    "errorFramesPerMinute": "error_frames",
+    "dumpedFramesPerMinute": "dumped_frames"
+}
+
+# A healthy link shows none of these, a few CRC errors a minute already means a bad SFP or cable
+DEFAULT_THRESHOLDS = {
+    "invalidCrcPerMinute": 1,
+    "linkFailuresPerMinute": 1,
+    "lossOfSyncPerMinute": 5,
+    "lossOfSignalPerMinute": 1,
+    "invalidTxWordsPerMinute": 60,
+    "errorFramesPerMinute": 10,
+    "dumpedFramesPerMinute": 10
+}
+
+def get_thresholds(configData:dict) -> dict:
+    """
+    Builds the alert thresholds from the "fcMonitor" section of the config,
+    filling in defaults for anything that is not set
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        dict: Thresholds keyed like DEFAULT_THRESHOLDS
+
+    Raises:
+        ValueError: If a threshold is unknown or negative
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    thresholds.update(configData.get("fcMonitor", {}))
+    for key, value in thresholds.items():
+        if key not in DEFAULT_THRESHOLDS:
+            raise ValueError(f"unknown threshold '{key}'")
+        if not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{key} must be a number of at least 0")
+    return thresholds
+
+def take_sample(sysfsRoot:str="/sys") -> dict:
+    """
+    Reads the state and counters of every HBA port
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        dict: {'time': float, 'hosts': {scsiHost: host from read_fc_hosts() plus 'statistics'}}
+    """
+    hosts = read_fc_hosts(sysfsRoot)
+    for name, host in hosts.items():
+        host["statistics"] = read_fc_host_statistics(name, sysfsRoot)
+    return {"time": time.time(), "hosts": hosts}
+
+def _delta(previous:dict, current:dict, counter:str):
+    """Increase of a counter between two samples, None if unknown or the counters were reset."""
+    before = previous.get(counter)
+    after = current.get(counter)
+    if before is None or after is None or after < before:
+        return None
+    return after - before
+
+def compute_rates(previous:dict, current:dict) -> dict:
+    """
+    Computes the per HBA port rates between two samples
+
+    Args:
+        previous (dict): Older sample from take_sample()
+        current (dict): Newer sample from take_sample()
+
+    Returns:
+        dict: {scsiHost: {
+            'seconds': float,
+            'txMBs': float,          # From tx_words, 4 bytes per word
+            'rxMBs': float,
+            'readIops': float,       # From fcp_input_requests
+            'writeIops': float,      # From fcp_output_requests
+            '<threshold key>': float # Errors per minute for each of ERROR_COUNTERS
+        }}, rates are None where a counter is unknown or was reset
+    """
+    seconds = current["time"] - previous["time"]
+    rates = {}
+    if seconds <= 0:
+        return rates
+
+    for name, host in current["hosts"].items():
+        if name not in previous["hosts"]:
+            continue
+        before = previous["hosts"][name].get("statistics", {})
+        after = host.get("statistics", {})
+
+        def per_second(counter, scale=1):
+            delta = _delta(before, after, counter)
+            return None if delta is None else round(delta * scale / seconds, 2)
+
+        hostRates = {
+            "seconds": round(seconds, 2),
+            "txMBs": per_second("tx_words", 4 / 1000000),
+            "rxMBs": per_second("rx_words", 4 / 1000000),
+            "readIops": per_second("fcp_input_requests"),
+            "writeIops": per_second("fcp_output_requests")
+        }
+        for key, counter in ERROR_COUNTERS.items():
+            hostRates[key] = per_second(counter, 60)
+        rates[name] = hostRates
+    return rates
+
+def check_alerts(sample:dict, rates:dict, thresholds:dict) -> list:
+    """
+    Checks the HBA ports against the thresholds
+
+    Args:
+        sample (dict): Current sample from take_sample()
+        rates (dict): From compute_rates()
+        thresholds (dict): From get_thresholds()
+
+    Returns:
+        list: [{'scsiHost': str, 'wwpn': str, 'severity': str, 'message': str}]
+    """
+    alerts = []
+    for name, host in sample["hosts"].items():
+        def alert(severity, message):
+            alerts.append({"scsiHost": name, "wwpn": host["wwpn"], "severity": severity, "message": message})
+
+        if host["portState"] != "Online":
+            alert("critical", f"port state is {host['portState'] or 'unknown'}")
+            continue
+
+        # A link that came up below the port's top speed has a bad SFP or a slower switch port
+        supported = [speed.strip() for speed in host["supportedSpeeds"].split(",") if speed.strip()]
+        if supported and host["speed"] and host["speed"] not in ("unknown", supported[-1]):
+            alert("warning", f"link runs at {host['speed']}, the port supports {supported[-1]}")
+
+        for key, value in rates.get(name, {}).items():
+            if key in thresholds and value is not None and value > thresholds[key]:
+                alert("critical" if key in ("invalidCrcPerMinute", "linkFailuresPerMinute") else "warning",
+                      f"{ERROR_COUNTERS[key]} rises at {value}/min (threshold {thresholds[key]}/min)")
+    return alerts
+
+def read_state(statePath:str=STATE_PATH) -> dict:
+    """Reads the sample saved by the last run, empty if there is none."""
+    try:
+        with open(statePath, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_state(sample:dict, statePath:str=STATE_PATH) -> None:
+    """Saves a sample for the next run."""
+    path = Path(statePath)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmpPath = path.with_name(path.name + ".tmp")
+    with open(tmpPath, "w") as f:
+        json.dump(sample, f)
+    os.replace(tmpPath, path)
+
+def print_rates(sample:dict, rates:dict, alerts:list) -> None:
+    """Prints one line per HBA port and the alerts."""
+    for name, host in sample["hosts"].items():
+        hostRates = rates.get(name, {})
+        values = []
+        for key in ["txMBs", "rxMBs", "readIops", "writeIops", "invalidCrcPerMinute", "linkFailuresPerMinute"]:
+            value = hostRates.get(key)
+            values.append("-" if value is None else f"{value:g}")
+        print(f"{name:<8} {host['wwpn']:<17} {host['portState']:<9} {host['speed']:<9} "
+              f"tx {values[0]} MB/s  rx {values[1]} MB/s  read {values[2]} IOPS  write {values[3]} IOPS  "
+              f"crc {values[4]}/min  link failures {values[5]}/min")
+    for alert in alerts:
+        print(f"{alert['severity'].upper()}: {alert['scsiHost']} ({alert['wwpn']}): {alert['message']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Samples the FC HBA counters and alerts on rising CRC and link error rates. "
+                                                 "Exits with 2 if a critical alert was raised in the last interval, 1 on warnings.")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between samples")
+    parser.add_argument("--count", type=int, default=1, help="Number of intervals to report, 0 to run until interrupted")
+    parser.add_argument("--state-file", help="Compare against the sample saved by the previous run instead of sleeping, for cron and monitoring agents")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of one line per port")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    parser.add_argument("--sysfs", default="/sys", help="Root of the sysfs tree")
+    args = parser.parse_args()
+
+    try:
+        thresholds = get_thresholds(readConfigFile(args.config))
+    except ValueError as e:
+        print(f"ERROR: Invalid fcMonitor section: {e}")
+        sys.exit(1)
+
+    def report(previous, current):
+        rates = compute_rates(previous, current)
+        alerts = check_alerts(current, rates, thresholds)
+        if args.json:
+            print(json.dumps({"time": current["time"], "rates": rates, "alerts": alerts}, indent=4))
+        else:
+            print_rates(current, rates, alerts)
+        return alerts
+
+    alerts = []
+    if args.state_file:
+        previous = read_state(args.state_file)
+        current = take_sample(args.sysfs)
+        write_state(current, args.state_file)
+        if previous:
+            alerts = report(previous, current)
+        else:
+            print(f"First sample saved to {args.state_file}, rates are reported from the next run")
+    else:
+        previous = take_sample(args.sysfs)
+        reported = 0
+        try:
+            while not args.count or reported < args.count:
+                time.sleep(args.interval)
+                current = take_sample(args.sysfs)
+                alerts = report(previous, current)
+                previous = current
+                reported += 1
+        except KeyboardInterrupt:
+            pass
+
+    severities = {alert["severity"] for alert in alerts}
+    sys.exit(2 if "critical" in severities else 1 if severities else 0)
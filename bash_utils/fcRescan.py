@@ -0,0 +1,146 @@
+import sys, json, time, argparse, subprocess, threading
+from pathlib import Path
+
+from fcHosts import read_fc_remote_ports
+
+def read_fc_transport_targets(sysfsRoot:str="/sys") -> set:
+    """
+    Reads the FC targets the SCSI layer already knows from /sys/class/fc_transport
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        set: {(scsiHost, channel, target)}, e.g. ('host1', 0, 2)
+    """
+    targets = set()
+    transportPath = Path(sysfsRoot) / "class" / "fc_transport"
+    if not transportPath.exists():
+        return targets
+    for targetDir in transportPath.glob("target*"):
+        # target<host>:<channel>:<target>
+        parts = targetDir.name[6:].split(":")
+        if len(parts) == 3 and all(part.isdigit() for part in parts):
+            targets.add((f"host{parts[0]}", int(parts[1]), int(parts[2])))
+    return targets
+
+def get_fc_targets(sysfsRoot:str="/sys", hosts:list=None) -> list:
+    """
+    Enumerates the array target ports to scan: online remote ports with the target
+    role, plus targets fc_transport knows about
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+        hosts (list): Only these SCSI hosts (e.g. ['host1']), all if None
+
+    Returns:
+        list: [(scsiHost, channel, target)] sorted
+    """
+    targets = read_fc_transport_targets(sysfsRoot)
+    for port in read_fc_remote_ports(sysfsRoot).values():
+        if port["portState"] == "Online" and "FCP Target" in port["roles"] and port["scsiTargetId"] >= 0:
+            targets.add((port["scsiHost"], port["channel"], port["scsiTargetId"]))
+    return sorted(target for target in targets if hosts is None or target[0] in hosts)
+
+def build_scan_requests(targets:list, lun:int=None) -> dict:
+    """
+    Groups the scan requests per host
+
+    Args:
+        targets (list): From get_fc_targets()
+        lun (int): Only probe this LUN, otherwise the target reports its LUNs
+
+    Returns:
+        dict: {scsiHost: ['<channel> <target> <lun>']}, what the host's scan attribute takes
+    """
+    requests = {}
+    for scsiHost, channel, target in targets:
+        requests.setdefault(scsiHost, []).append(f"{channel} {target} {'-' if lun is None else lun}")
+    return requests
+
+def scan_hosts(requests:dict, sysfsRoot:str="/sys", dryRun:bool=False) -> dict:
+    """
+    Writes the scan requests, one thread per host. A write returns when the scan of
+    that target is done; the kernel serializes scans of one host, so only hosts run in parallel.
+
+    Args:
+        requests (dict): From build_scan_requests()
+        sysfsRoot (str): Root of the sysfs tree
+        dryRun (bool): Only print the requests
+
+    Returns:
+        dict: {scsiHost: {'scanned': int, 'seconds': float, 'errors': [str]}}
+    """
+    results = {}
+
+    def scan(scsiHost, hostRequests):
+        start = time.monotonic()
+        result = {"scanned": 0, "seconds": 0.0, "errors": []}
+        scanPath = Path(sysfsRoot) / "class" / "scsi_host" / scsiHost / "scan"
+        for request in hostRequests:
+            print(f"echo '{request}' > {scanPath}")
+            if dryRun:
+                continue
+            try:
+                with open(scanPath, "w") as f:
+                    f.write(request)
+                result["scanned"] += 1
+            except OSError as e:
+                result["errors"].append(f"{request}: {e.strerror or e}")
+        result["seconds"] = round(time.monotonic() - start, 2)
+        results[scsiHost] = result
+
+    threads = [threading.Thread(target=scan, args=item) for item in requests.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def rescan_fc_targets(sysfsRoot:str="/sys", lun:int=None, hosts:list=None, dryRun:bool=False) -> bool:
+    """
+    Scans the known FC targets for new LUNs without a LIP
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+        lun (int): Only probe this LUN
+        hosts (list): Only these SCSI hosts
+        dryRun (bool): Only print the requests
+
+    Returns:
+        bool: True if targets were found and scanned without errors, False otherwise
+    """
+    targets = get_fc_targets(sysfsRoot, hosts)
+    if not targets:
+        print("No FC targets found")
+        return False
+
+    start = time.monotonic()
+    results = scan_hosts(build_scan_requests(targets, lun), sysfsRoot, dryRun)
+    success = True
+    for scsiHost, result in sorted(results.items()):
+        for error in result["errors"]:
+            print(f"ERROR: {scsiHost}: {error}")
+            success = False
+        print(f"{scsiHost}: {result['scanned']} target(s) scanned in {result['seconds']}s")
+    if not dryRun:
+        try:
+            subprocess.run(["udevadm", "settle", "--timeout=30"], capture_output=True)
+        except OSError:
+            pass
+    print(f"Scanned {len(targets)} target(s) on {len(results)} host(s) in {time.monotonic() - start:.1f}s")
+    return success
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scans the known FC array targets for new LUNs, one thread per HBA and without a LIP.")
+    parser.add_argument("--lun", type=int, help="Only probe this LUN number instead of asking the targets for their LUNs")
+    parser.add_argument("--host", action="append", help="Only scan this SCSI host, e.g. host1 (may be repeated)")
+    parser.add_argument("--list", action="store_true", help="Print the targets that would be scanned")
+    parser.add_argument("--dry-run", action="store_true", help="Print the scan requests without writing them")
+    parser.add_argument("--sysfs", default="/sys", help="Root of the sysfs tree")
+    args = parser.parse_args()
+
+    if args.list:
+        print(json.dumps(get_fc_targets(args.sysfs, args.host), indent=4))
+        sys.exit(0)
+    sys.exit(0 if rescan_fc_targets(args.sysfs, args.lun, args.host, args.dry_run) else 1)
@@ -0,0 +1,323 @@
+import os, sys, json, math, argparse
+from pathlib import Path
+
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+TIB = 1024 * GIB
+
+# Per-datastore performance profiles, selected by "performanceProfile" in datastoreInfo.
+#   targetResourceGroups: Resource group count the -r size aims for. Fewer, larger resource
+#       groups mean fewer rgrp glocks to bounce between nodes when allocating big images.
+#   journalHeadroom: Fraction of the node count added as spare journals for node additions
+#   gfs2MountOptions: Mount options used on top of _netdev and acl
+GFS2_PROFILES = {
+    "vmImages": {
+        "targetResourceGroups": 1024,
+        "journalHeadroom": 0.5,
+        "gfs2MountOptions": ["noatime", "quota=off", "statfs_quantum=60", "statfs_percent=10", "rgrplvb"]
+    },
+    "backup": {
+        "targetResourceGroups": 1024,
+        "journalHeadroom": 0.25,
+        "gfs2MountOptions": ["noatime", "quota=off", "statfs_quantum=30", "statfs_percent=5"]
+    },
+    "general": {
+        "targetResourceGroups": 4096,
+        "journalHeadroom": 0.25,
+        "gfs2MountOptions": ["relatime", "quota=off"]
+    }
+}
+DEFAULT_PROFILE = "vmImages"
+
+# Hitachi Dynamic Provisioning allocates pool capacity in 42 MiB pages. XFS allocation
+# groups are aligned to it so no allocation group boundary splits a page.
+HITACHI_PAGE_SIZE = 42 * MIB
+
+# Limits from mkfs.xfs(8)
+XFS_MAX_AG_SIZE = TIB
+XFS_MIN_AG_SIZE = 16 * MIB
+XFS_MIN_LOG_SIZE = 64 * MIB
+XFS_MAX_LOG_SIZE = GIB
+XFS_MAX_LOG_STRIPE_UNIT = 256 * 1024
+
+# Limits from mkfs.gfs2(8)
+GFS2_MIN_RG_MB = 32
+GFS2_MAX_RG_MB = 2048
+GFS2_MIN_JOURNAL_MB = 8
+GFS2_MAX_JOURNAL_MB = 1024
+# The journals are never allowed to take more than this share of the LUN
+GFS2_MAX_JOURNAL_SHARE = 0.02
+
+def get_profile(profileName:str=None) -> dict:
+    """
+    Gets a datastore performance profile by name
+
+    Args:
+        profileName (str): Name of the profile. Default profile is used if not given.
+
+    Returns:
+        dict: The performance profile
+
+    Raises:
+        ValueError: If the profile does not exist
+    """
+    profileName = profileName or DEFAULT_PROFILE
+    if profileName not in GFS2_PROFILES:
+        raise ValueError(f"Unknown performance profile '{profileName}'. Use one of: {', '.join(GFS2_PROFILES.keys())}")
+    return GFS2_PROFILES[profileName]
+
+def get_block_device_size(devicePath:str, sysfsRoot:str="/sys") -> int:
+    """
+    Gets the size of a block device in bytes from sysfs
+
+    Args:
+        devicePath (str): Path of the device (e.g. /dev/mapper/vol1)
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        int: Size of the device in bytes, 0 if it could not be read
+    """
+    kernelName = Path(os.path.realpath(devicePath)).name
+    sizeFile = Path(sysfsRoot) / "class" / "block" / kernelName / "size"
+    try:
+        with open(sizeFile, "r") as f:
+            # Size is always reported in 512 byte sectors
+            return int(f.read().strip()) * 512
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read size of {devicePath}: {e}")
+        return 0
+
+def _next_power_of_two(value:float) -> int:
+    """Returns the smallest power of two that is >= value."""
+    if value <= 1:
+        return 1
+    return 1 << math.ceil(math.log2(value))
+
+def calculate_gfs2_mkfs_parameters(lunSizeBytes:int, nodeCount:int, profileName:str=None) -> dict:
+    """
+    Calculates the mkfs.gfs2 parameters for a LUN from its size and the cluster size
+
+    Args:
+        lunSizeBytes (int): Size of the LUN in bytes
+        nodeCount (int): Number of nodes in the cluster
+        profileName (str): Datastore performance profile
+
+    Returns:
+        dict: {
+            'journals': int,        # -j
+            'journalSizeMb': int,   # -J
+            'resourceGroupSizeMb': int,  # -r
+            'blockSize': int        # -b
+        }
+    """
+    profile = get_profile(profileName)
+    nodeCount = max(nodeCount, 1)
+
+    # Spare journals so nodes can be added without gfs2_jadd on a full file system
+    journals = nodeCount + max(1, math.ceil(nodeCount * profile["journalHeadroom"]))
+
+    # Journal size grows with the LUN, then shrinks if the journals would eat too much of a small LUN
+    if lunSizeBytes < 100 * GIB:
+        journalSizeMb = 32
+    elif lunSizeBytes < TIB:
+        journalSizeMb = 128
+    elif lunSizeBytes < 10 * TIB:
+        journalSizeMb = 256
+    else:
+        journalSizeMb = 512
+    if lunSizeBytes > 0:
+        maxJournalSizeMb = int(lunSizeBytes * GFS2_MAX_JOURNAL_SHARE / journals / MIB)
+        journalSizeMb = min(journalSizeMb, maxJournalSizeMb)
+    journalSizeMb = max(GFS2_MIN_JOURNAL_MB, min(journalSizeMb, GFS2_MAX_JOURNAL_MB))
+
+    # Resource group size is a power of two aiming for the profile's resource group count
+    resourceGroupSizeMb = _next_power_of_two(lunSizeBytes / MIB / profile["targetResourceGroups"])
+    resourceGroupSizeMb = max(GFS2_MIN_RG_MB, min(resourceGroupSizeMb, GFS2_MAX_RG_MB))
+
+    # GFS2 can not use blocks larger than the page size. OPEN-V LUNs report 512 B logical
+    # blocks, so a 4K block is always a whole number of them.
+    blockSize = min(os.sysconf("SC_PAGE_SIZE"), 4096)
+
+    return {
+        "journals": journals,
+        "journalSizeMb": journalSizeMb,
+        "resourceGroupSizeMb": resourceGroupSizeMb,
+        "blockSize": blockSize
+    }
+
+def build_gfs2_mkfs_command(clusterName:str, fsName:str, devicePath:str, params:dict) -> str:
+    """
+    Builds the mkfs.gfs2 command for the given parameters
+
+    Args:
+        clusterName (str): Name of the Proxmox cluster
+        fsName (str): Name of the file system in the lock table
+        devicePath (str): Device to format
+        params (dict): Parameters from calculate_gfs2_mkfs_parameters()
+
+    Returns:
+        str: mkfs.gfs2 command
+    """
+    return f"mkfs.gfs2 -O -t {clusterName}:{fsName} -j {params['journals']} -J {params['journalSizeMb']} " \
+        f"-r {params['resourceGroupSizeMb']} -b {params['blockSize']} {devicePath}"
+
+def get_gfs2_mount_options(profileName:str=None) -> str:
+    """
+    Gets the mount options of a GFS2 datastore for its performance profile
+
+    Args:
+        profileName (str): Datastore performance profile
+
+    Returns:
+        str: Comma separated mount options
+    """
+    profile = get_profile(profileName)
+    # Datastores mounted by earlier installs with acl rely on their POSIX ACLs
+    return ",".join(["_netdev", "acl"] + profile["gfs2MountOptions"])
+
+def read_queue_topology(devicePath:str, sysfsRoot:str="/sys") -> dict:
+    """
+    Reads the I/O topology the device reports in /sys/block/<dm-*>/queue
+
+    Args:
+        devicePath (str): Path of the device (e.g. /dev/mapper/vol1)
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        dict: {
+            'device': str,             # Kernel name, e.g. dm-3
+            'sizeBytes': int,
+            'minimumIoSize': int,
+            'optimalIoSize': int,
+            'physicalBlockSize': int,
+            'logicalBlockSize': int
+        }
+    """
+    kernelName = Path(os.path.realpath(devicePath)).name
+    queuePath = Path(sysfsRoot) / "block" / kernelName / "queue"
+    topology = {
+        "device": kernelName,
+        "sizeBytes": get_block_device_size(devicePath, sysfsRoot)
+    }
+    for key, attribute in [("minimumIoSize", "minimum_io_size"), ("optimalIoSize", "optimal_io_size"),
+                           ("physicalBlockSize", "physical_block_size"), ("logicalBlockSize", "logical_block_size")]:
+        try:
+            with open(queuePath / attribute, "r") as f:
+                topology[key] = int(f.read().strip())
+        except (OSError, ValueError):
+            topology[key] = 0
+    return topology
+
+def calculate_xfs_geometry(topology:dict, cpuCount:int=None, pageSizeBytes:int=HITACHI_PAGE_SIZE) -> dict:
+    """
+    Derives the XFS geometry of a standalone datastore from the device topology,
+    its size and the CPU count
+
+    Args:
+        topology (dict): Device topology from read_queue_topology()
+        cpuCount (int): Number of CPUs. Taken from the system if not given.
+        pageSizeBytes (int): Hitachi pool page size
+
+    Returns:
+        dict: {
+            'stripeUnitBytes': int,   # 0 if the device reports no stripe geometry
+            'stripeWidth': int,       # Stripe units per stripe
+            'agCount': int,
+            'agSizeBytes': int,
+            'logSizeBytes': int,
+            'logStripeUnitBytes': int,
+            'pageSizeBytes': int,
+            'mountOptions': str
+        } plus the topology values the geometry was derived from
+    """
+    cpuCount = cpuCount or os.cpu_count() or 1
+    sizeBytes = topology["sizeBytes"]
+    blockSize = max(topology.get("physicalBlockSize", 0), topology.get("logicalBlockSize", 0), 4096)
+
+    # Stripe unit/width from the reported minimum and optimal I/O sizes
+    minimumIoSize = topology.get("minimumIoSize", 0)
+    optimalIoSize = topology.get("optimalIoSize", 0)
+    stripeUnit = 0
+    stripeWidth = 0
+    if minimumIoSize > blockSize and minimumIoSize % blockSize == 0:
+        stripeUnit = minimumIoSize
+        if optimalIoSize > minimumIoSize and optimalIoSize % minimumIoSize == 0:
+            stripeWidth = optimalIoSize // minimumIoSize
+        else:
+            stripeWidth = 1
+    elif optimalIoSize > blockSize and optimalIoSize % blockSize == 0:
+        stripeUnit = optimalIoSize
+        stripeWidth = 1
+
+    # One allocation group per CPU so parallel writers do not contend, within the XFS AG size limits
+    agCount = max(4, cpuCount, math.ceil(sizeBytes / XFS_MAX_AG_SIZE))
+    alignment = math.lcm(blockSize, pageSizeBytes, stripeUnit * stripeWidth or blockSize)
+    agSize = min(sizeBytes // agCount, XFS_MAX_AG_SIZE - blockSize)
+    agSize = agSize // alignment * alignment
+    if agSize < XFS_MIN_AG_SIZE:
+        # Too small to align to the page size, leave it to mkfs.xfs
+        agSize = 0
+    else:
+        agCount = math.ceil(sizeBytes / agSize)
+
+    # Log grows with the file system, 1 MiB per GiB
+    logSize = sizeBytes // 1024 // MIB * MIB
+    logSize = max(XFS_MIN_LOG_SIZE, min(logSize, XFS_MAX_LOG_SIZE))
+    logStripeUnit = stripeUnit if 0 < stripeUnit <= XFS_MAX_LOG_STRIPE_UNIT else 0
+
+    mountOptions = ["_netdev", "noatime", "inode64", "logbsize=256k"]
+    if stripeUnit:
+        mountOptions.append("swalloc")
+    if optimalIoSize:
+        mountOptions.append("largeio")
+
+    geometry = dict(topology)
+    geometry.update({
+        "stripeUnitBytes": stripeUnit,
+        "stripeWidth": stripeWidth,
+        "agCount": agCount,
+        "agSizeBytes": agSize,
+        "logSizeBytes": logSize,
+        "logStripeUnitBytes": logStripeUnit,
+        "pageSizeBytes": pageSizeBytes,
+        "mountOptions": ",".join(mountOptions)
+    })
+    return geometry
+
+def build_xfs_mkfs_command(devicePath:str, geometry:dict) -> str:
+    """
+    Builds the mkfs.xfs command for the given geometry
+
+    Args:
+        devicePath (str): Device to format
+        geometry (dict): Geometry from calculate_xfs_geometry()
+
+    Returns:
+        str: mkfs.xfs command
+    """
+    dataOptions = []
+    if geometry["agSizeBytes"]:
+        dataOptions.append(f"agsize={geometry['agSizeBytes']}")
+    else:
+        dataOptions.append(f"agcount={geometry['agCount']}")
+    if geometry["stripeUnitBytes"]:
+        dataOptions.append(f"su={geometry['stripeUnitBytes']}")
+        dataOptions.append(f"sw={geometry['stripeWidth']}")
+
+    logOptions = [f"size={geometry['logSizeBytes']}"]
+    if geometry["logStripeUnitBytes"]:
+        logOptions.append(f"su={geometry['logStripeUnitBytes']}")
+
+    # reflink is needed for fast clones of VM images
+    return f"mkfs.xfs -m reflink=1 -d {','.join(dataOptions)} -l {','.join(logOptions)} {devicePath}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculates file system creation and mount parameters for Hitachi datastores.")
+    parser.add_argument("--size", type=float, required=True, help="LUN size in GiB")
+    parser.add_argument("--nodes", type=int, default=1, help="Number of cluster nodes")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=GFS2_PROFILES.keys(), help="Datastore performance profile")
+    args = parser.parse_args()
+
+    params = calculate_gfs2_mkfs_parameters(int(args.size * GIB), args.nodes, args.profile)
+    params["mountOptions"] = get_gfs2_mount_options(args.profile)
+    print(json.dumps(params, indent=4))
@@ -15,16 +15,37 @@ def main() -> None:
         pass
         generate_multipath_config()
 
-def generate_multipath_config()->dict:
+def generate_multipath_config(multipathConfig:dict=None)->dict:
     """
     Generates a default multipath configuration dictionary.
     
+    Args:
+        multipathConfig (dict): Hitachi configuration, read from the config file if not given
+
     Returns:
         dict: The default multipath configuration
     """
-    lines = []
+    if multipathConfig is None:
+        multipathConfig = readConfigFile()
+    content = build_multipath_config(multipathConfig)
+    print(content)
+
+    filename = "/root/hitachi/multipath.conf"
+    write_multipath_config(content, filename)
     
-    multipathConfig = readConfigFile()
+    # return multipath_config
+
+def build_multipath_config(multipathConfig:dict)->str:
+    """
+    Builds the content of multipath.conf from the Hitachi configuration
+
+    Args:
+        multipathConfig (dict): Hitachi configuration
+
+    Returns:
+        str: Content of multipath.conf
+    """
+    lines = []
 
     defaultsSection = {
         "polling_interval": 10,
@@ -71,8 +92,8 @@ def generate_multipath_config()->dict:
     lines.append("blacklist {")
     lines.append('\tdevnode "^sd[a-z]"')
     lines.append('\tdevnode "^hd[a-z]"')
-    for entry in multipathConfig["multipathData"]["blacklistedVolumes"]:
-        lines.append(f"\twwid {entry['wwid']}")
+    for entry in multipathConfig["multipathData"].get("blacklistedVolumes", []):
+        lines.append(f"\twwid {entry.get('wwid', entry.get('scsi_id'))}")
     lines.append("}")
 
     # Add Multipaths section to lines
@@ -80,8 +101,8 @@ def generate_multipath_config()->dict:
     for key, _ in multipathConfig["multipathData"]["multipathVolumes"].items():
         volume = multipathConfig["multipathData"]["multipathVolumes"][key]
         lines.append("\tmultipath {")
-        lines.append(f"\t\twwid {volume['wwid']}")
-        lines.append(f"\t\talias {volume['friendlyName']}")
+        lines.append(f"\t\twwid {volume.get('wwid', key)}")
+        lines.append(f"\t\talias {volume.get('alias', volume.get('friendlyName'))}")
         lines.append("\t}")
     lines.append("\t# End of multipath devices")
     lines.append("}")
@@ -94,9 +115,16 @@ def generate_multipath_config()->dict:
     lines.append("\t}")
     lines.append("}\n")
 
-    print("\n".join(lines))
+    return "\n".join(lines)
 
-    filename = "/root/hitachi/multipath.conf"
+def write_multipath_config(content:str, filename:str="/etc/multipath.conf")->None:
+    """
+    Writes multipath.conf, keeping a backup of the previous file
+
+    Args:
+        content (str): Content of multipath.conf
+        filename (str): Path of multipath.conf
+    """
     backup_filename = filename + ".bak"
 
     # Make backup of multipath.conf file first
@@ -108,9 +136,7 @@ def generate_multipath_config()->dict:
         
     # Write to file (overwrite)
     with open(filename, "w") as f:
-        f.write("\n".join(lines))
-    
-    # return multipath_config
+        f.write(content)
 
 
 def readConfigFile()->dict:
@@ -0,0 +1,281 @@
+import os, sys, json, argparse, subprocess
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+
+# Defaults tuned for all-flash VSP arrays. The array does its own scheduling
+# and read ahead, so the host should pass requests through as fast as possible.
+DEFAULT_BLOCK_TUNING = {
+    "scheduler": "none",
+    "nrRequests": 256,
+    "maxSectorsKb": 1024,
+    "readAheadKb": 512,
+    "rotational": 0
+}
+
+# Maps the config keys of the "blockTuning" section to the sysfs queue attributes
+QUEUE_ATTRIBUTES = {
+    "scheduler": "scheduler",
+    "nrRequests": "nr_requests",
+    "maxSectorsKb": "max_sectors_kb",
+    "readAheadKb": "read_ahead_kb",
+    "rotational": "rotational"
+}
+
+VALID_SCHEDULERS = ["none", "mq-deadline", "kyber", "bfq"]
+
+def main(configPath:str, rulesPath:str, writeRules:bool=True, applyLive:bool=False) -> int:
+    configData = readConfigFile(configPath)
+    if not configData:
+        print("ERROR: No Hitachi configuration found. Exiting...")
+        return 1
+
+    try:
+        globalTuning = get_block_tuning(configData)
+    except ValueError as e:
+        print(f"ERROR: Invalid blockTuning section: {e}")
+        return 1
+
+    volumeTunings = get_volume_block_tunings(configData, globalTuning)
+    rules = generate_udev_rules(globalTuning, volumeTunings)
+    print(rules)
+
+    if writeRules:
+        if not write_udev_rules(rules, rulesPath):
+            return 1
+
+    if applyLive:
+        changed = apply_block_tuning_live(globalTuning, volumeTunings)
+        print(f"Applied {changed} queue setting(s) through sysfs")
+
+    return 0
+
+def get_block_tuning(configData:dict, overrides:dict=None) -> dict:
+    """
+    Builds the block queue tuning values from the "blockTuning" section of the config,
+    filling in defaults for anything that is not set.
+
+    Args:
+        configData (dict): Hitachi configuration
+        overrides (dict): Optional per-volume values layered on top of the global section
+
+    Returns:
+        dict: Tuning values keyed like DEFAULT_BLOCK_TUNING
+
+    Raises:
+        ValueError: If a value is not valid for its queue attribute
+    """
+    tuning = dict(DEFAULT_BLOCK_TUNING)
+    tuning.update(configData.get("blockTuning", {}))
+    if overrides:
+        tuning.update(overrides)
+
+    for key in tuning.keys():
+        if key not in QUEUE_ATTRIBUTES:
+            raise ValueError(f"unknown setting '{key}'")
+
+    if tuning["scheduler"] not in VALID_SCHEDULERS:
+        raise ValueError(f"scheduler must be one of {', '.join(VALID_SCHEDULERS)}")
+    for key in ["nrRequests", "maxSectorsKb", "readAheadKb"]:
+        if not isinstance(tuning[key], int) or tuning[key] <= 0:
+            raise ValueError(f"{key} must be a positive integer")
+    if tuning["rotational"] not in [0, 1]:
+        raise ValueError("rotational must be 0 or 1")
+
+    return tuning
+
+def get_volume_block_tunings(configData:dict, globalTuning:dict) -> dict:
+    """
+    Gets the tuning values for every multipath volume in the config.
+    A volume may carry its own "blockTuning" section to override the global values.
+
+    Args:
+        configData (dict): Hitachi configuration
+        globalTuning (dict): Tuning values from get_block_tuning()
+
+    Returns:
+        dict: {wwid: {"alias": str, "tuning": dict, "override": bool}}
+    """
+    volumeTunings = {}
+    volumes = configData.get("multipathData", {}).get("multipathVolumes", {})
+    for wwid, volume in volumes.items():
+        overrides = volume.get("blockTuning", {})
+        try:
+            tuning = get_block_tuning({"blockTuning": globalTuning}, overrides)
+        except ValueError as e:
+            print(f"Warning: Ignoring blockTuning of volume {wwid}: {e}")
+            tuning = globalTuning
+            overrides = {}
+        volumeTunings[wwid] = {
+            "alias": volume.get("alias", volume.get("friendlyName", "")),
+            "tuning": tuning,
+            "override": len(overrides) > 0
+        }
+    return volumeTunings
+
+def _udev_assignments(tuning:dict) -> str:
+    """Formats tuning values as udev ATTR assignments."""
+    assignments = []
+    for key, attribute in QUEUE_ATTRIBUTES.items():
+        assignments.append(f'ATTR{{queue/{attribute}}}="{tuning[key]}"')
+    return ", ".join(assignments)
+
+def generate_udev_rules(globalTuning:dict, volumeTunings:dict) -> str:
+    """
+    Generates the udev rules file content for the Hitachi sd paths and the
+    multipath dm devices built on top of them.
+
+    Args:
+        globalTuning (dict): Tuning values applied to every Hitachi OPEN-V path
+        volumeTunings (dict): Per-volume tuning from get_volume_block_tunings()
+
+    Returns:
+        str: Content of the udev rules file
+    """
+    sdMatch = 'ACTION=="add|change", SUBSYSTEM=="block", ENV{DEVTYPE}=="disk", KERNEL=="sd*"'
+    dmMatch = 'ACTION=="add|change", SUBSYSTEM=="block", KERNEL=="dm-*"'
+
+    lines = []
+    lines.append("# Generated by generateUdevRules.py from hitachi_config.json. Do not edit by hand.")
+    lines.append("")
+    lines.append("# All Hitachi OPEN-V SCSI paths")
+    lines.append(f'{sdMatch}, ATTRS{{vendor}}=="HITACHI*", ATTRS{{model}}=="OPEN-V*", {_udev_assignments(globalTuning)}')
+
+    # Paths of volumes with their own tuning are matched again by WWID so they win over the generic rule
+    for wwid, volume in volumeTunings.items():
+        if volume["override"]:
+            lines.append(f'{sdMatch}, ENV{{ID_SERIAL}}=="{wwid}", {_udev_assignments(volume["tuning"])}')
+
+    lines.append("")
+    lines.append("# Multipath devices of the configured Hitachi volumes")
+    for wwid, volume in volumeTunings.items():
+        lines.append(f"# {volume['alias']}")
+        lines.append(f'{dmMatch}, ENV{{DM_UUID}}=="mpath-{wwid}", {_udev_assignments(volume["tuning"])}')
+
+    return "\n".join(lines) + "\n"
+
+def write_udev_rules(rules:str, rulesPath:str) -> bool:
+    """
+    Writes the udev rules file and reloads the udev rules.
+
+    Args:
+        rules (str): Content of the udev rules file
+        rulesPath (str): Path of the rules file to write
+
+    Returns:
+        bool: True if the rules were written and reloaded, False otherwise
+    """
+    rulesFile = Path(rulesPath)
+    tmpFile = rulesFile.with_name(rulesFile.name + ".tmp")
+    try:
+        with open(tmpFile, "w") as f:
+            f.write(rules)
+        os.replace(tmpFile, rulesFile)
+        print(f"Wrote udev rules to {rulesFile}")
+    except Exception as e:
+        print(f"ERROR: Could not write udev rules to {rulesFile}: {e}")
+        return False
+
+    result = subprocess.run(["udevadm", "control", "--reload"], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Warning: Could not reload udev rules: {result.stderr.strip()}")
+        return False
+    return True
+
+def _read_sysfs(path:Path) -> str:
+    """Reads a sysfs attribute, returning an empty string if it can not be read."""
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def _write_queue_attribute(queuePath:Path, attribute:str, value) -> bool:
+    """
+    Writes a single queue attribute if it differs from the current value.
+
+    Returns:
+        bool: True if the attribute was changed, False otherwise
+    """
+    attributePath = queuePath / attribute
+    current = _read_sysfs(attributePath)
+
+    if attribute == "scheduler":
+        # Content looks like "[mq-deadline] kyber none", the active one is in brackets
+        if f"[{value}]" in current:
+            return False
+        if str(value) not in current.replace("[", "").replace("]", "").split():
+            print(f"Warning: Scheduler '{value}' is not available for {queuePath.parent.name}")
+            return False
+    elif attribute == "max_sectors_kb":
+        maxHwSectorsKb = _read_sysfs(queuePath / "max_hw_sectors_kb")
+        if maxHwSectorsKb.isdigit():
+            value = min(int(value), int(maxHwSectorsKb))
+        if current == str(value):
+            return False
+    elif current == str(value):
+        return False
+
+    try:
+        with open(attributePath, "w") as f:
+            f.write(str(value))
+        return True
+    except OSError as e:
+        print(f"Warning: Could not set {attribute}={value} on {queuePath.parent.name}: {e}")
+        return False
+
+def apply_block_tuning_live(globalTuning:dict, volumeTunings:dict, sysfsRoot:str="/sys") -> int:
+    """
+    Applies the tuning values to the running system through sysfs, so the
+    settings take effect without a reboot or re-trigger of udev.
+
+    Args:
+        globalTuning (dict): Tuning values applied to every Hitachi OPEN-V path
+        volumeTunings (dict): Per-volume tuning from get_volume_block_tunings()
+        sysfsRoot (str): Root of the sysfs tree
+
+    Returns:
+        int: Number of queue attributes that were changed
+    """
+    changed = 0
+    blockPath = Path(sysfsRoot) / "block"
+    if not blockPath.exists():
+        print(f"ERROR: {blockPath} does not exist")
+        return changed
+
+    for device in sorted(blockPath.iterdir()):
+        tuning = None
+        if device.name.startswith("sd"):
+            vendor = _read_sysfs(device / "device" / "vendor")
+            model = _read_sysfs(device / "device" / "model")
+            if not vendor.startswith("HITACHI") or not model.startswith("OPEN-V"):
+                continue
+            tuning = globalTuning
+            wwid = _read_sysfs(device / "device" / "wwid")
+            if wwid.startswith("naa."):
+                wwid = "3" + wwid[4:]
+            if wwid in volumeTunings and volumeTunings[wwid]["override"]:
+                tuning = volumeTunings[wwid]["tuning"]
+        elif device.name.startswith("dm-"):
+            dmUuid = _read_sysfs(device / "dm" / "uuid")
+            if not dmUuid.startswith("mpath-") or dmUuid[6:] not in volumeTunings:
+                continue
+            tuning = volumeTunings[dmUuid[6:]]["tuning"]
+        else:
+            continue
+
+        for key, attribute in QUEUE_ATTRIBUTES.items():
+            if _write_queue_attribute(device / "queue", attribute, tuning[key]):
+                print(f"Set {device.name} {attribute}={tuning[key]}")
+                changed += 1
+
+    return changed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates udev rules for block queue tuning of Hitachi LUNs.")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    parser.add_argument("--rules", default="/etc/udev/rules.d/99-hitachi-block-tuning.rules", help="Path of the udev rules file to write")
+    parser.add_argument("--no-write", action="store_true", help="Only print the rules, do not write them")
+    parser.add_argument("--apply-live", action="store_true", help="Also apply the values to the running system through sysfs")
+    args = parser.parse_args()
+    sys.exit(main(args.config, args.rules, not args.no_write, args.apply_live))
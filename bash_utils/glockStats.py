@@ -0,0 +1,208 @@
+import os, sys, json, re, heapq, argparse
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+
+DEBUGFS_ROOT = "/sys/kernel/debug"
+DEFAULT_TOP = 20
+
+# Glock types from the kernel's fs/gfs2/glock.h
+GLOCK_TYPES = {1: "trans", 2: "inode", 3: "rgrp", 4: "meta", 5: "iopen", 6: "flock", 8: "quota", 9: "journal"}
+INODE_GLOCK_TYPES = (2, 5)
+
+SORT_KEYS = {
+    # Blocking DLM round trip time times the DLM requests, an estimate of the time spent waiting for the lock
+    "wait": lambda glock: (glock["waitNs"], glock["dlmRequests"]),
+    # Every DLM request of a contended glock follows a demote on another node
+    "demotes": lambda glock: (glock["dlmRequests"], glock["waitNs"])
+}
+
+# G: n:2/5d2b3 rtt:1456/376 rttb:10294/2189 irt:130521/40128 dcnt: 12 qcnt: 24
+GLSTATS_LINE = re.compile(r"G:\s*n:(\d+)/([0-9a-f]+)\s+rtt:(\d+)/(\d+)\s+rttb:(\d+)/(\d+)\s+irt:(\d+)/(\d+)\s+dcnt:\s*(\d+)\s+qcnt:\s*(\d+)")
+
+def parse_glstats(text:str, top:int=None, sortKey:str="wait") -> list:
+    """
+    Parses the glstats file of a GFS2 file system. It has a line per glock,
+    with the top argument only the hottest are kept while reading.
+
+    Args:
+        text (str): Content of /sys/kernel/debug/gfs2/<cluster:fs>/glstats
+        top (int): Only return this many glocks, all if None
+        sortKey (str): Key of SORT_KEYS to rank by
+
+    Returns:
+        list: [{'glock': str, 'type': str, 'number': int, 'rttNs': int, 'rttbNs': int,
+                'irtNs': int, 'dlmRequests': int, 'queued': int, 'waitNs': int}] hottest first
+    """
+    key = SORT_KEYS[sortKey]
+    glocks = []
+    for line in text.splitlines():
+        match = GLSTATS_LINE.search(line)
+        if not match:
+            continue
+        glockType, number = int(match.group(1)), int(match.group(2), 16)
+        rttb, dcount = int(match.group(5)), int(match.group(9))
+        glocks.append({
+            "glock": f"{glockType}/{match.group(2)}",
+            "type": GLOCK_TYPES.get(glockType, str(glockType)),
+            "number": number,
+            "rttNs": int(match.group(3)),
+            "rttbNs": rttb,
+            "irtNs": int(match.group(7)),
+            "dlmRequests": dcount,
+            "queued": int(match.group(10)),
+            "waitNs": rttb * dcount
+        })
+    if top is None:
+        return sorted(glocks, key=key, reverse=True)
+    return heapq.nlargest(top, glocks, key=key)
+
+def parse_glocks(text:str) -> dict:
+    """
+    Parses the glocks file of a GFS2 file system
+
+    Args:
+        text (str): Content of /sys/kernel/debug/gfs2/<cluster:fs>/glocks
+
+    Returns:
+        dict: {glock: {'state': str, 'flags': str, 'demoteState': str, 'holders': int, 'waiters': int}},
+              glock is "<type>/<hex number>" as in parse_glstats()
+    """
+    glocks = {}
+    current = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("G:"):
+            fields = dict(field.split(":", 1) for field in line[2:].split() if ":" in field)
+            current = {
+                "state": fields.get("s", ""),
+                "flags": fields.get("f", ""),
+                "demoteState": fields.get("d", "").split("/")[0],
+                "holders": 0,
+                "waiters": 0
+            }
+            glocks[fields.get("n", "")] = current
+        elif line.startswith("H:") and current is not None:
+            fields = dict(field.split(":", 1) for field in line[2:].split() if ":" in field)
+            if "W" in fields.get("f", ""):
+                current["waiters"] += 1
+            else:
+                current["holders"] += 1
+    return glocks
+
+def get_gfs2_datastores(configData:dict) -> list:
+    """
+    Gets the GFS2 datastores of the config with their DLM lock table name
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        list: [{'wwid': str, 'alias': str, 'mountPoint': str, 'lockTable': str}]
+    """
+    clusterName = configData.get("clusterConfig", {}).get("clusterName", "")
+    datastores = []
+    for wwid, volume in configData.get("multipathData", {}).get("multipathVolumes", {}).items():
+        datastoreInfo = volume.get("datastoreInfo", {})
+        if volume.get("volumeType") != "datastore" or datastoreInfo.get("fileSystem", "gfs2") != "gfs2":
+            continue
+        datastores.append({
+            "wwid": wwid,
+            "alias": volume.get("alias", volume.get("friendlyName", "")),
+            "mountPoint": datastoreInfo.get("mountPoint", ""),
+            # install.py creates the file system with -t <cluster>:<datastoreName>
+            "lockTable": f"{clusterName}:{datastoreInfo.get('datastoreName', '')}"
+        })
+    return datastores
+
+def map_inodes(mountPoint:str) -> dict:
+    """
+    Maps the inode numbers of the VM images on a datastore to their paths.
+    GFS2 uses the disk address of an inode as its inode number and as the number of its glocks.
+
+    Args:
+        mountPoint (str): Mount point of the datastore
+
+    Returns:
+        dict: {inode number: path relative to the mount point}
+    """
+    inodes = {}
+    root = Path(mountPoint)
+    for top in ("images", "template", "private"):
+        for dirPath, dirNames, fileNames in os.walk(root / top):
+            for name in dirNames + fileNames:
+                path = Path(dirPath) / name
+                try:
+                    inodes[path.lstat().st_ino] = str(path.relative_to(root))
+                except OSError:
+                    continue
+    return inodes
+
+def collect_glock_stats(datastore:dict, debugfsRoot:str=DEBUGFS_ROOT, top:int=DEFAULT_TOP, sortKey:str="wait",
+                        inodes:dict=None) -> list:
+    """
+    Ranks the hottest glocks of a datastore and maps inode glocks to files
+
+    Args:
+        datastore (dict): From get_gfs2_datastores()
+        debugfsRoot (str): Where debugfs is mounted, or a directory of captured gfs2/<lock table>/ files
+        top (int): Number of glocks to return
+        sortKey (str): Key of SORT_KEYS to rank by
+        inodes (dict): From map_inodes(), read from the mount point if None
+
+    Returns:
+        list: Glocks from parse_glstats() with the fields of parse_glocks() and 'path' added
+
+    Raises:
+        OSError: If glstats can not be read
+    """
+    statsDir = Path(debugfsRoot) / "gfs2" / datastore["lockTable"]
+    glstats = parse_glstats((statsDir / "glstats").read_text(), top, sortKey)
+    try:
+        glocks = parse_glocks((statsDir / "glocks").read_text())
+    except OSError:
+        glocks = {}
+    if inodes is None:
+        inodes = map_inodes(datastore["mountPoint"]) if datastore["mountPoint"] else {}
+
+    for glock in glstats:
+        glock.update(glocks.get(glock["glock"], {}))
+        isInode = int(glock["glock"].split("/")[0]) in INODE_GLOCK_TYPES
+        glock["path"] = inodes.get(glock["number"], "") if isInode else ""
+    return glstats
+
+def print_glocks(datastore:dict, glocks:list) -> None:
+    """Prints the ranked glocks of a datastore as a table."""
+    print(f"{datastore['alias']} ({datastore['lockTable']})")
+    print(f"  {'Glock':<18} {'Type':<6} {'Wait ms':>10} {'DLM reqs':>9} {'Queued':>9} {'Waiters':>7} Path")
+    for glock in glocks:
+        print(f"  {glock['glock']:<18} {glock['type']:<6} {glock['waitNs'] / 1e6:>10.1f} {glock['dlmRequests']:>9} "
+              f"{glock['queued']:>9} {glock.get('waiters', 0):>7} {glock['path'] or '-'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks the most contended GFS2 glocks of each datastore and maps them to VM images.")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Number of glocks to show per datastore")
+    parser.add_argument("--sort", choices=list(SORT_KEYS), default="wait", help="Rank by estimated wait time or by DLM requests")
+    parser.add_argument("--datastore", help="Only this datastore (alias)")
+    parser.add_argument("--debugfs", default=DEBUGFS_ROOT, help="debugfs mount point, or a directory of captured gfs2/<cluster:fs>/ files")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+    for datastore in get_gfs2_datastores(readConfigFile(args.config)):
+        if args.datastore and datastore["alias"] != args.datastore:
+            continue
+        try:
+            results[datastore["alias"]] = (datastore, collect_glock_stats(datastore, args.debugfs, args.top, args.sort))
+        except OSError as e:
+            print(f"ERROR: Could not read glock statistics of {datastore['alias']}, are debugfs and the datastore mounted? {e}")
+            failed = True
+
+    if args.json:
+        print(json.dumps({alias: glocks for alias, (datastore, glocks) in results.items()}, indent=4))
+    else:
+        for datastore, glocks in results.values():
+            print_glocks(datastore, glocks)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,229 @@
+import os, sys, json, shlex, argparse
+
+# Everything else is imported inside the subcommands, so "status" only pays for what it uses
+
+CONFIG_PATH = "/opt/hitachi/etc/hitachi_config.json"
+
+VOLUME_TYPES = ["unused", "datastore", "rdm"]
+
+class Context:
+    """
+    State shared by all subcommands of one invocation. The config and the device
+    inventory are loaded once on first use, added volumes are written once at the end
+    or when "apply" commits them.
+    """
+
+    def __init__(self, configPath:str=CONFIG_PATH, dryRun:bool=False):
+        self.configPath = configPath
+        self.dryRun = dryRun
+        self._config = None
+        self._luns = None
+        self.pendingVolumes = {}
+
+    @property
+    def config(self) -> dict:
+        if self._config is None:
+            try:
+                with open(self.configPath, "r") as f:
+                    self._config = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading config file: {e}")
+                self._config = {}
+        return self._config
+
+    @property
+    def luns(self) -> dict:
+        """LUN inventory from the inventory service, or from one sysfs scan if it is not running."""
+        if self._luns is None:
+            from hitachiInventory import query_inventory, scan_block_devices
+            self._luns = query_inventory("luns")
+            if self._luns is None:
+                self._luns = scan_block_devices()
+        return self._luns
+
+    def forget_luns(self) -> None:
+        """Drops the inventory after the devices changed."""
+        self._luns = None
+
+    def set_volume(self, wwid:str, volumeData:dict) -> None:
+        """Adds a volume to the loaded config and queues it for writing."""
+        self.config.setdefault("multipathData", {}).setdefault("multipathVolumes", {})[wwid] = volumeData
+        self.pendingVolumes[wwid] = volumeData
+
+    def flush(self) -> bool:
+        """
+        Writes the queued volumes to the config
+
+        Returns:
+            bool: True if nothing was queued or the volumes were written
+        """
+        if not self.pendingVolumes or self.dryRun:
+            return True
+        from sharedConfig import set_volumes
+        try:
+            set_volumes(self.pendingVolumes, self.configPath)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: Could not save {len(self.pendingVolumes)} volume(s): {e}")
+            return False
+        print(f"Saved {len(self.pendingVolumes)} volume(s) to the config")
+        self.pendingVolumes = {}
+        return True
+
+def cmd_discover(ctx:Context, args) -> int:
+    ctx.forget_luns()
+    volumes = ctx.config.get("multipathData", {}).get("multipathVolumes", {})
+    luns = [lun for lun in ctx.luns.values() if lun["isHitachi"] or args.all]
+    if args.json:
+        print(json.dumps(luns, indent=4))
+        return 0
+
+    print(f"{'WWID':<36} {'Size':>10} {'Paths':>5} {'Map':<24} Configured")
+    for lun in sorted(luns, key=lambda lun: lun["wwid"]):
+        volume = volumes.get(lun["wwid"])
+        configured = f"{volume.get('alias', volume.get('friendlyName'))} ({volume.get('volumeType')})" if volume else "no"
+        print(f"{lun['wwid']:<36} {lun['sizeBytes'] / 1024 ** 3:>7.1f}GiB {len(lun['paths']):>5} {lun['alias'] or '-':<24} {configured}")
+    return 0
+
+def cmd_add(ctx:Context, args) -> int:
+    if args.wwid not in ctx.luns:
+        print(f"Warning: {args.wwid} is not visible on this node")
+    volumes = ctx.config.get("multipathData", {}).get("multipathVolumes", {})
+    if args.wwid in volumes and not args.replace:
+        print(f"Volume with UUID {args.wwid} already exists in configuration.")
+        return 1
+
+    volumeData = {"scsi_id": args.wwid, "alias": args.alias, "volumeType": args.type}
+    if args.type == "datastore":
+        mountRoot = ctx.config.get("mountRoot", "/mnt")
+        volumeData["datastoreInfo"] = {
+            "fileSystem": args.fs,
+            "mountPoint": f"{mountRoot}/{args.alias}",
+            "datastoreName": args.alias
+        }
+        if args.fs == "gfs2":
+            volumeData["datastoreInfo"]["performanceProfile"] = "vmImages"
+    ctx.set_volume(args.wwid, volumeData)
+    print(f"Added volume: {args.alias} with UUID: {args.wwid}")
+    return 0
+
+def cmd_generate(ctx:Context, args) -> int:
+    from generateMultipathConfig import build_multipath_config
+    content = build_multipath_config(ctx.config)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(content)
+        print(f"Wrote {args.output}")
+    else:
+        print(content)
+    return 0
+
+def cmd_apply(ctx:Context, args) -> int:
+    from generateMultipathConfig import build_multipath_config, write_multipath_config
+    from multipathReconcile import reconcile
+
+    # apply is a commit point: multipath.conf and the maps are changed for real, so the
+    # volumes added before it are saved first and stay saved if a later batch line fails
+    if not ctx.flush():
+        return 1
+    content = build_multipath_config(ctx.config)
+    if ctx.dryRun:
+        print(content)
+    else:
+        write_multipath_config(content, args.multipath_conf)
+    try:
+        success = reconcile(ctx.config, ctx.dryRun)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return 1
+    ctx.forget_luns()
+    return 0 if success else 1
+
+def cmd_status(ctx:Context, args) -> int:
+    # Health is reported, not returned, so a warning does not abort a batch; storageStatus.py exits with it
+    from storageStatus import collect_status, print_status
+    config = ctx.config
+    report = collect_status(config, ctx.luns)
+    if args.json:
+        print(json.dumps(dict(report, serverName=config.get("serverName")), indent=4))
+        return 0
+
+    print(f"Server: {config.get('serverName', '?')}  Cluster: {config.get('clusterConfig', {}).get('clusterName') or '-'}")
+    print_status(report)
+    return 0
+
+def cmd_batch(ctx:Context, args) -> int:
+    parser = build_parser(batch=True)
+    for lineNumber, line in enumerate(sys.stdin, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            lineArgs = parser.parse_args(shlex.split(line))
+        except SystemExit:
+            print(f"ERROR: Invalid command on line {lineNumber}: {line}")
+            return 1
+        result = lineArgs.func(ctx, lineArgs)
+        if result != 0 and not args.keep_going:
+            print(f"ERROR: Line {lineNumber} failed, stopping: {line}")
+            return result
+    return 0
+
+def build_parser(batch:bool=False) -> argparse.ArgumentParser:
+    """
+    Builds the argument parser. Batch lines use the same subcommands without the global options.
+
+    Args:
+        batch (bool): Build the parser for a line of a batch script
+
+    Returns:
+        argparse.ArgumentParser: The parser
+    """
+    parser = argparse.ArgumentParser(prog="hitachi", description="Manages Hitachi volumes on this Proxmox node.")
+    if not batch:
+        parser.add_argument("--config", default=CONFIG_PATH, help="Path to Hitachi configuration JSON file")
+        parser.add_argument("--dry-run", action="store_true", help="Do not write the config, multipath.conf or change maps")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    discover = subparsers.add_parser("discover", help="List the LUNs seen by this node")
+    discover.add_argument("--all", action="store_true", help="Include LUNs of other vendors")
+    discover.add_argument("--json", action="store_true", help="Print JSON")
+    discover.set_defaults(func=cmd_discover)
+
+    add = subparsers.add_parser("add", help="Add a volume to the config")
+    add.add_argument("wwid", help="WWID of the LUN (scsi_id)")
+    add.add_argument("alias", help="Alias of the multipath device")
+    add.add_argument("--type", choices=VOLUME_TYPES, default="unused", help="Use of the volume")
+    add.add_argument("--fs", choices=["gfs2", "xfs"], default="gfs2", help="File system of a datastore")
+    add.add_argument("--replace", action="store_true", help="Replace the volume if it is already configured")
+    add.set_defaults(func=cmd_add)
+
+    generate = subparsers.add_parser("generate", help="Print multipath.conf for the config")
+    generate.add_argument("--output", help="Write to this file instead")
+    generate.set_defaults(func=cmd_generate)
+
+    apply = subparsers.add_parser("apply", help="Save the config, write multipath.conf and reconcile the maps. "
+                                  "In a batch this commits every volume added before it")
+    apply.add_argument("--multipath-conf", default="/etc/multipath.conf", help="Path of multipath.conf")
+    apply.set_defaults(func=cmd_apply)
+
+    status = subparsers.add_parser("status", help="Show the health of the configured volumes: paths, mounts, usage and RDM attachments")
+    status.add_argument("--json", action="store_true", help="Print JSON")
+    status.set_defaults(func=cmd_status)
+
+    if not batch:
+        batchParser = subparsers.add_parser("batch", help="Run one subcommand per line from stdin, sharing the config and inventory. "
+                                            "A failed line discards the volumes added since the last apply")
+        batchParser.add_argument("--keep-going", action="store_true", help="Continue after a failed line")
+        batchParser.set_defaults(func=cmd_batch)
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    ctx = Context(args.config, args.dry_run)
+    result = args.func(ctx, args)
+    if result != 0 and ctx.pendingVolumes:
+        # Only what was added since the last apply is discarded, apply already saved the rest
+        print(f"Not saving {len(ctx.pendingVolumes)} volume(s) added since the last apply because of the error")
+    elif not ctx.flush():
+        result = 1
+    sys.exit(result)
@@ -0,0 +1,404 @@
+import os, sys, json, socket, argparse, threading, time
+from pathlib import Path
+
+from clusterInfo import get_cluster_info, cluster_info_to_dict, PVE_DIR
+from hitachiNaa import decode_naa, decode_vpd_pg83, get_serial_offsets, index_by_ldev, ldev_key
+
+SOCKET_PATH = "/run/hitachi/inventory.sock"
+CONFIG_PATH = "/opt/hitachi/etc/hitachi_config.json"
+
+# Full rescan interval in seconds, in case a uevent was missed
+RESCAN_INTERVAL = 60
+# Seconds to wait for more uevents before rescanning, a LUN presentation comes in bursts
+UEVENT_SETTLE_TIME = 0.5
+
+NETLINK_KOBJECT_UEVENT = 15
+
+SERVICE_UNIT = """[Unit]
+Description=Hitachi storage inventory service
+After=systemd-udevd.service multipathd.service pve-cluster.service
+
+[Service]
+Type=simple
+ExecStart=/usr/bin/python3 {script} --serve
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+def _read_sysfs(path:Path) -> str:
+    """Reads a sysfs attribute, returning an empty string if it can not be read."""
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def sysfs_wwid_to_scsi_id(wwid:str) -> str:
+    """
+    Converts the wwid sysfs attribute of a SCSI device to the ID scsi_id prints,
+    which is what hitachi_config.json and multipath use (e.g. naa.60060e80... -> 360060e80...)
+
+    Args:
+        wwid (str): Content of /sys/block/sdX/device/wwid
+
+    Returns:
+        str: SCSI ID of the device, empty if the wwid is unknown
+    """
+    prefixes = {"t10.": "1", "eui.": "2", "naa.": "3"}
+    for prefix, idType in prefixes.items():
+        if wwid.startswith(prefix):
+            if prefix == "t10.":
+                return idType + wwid[4:].replace(" ", "_")
+            return idType + wwid[4:].lower()
+    return ""
+
+def scan_block_devices(sysfsRoot:str="/sys", serialOffsets:dict=None) -> dict:
+    """
+    Builds the LUN inventory of the system in a single pass over /sys/block
+
+    Args:
+        sysfsRoot (str): Root of the sysfs tree
+        serialOffsets (dict): Serial offsets per array model code, see get_serial_offsets()
+
+    Returns:
+        dict: {wwid: {
+            'wwid': str,
+            'vendor': str,
+            'model': str,
+            'sizeBytes': int,
+            'isHitachi': bool,
+            'paths': [{'device': str, 'hctl': str, 'state': str,
+                       'scsiHost': str,  # e.g. host1
+                       'rport': str}],   # FC remote port the path goes through, empty if not FC
+            'dmDevice': str,     # Kernel name of the multipath device, empty if none
+            'alias': str,        # Name of the multipath device, empty if none
+            'arraySerial': int,  # Hitachi array serial and LDEV number, None if not decodable
+            'ldevId': int
+        }}
+    """
+    luns = {}
+    maps = {}
+    blockPath = Path(sysfsRoot) / "block"
+    if not blockPath.exists():
+        return luns
+
+    for device in sorted(blockPath.iterdir()):
+        if device.name.startswith("sd"):
+            wwid = sysfs_wwid_to_scsi_id(_read_sysfs(device / "device" / "wwid"))
+            if not wwid:
+                # Older kernels have no wwid attribute, read the identification VPD page
+                try:
+                    wwid = decode_vpd_pg83((device / "device" / "vpd_pg83").read_bytes())
+                except OSError:
+                    pass
+            if not wwid:
+                continue
+            lun = luns.get(wwid)
+            if lun is None:
+                vendor = _read_sysfs(device / "device" / "vendor")
+                model = _read_sysfs(device / "device" / "model")
+                size = _read_sysfs(device / "size")
+                lun = luns[wwid] = {
+                    "wwid": wwid,
+                    "vendor": vendor,
+                    "model": model,
+                    "sizeBytes": int(size) * 512 if size.isdigit() else 0,
+                    "isHitachi": vendor.startswith("HITACHI") and model.startswith("OPEN-"),
+                    "paths": [],
+                    "dmDevice": "",
+                    "alias": "",
+                    "arraySerial": None,
+                    "ldevId": None
+                }
+                if lun["isHitachi"]:
+                    ldev = decode_naa(wwid, serialOffsets)
+                    if ldev:
+                        lun["arraySerial"] = ldev["arraySerial"]
+                        lun["ldevId"] = ldev["ldevId"]
+            # e.g. /sys/devices/pci0000:00/.../host1/rport-1:0-2/target1:0:0/1:0:0:3
+            devicePath = Path(os.path.realpath(device / "device"))
+            scsiHost = ""
+            rport = ""
+            for part in devicePath.parts:
+                if part.startswith("host") and part[4:].isdigit():
+                    scsiHost = part
+                elif part.startswith("rport-"):
+                    rport = part
+            lun["paths"].append({
+                "device": device.name,
+                "hctl": devicePath.name,
+                "state": _read_sysfs(device / "device" / "state"),
+                "scsiHost": scsiHost,
+                "rport": rport
+            })
+        elif device.name.startswith("dm-"):
+            dmUuid = _read_sysfs(device / "dm" / "uuid")
+            if dmUuid.startswith("mpath-"):
+                maps[dmUuid[6:]] = (device.name, _read_sysfs(device / "dm" / "name"))
+
+    for wwid, (dmDevice, alias) in maps.items():
+        if wwid in luns:
+            luns[wwid]["dmDevice"] = dmDevice
+            luns[wwid]["alias"] = alias
+
+    return luns
+
+class Inventory:
+    """
+    In-memory device, cluster and config inventory of this node. Device data is
+    refreshed from uevents, config and cluster data when their file mtime changes.
+    """
+
+    def __init__(self, configPath:str=CONFIG_PATH, pveDir:str=PVE_DIR, sysfsRoot:str="/sys"):
+        self.configPath = configPath
+        self.pveDir = pveDir
+        self.sysfsRoot = sysfsRoot
+        self.lock = threading.Lock()
+        self.luns = {}
+        self.ldevIndex = {}
+        self.scanTime = 0
+        self.dirty = threading.Event()
+        self.files = {}
+        self.rescan()
+
+    def rescan(self) -> None:
+        """Rescans the block devices."""
+        try:
+            serialOffsets = get_serial_offsets(self.get_config())
+        except ValueError as e:
+            print(f"Warning: {e}")
+            serialOffsets = {}
+        luns = scan_block_devices(self.sysfsRoot, serialOffsets)
+        with self.lock:
+            self.luns = luns
+            self.ldevIndex = index_by_ldev(luns)
+            self.scanTime = time.time()
+
+    def _cached_file(self, path:str, loader) -> dict:
+        """Returns the loaded content of a file, loading it again only if its mtime changed."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        cached = self.files.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, loader(path) if mtime is not None else {})
+            self.files[path] = cached
+        return cached[1]
+
+    def get_config(self) -> dict:
+        def load(path):
+            try:
+                with open(path, "r") as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading config file: {e}")
+                return {}
+        return self._cached_file(self.configPath, load)
+
+    def get_cluster(self) -> dict:
+        # clusterInfo caches on the mtimes of the cluster files itself
+        return cluster_info_to_dict(get_cluster_info(self.pveDir))
+
+    def query(self, request:dict):
+        """
+        Answers a query
+
+        Args:
+            request (dict): {'query': str, ...}
+
+        Returns:
+            Any: JSON serializable answer
+
+        Raises:
+            ValueError: If the query is unknown
+        """
+        query = request.get("query", "")
+        if query == "ping":
+            return {"scanTime": self.scanTime}
+        if query == "refresh":
+            self.rescan()
+            return {"scanTime": self.scanTime}
+        if query == "luns":
+            with self.lock:
+                luns = self.luns
+            if request.get("hitachiOnly", False):
+                return {wwid: lun for wwid, lun in luns.items() if lun["isHitachi"]}
+            return luns
+        if query == "lun":
+            with self.lock:
+                return self.luns.get(request.get("wwid", ""))
+        if query == "ldev":
+            # Looks a LUN up by the array serial and LDEV number of array-side reports
+            with self.lock:
+                wwid = self.ldevIndex.get(ldev_key(request.get("arraySerial"), request.get("ldevId")))
+                return self.luns.get(wwid) if wwid else None
+        if query == "disks":
+            # One entry per sd path, the shape get_hitachi_disks() in the plugin returns
+            disks = []
+            with self.lock:
+                luns = self.luns
+            for lun in luns.values():
+                if request.get("hitachiOnly", True) and not lun["isHitachi"]:
+                    continue
+                for path in lun["paths"]:
+                    disks.append({"device": path["device"], "sizeBytes": lun["sizeBytes"], "wwid": lun["wwid"], "model": lun["model"]})
+            return disks
+        if query == "cluster":
+            return self.get_cluster()
+        if query == "config":
+            return self.get_config()
+        if query == "all":
+            with self.lock:
+                luns = self.luns
+            return {"luns": luns, "cluster": self.get_cluster(), "config": self.get_config(), "scanTime": self.scanTime}
+        raise ValueError(f"unknown query '{query}'")
+
+    def watch_uevents(self) -> None:
+        """Rescans whenever the kernel reports a block device change. Runs forever."""
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))
+        except OSError as e:
+            print(f"Warning: Could not listen for uevents, falling back to periodic rescans: {e}")
+            return
+
+        while True:
+            data = sock.recv(65536)
+            if b"SUBSYSTEM=block" in data:
+                self.dirty.set()
+
+    def rescan_loop(self) -> None:
+        """Rescans after uevents settle and every RESCAN_INTERVAL seconds. Runs forever."""
+        while True:
+            if self.dirty.wait(RESCAN_INTERVAL):
+                # Let the rest of the burst arrive
+                while True:
+                    self.dirty.clear()
+                    if not self.dirty.wait(UEVENT_SETTLE_TIME):
+                        break
+            self.rescan()
+
+def serve(socketPath:str=SOCKET_PATH, configPath:str=CONFIG_PATH) -> int:
+    """
+    Runs the inventory service. Requests and answers are one JSON document per line.
+
+    Args:
+        socketPath (str): Path of the Unix socket to listen on
+        configPath (str): Path to the Hitachi configuration JSON file
+
+    Returns:
+        int: Exit code
+    """
+    import socketserver
+
+    inventory = Inventory(configPath)
+    threading.Thread(target=inventory.watch_uevents, daemon=True).start()
+    threading.Thread(target=inventory.rescan_loop, daemon=True).start()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    answer = {"ok": True, "data": inventory.query(json.loads(line))}
+                except Exception as e:
+                    answer = {"ok": False, "error": str(e)}
+                self.wfile.write(json.dumps(answer, separators=(",", ":")).encode() + b"\n")
+
+    socketFile = Path(socketPath)
+    socketFile.parent.mkdir(parents=True, exist_ok=True)
+    if socketFile.exists():
+        socketFile.unlink()
+
+    socketserver.ThreadingUnixStreamServer.daemon_threads = True
+    with socketserver.ThreadingUnixStreamServer(socketPath, Handler) as server:
+        os.chmod(socketPath, 0o600)
+        print(f"Serving Hitachi inventory on {socketPath}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+def query_inventory(query:str, socketPath:str=SOCKET_PATH, timeout:float=2.0, **kwargs):
+    """
+    Asks the inventory service a question
+
+    Args:
+        query (str): Query name (ping, refresh, luns, lun, ldev, disks, cluster, config, all)
+        socketPath (str): Path of the service's Unix socket
+        timeout (float): Seconds to wait for the answer
+        kwargs: Extra query arguments (e.g. wwid, hitachiOnly, arraySerial and ldevId)
+
+    Returns:
+        Any: The answer, None if the service is not running or failed to answer
+    """
+    request = dict(kwargs)
+    request["query"] = query
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socketPath)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                answer = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+    if not answer.get("ok"):
+        print(f"Error from inventory service: {answer.get('error')}")
+        return None
+    return answer["data"]
+
+def install_service() -> bool:
+    """
+    Installs and starts the systemd service of the inventory service
+
+    Returns:
+        bool: True if the service was installed and started, False otherwise
+    """
+    import subprocess
+
+    unitPath = Path("/etc/systemd/system/hitachi-inventory.service")
+    with open(unitPath, "w") as f:
+        f.write(SERVICE_UNIT.format(script=os.path.realpath(__file__)))
+    print(f"Created systemd service unit at {unitPath}")
+
+    for command in [["systemctl", "daemon-reload"], ["systemctl", "enable", "--now", unitPath.name]]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: '{' '.join(command)}' failed: {result.stderr.strip()}")
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory Hitachi device, cluster and config inventory served over a Unix socket.")
+    parser.add_argument("--serve", action="store_true", help="Run the inventory service")
+    parser.add_argument("--install", action="store_true", help="Install and start the systemd service")
+    parser.add_argument("--query", help="Query a running service (ping, refresh, luns, lun, ldev, disks, cluster, config, all)")
+    parser.add_argument("--wwid", help="WWID for the 'lun' query")
+    parser.add_argument("--ldev", help="Array serial and LDEV number for the 'ldev' query, e.g. 440477:121")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Path of the Unix socket")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    if args.serve:
+        sys.exit(serve(args.socket, args.config))
+    elif args.install:
+        sys.exit(0 if install_service() else 1)
+    elif args.query:
+        extra = {"wwid": args.wwid} if args.wwid else {}
+        if args.ldev:
+            arraySerial, _, ldevId = args.ldev.partition(":")
+            if not (arraySerial.isdigit() and ldevId.isdigit()):
+                parser.error("--ldev must be <serial>:<ldev number>")
+            extra.update(arraySerial=int(arraySerial), ldevId=int(ldevId))
+        result = query_inventory(args.query, args.socket, **extra)
+        if result is None:
+            print("No answer from the inventory service")
+            sys.exit(1)
+        print(json.dumps(result, indent=4))
+    else:
+        print(json.dumps(scan_block_devices(), indent=4))
@@ -0,0 +1,144 @@
+import sys, json, argparse
+
+# NAA 6 (IEEE registered extended) with Hitachi's IEEE OUI 0060e8
+HITACHI_NAA_PREFIX = "60060e80"
+
+# VPD page 0x83 designator type of an NAA identifier, and association with the LUN itself
+DESIGNATOR_TYPE_NAA = 3
+ASSOCIATION_LUN = 0
+
+def decode_naa(wwid:str, serialOffsets:dict=None) -> dict:
+    """
+    Decodes the array serial and LDEV of a Hitachi NAA identifier.
+    e.g. 360060e80289e1d0050809e1d00000079 is model code 28, serial 0x9e1d, LDEV 00:79.
+    The identifier only has room for the low part of six digit serials; the part that
+    is cut off depends on the array model and is added from serialOffsets.
+
+    Args:
+        wwid (str): SCSI ID as printed by scsi_id (with the leading 3) or the bare NAA
+        serialOffsets (dict): {modelCode: int} added to the serial of arrays with that model code
+
+    Returns:
+        dict: {'modelCode': str, 'rawSerial': int, 'arraySerial': int, 'ldevId': int},
+              None if the identifier is not a Hitachi NAA-6
+    """
+    naa = wwid.lower()
+    if len(naa) == 33 and naa.startswith("3"):
+        naa = naa[1:]
+    if len(naa) != 32 or not naa.startswith(HITACHI_NAA_PREFIX):
+        return None
+    try:
+        modelCode = naa[8:10]
+        rawSerial = int(naa[10:14], 16)
+        ldevId = int(naa[-4:], 16)
+    except ValueError:
+        return None
+    return {
+        "modelCode": modelCode,
+        "rawSerial": rawSerial,
+        "arraySerial": rawSerial + (serialOffsets or {}).get(modelCode, 0),
+        "ldevId": ldevId
+    }
+
+def format_ldev(ldevId:int) -> str:
+    """
+    Formats an LDEV number the way the array shows it
+
+    Args:
+        ldevId (int): LDEV number
+
+    Returns:
+        str: CU:LDEV, e.g. 00:79
+    """
+    return f"{ldevId >> 8:02X}:{ldevId & 0xff:02X}"
+
+def decode_vpd_pg83(data:bytes) -> str:
+    """
+    Gets the NAA identifier of a LUN from VPD page 0x83 (Device Identification),
+    as found in /sys/block/sdX/device/vpd_pg83
+
+    Args:
+        data (bytes): Raw page
+
+    Returns:
+        str: SCSI ID as scsi_id prints it (3 followed by the NAA in hex), empty if there is none
+    """
+    if len(data) < 4 or data[1] != 0x83:
+        return ""
+    end = min(len(data), 4 + int.from_bytes(data[2:4], "big"))
+    offset = 4
+    while offset + 4 <= end:
+        association = (data[offset + 1] >> 4) & 0x3
+        designatorType = data[offset + 1] & 0xf
+        length = data[offset + 3]
+        designator = data[offset + 4:offset + 4 + length]
+        if designatorType == DESIGNATOR_TYPE_NAA and association == ASSOCIATION_LUN and len(designator) == length:
+            return "3" + designator.hex()
+        offset += 4 + length
+    return ""
+
+def get_serial_offsets(configData:dict) -> dict:
+    """
+    Gets the serial offsets per model code from the config's "naa" section
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        dict: {modelCode: int}
+
+    Raises:
+        ValueError: If an offset is not an integer
+    """
+    offsets = {}
+    for modelCode, offset in configData.get("naa", {}).get("serialOffsets", {}).items():
+        if not isinstance(offset, int) or isinstance(offset, bool):
+            raise ValueError(f"naa.serialOffsets.{modelCode} must be an integer")
+        offsets[modelCode.lower()] = offset
+    return offsets
+
+def ldev_key(arraySerial:int, ldevId:int) -> str:
+    """Key of a LUN in the LDEV index, e.g. 440477:121"""
+    return f"{arraySerial}:{ldevId}"
+
+def index_by_ldev(luns:dict) -> dict:
+    """
+    Indexes the inventory by array serial and LDEV
+
+    Args:
+        luns (dict): From scan_block_devices()
+
+    Returns:
+        dict: {ldev_key(): wwid} of the LUNs with a decoded LDEV
+    """
+    return {ldev_key(lun["arraySerial"], lun["ldevId"]): wwid
+            for wwid, lun in luns.items() if lun.get("ldevId") is not None}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decodes the array serial and LDEV of Hitachi LUNs from their NAA identifiers.")
+    parser.add_argument("wwids", nargs="*", help="SCSI IDs to decode, defaults to every Hitachi LUN of this node")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    from addVolumeToConfig import readConfigFile
+    try:
+        serialOffsets = get_serial_offsets(readConfigFile(args.config))
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    if args.wwids:
+        rows = {wwid: dict(decode_naa(wwid, serialOffsets) or {}, alias="") for wwid in args.wwids}
+    else:
+        from hitachiInventory import scan_block_devices
+        rows = {wwid: {"arraySerial": lun["arraySerial"], "ldevId": lun["ldevId"], "alias": lun["alias"]}
+                for wwid, lun in scan_block_devices(serialOffsets=serialOffsets).items() if lun["isHitachi"]}
+
+    if args.json:
+        print(json.dumps(rows, indent=4))
+        sys.exit(0)
+    print(f"{'Serial':>8} {'LDEV':>6} {'Map':<24} WWID")
+    for wwid, row in sorted(rows.items(), key=lambda item: (item[1].get("arraySerial") or 0, item[1].get("ldevId") or 0)):
+        ldev = format_ldev(row["ldevId"]) if row.get("ldevId") is not None else "-"
+        print(f"{row.get('arraySerial') or '-':>8} {ldev:>6} {row['alias'] or '-':<24} {wwid}")
@@ -1,11 +1,22 @@
-import sys, os, json, re, subprocess, argparse, socket, time
+import sys, os, json, re, shutil, subprocess, argparse, socket, time
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from clusterInfo import get_cluster_info
+from fcHosts import read_fc_hosts
+from fcRescan import rescan_fc_targets
+from mountOrchestrator import build_mount_unit, install_service as install_mount_service
+from fsTuning import calculate_gfs2_mkfs_parameters, build_gfs2_mkfs_command, get_gfs2_mount_options, get_block_device_size, \
+    read_queue_topology, calculate_xfs_geometry, build_xfs_mkfs_command
+
+# The storage plugin runs the Python helpers (cloneImage.py, moveImage.py, ...) from here
+HELPER_DIR = "/opt/hitachi/bin"
+
 def main(config: dict = None):
     if config:
         hostname = socket.gethostname()
         handleNeededPackages()
+        install_helpers()
     else:
         config = {}
         hostname = socket.gethostname()
@@ -14,6 +25,7 @@ def main(config: dict = None):
         if serverType == 'cluster':
             cluster_info = get_cluster_information()
         handleNeededPackages()
+        install_helpers()
         configure_dlm_for_cluster()
         print_wwpn()
         print()
@@ -30,6 +42,7 @@ def main(config: dict = None):
         print(json.dumps(hitachi_config, indent=4))
 
         conifgure_volumes(hitachi_config)
+        save_config_file(hitachi_config)
     
     return 0
 
@@ -99,39 +112,18 @@ def get_cluster_information() -> dict:
         'cluster_node_list': []
     }
     
-    # Check if node is part of a Proxmox cluster
-    command = "pvecm status"
-    stdout, stderr, success = runCommand(command)
-    if not success:
+    # Read membership from the cluster file system instead of parsing pvecm output
+    info = get_cluster_info()
+    if not info.isClusterNode:
         print("ERROR: This node is NOT part of a Proxmox cluster. Exiting...")
         return cluster_info
-    
-    # Parse cluster name
-    for line in stdout.split('\n'):
-        if 'Name:' in line:
-            cluster_info['cluster_name'] = line.split(':', 1)[1].strip()
-        elif 'Nodes:' in line:
-            try:
-                cluster_info['cluster_node_count'] = int(line.split(':', 1)[1].strip())
-            except ValueError:
-                cluster_info['cluster_node_count'] = 0
+    if not info.quorate:
+        print("WARNING: The cluster is not quorate!")
 
-    # Get cluster node list
-    command = "pvecm nodes"
-    stdout, stderr, success = runCommand(command)
-    if not success:
-        print("ERROR: Could not retrieve cluster node list. Exiting...")
-        sys.exit(1)
-
-    # Parse node list (skip first 4 lines of header)
-    lines = stdout.split('\n')
-    for line in lines[3:]:  # Skip header lines
-        parts = line.split()
-        if len(parts) >= 3:
-            node = {}
-            node['nodeId'] = parts[0]
-            node['nodeName'] = parts[2]
-            cluster_info['cluster_node_list'].append(node)
+    cluster_info['cluster_name'] = info.clusterName
+    cluster_info['cluster_node_count'] = info.nodeCount
+    for node in info.nodes:
+        cluster_info['cluster_node_list'].append({'nodeId': node.nodeId, 'nodeName': node.nodeName})
 
     print("\nCluster Information:")
     print(f"\tCluster Name: {cluster_info['cluster_name']}")
@@ -173,6 +165,33 @@ def handleNeededPackages():
         else:
             print(f"Package {package} is already installed.")
 
+def install_helpers(helperDir:str=HELPER_DIR) -> bool:
+    """
+    Copies the Python helpers to the directory the storage plugin runs them from.
+    All modules are copied since the helpers import each other.
+
+    Args:
+        helperDir (str): Destination directory
+
+    Returns:
+        bool: True if all helpers were copied, False otherwise
+    """
+    print()
+    print("###############################")
+    print("# Installing the helper tools #")
+    print("###############################")
+    Path(helperDir).mkdir(parents=True, exist_ok=True)
+    succeeded = True
+    for script in sorted(Path(__file__).resolve().parent.glob("*.py")):
+        try:
+            shutil.copy2(script, Path(helperDir) / script.name)
+            os.chmod(Path(helperDir) / script.name, 0o755)
+        except OSError as e:
+            print(f"ERROR: Could not install {script.name} to {helperDir}: {e}")
+            succeeded = False
+    print(f"Installed the helpers to {helperDir}")
+    return succeeded
+
 def is_package_installed(package_name: str) -> bool:
     """
     Check if a Debian package is installed using dpkg.
@@ -373,50 +392,27 @@ def print_wwpn() -> bool:
     print("# Server WWPN Information #")
     print("##################################################")
     
-    fc_host_path = Path('/sys/class/fc_host')
+    fc_hosts = read_fc_hosts()
     
-    if fc_host_path.exists():
-        host_dirs = sorted(fc_host_path.glob('host*'))
+    if fc_hosts:
+        print("\nFibre Channel HBA WWPNs:")
+        found_wwpn = False
         
-        if host_dirs:
-            print("\nFibre Channel HBA WWPNs:")
-            found_wwpn = False
-            
-            for host_dir in host_dirs:
-                wwpn_file = host_dir / 'port_name'
-                wwnn_file = host_dir / 'node_name'
-                
-                try:
-                    if wwpn_file.exists():
-                        with open(wwpn_file, 'r') as f:
-                            wwpn = f.read().strip()
-                        
-                        # Also get WWNN if available
-                        wwnn = ""
-                        if wwnn_file.exists():
-                            with open(wwnn_file, 'r') as f:
-                                wwnn = f.read().strip()
-                        
-                        # Format WWPN for better readability (remove 0x prefix)
-                        wwpn_formatted = wwpn.replace('0x', '').upper()
-                        wwnn_formatted = wwnn.replace('0x', '').upper() if wwnn else "N/A"
-                        
-                        print(f"\n  {host_dir.name}:")
-                        print(f"    WWPN: {wwpn_formatted}")
-                        print(f"    WWNN: {wwnn_formatted}")
-                        
-                        found_wwpn = True
-                
-                except Exception as e:
-                    print(f"  Error reading {host_dir.name}: {e}")
-            
-            if found_wwpn:
-                print()
-                return True
-            else:
-                print("  No WWPNs found in /sys/class/fc_host/")
+        for host_name, fc_host in fc_hosts.items():
+            if fc_host['wwpn']:
+                print(f"\n  {host_name}:")
+                print(f"    WWPN: {fc_host['wwpn']}")
+                print(f"    WWNN: {fc_host['wwnn'] or 'N/A'}")
+                found_wwpn = True
+        
+        if found_wwpn:
+            print()
+            return True
         else:
-            print("\nNo Fibre Channel HBA hosts found in /sys/class/fc_host/")
+            print("  No WWPNs found in /sys/class/fc_host/")
+    else:
+        print("\nNo Fibre Channel HBA hosts found in /sys/class/fc_host/")
+    return False
 
 def verify_disks_found() -> bool:
     """
@@ -478,7 +474,11 @@ def rescan_disks():
     print("# Rescanning SCSI Bus #")
     print("#######################")
     
-    command = "rescan-scsi-bus.sh --largelun --multipath --issue-lip-wait=10 --alltargets"
+    # Scan the known FC targets directly, a LIP disrupts I/O on LUNs in use
+    if rescan_fc_targets():
+        return
+
+    command = "rescan-scsi-bus.sh --largelun --multipath --alltargets"
     stdout, stderr, success = runCommand(command)
     if not success:
         print(f"Error rescanning SCSI bus: {stderr}")
@@ -822,7 +822,8 @@ def configure_volumes_for_multipath(volumes:list, mountRoot:str=None, isCluster=
                 volume['datastoreInfo'] = {
                     "fileSystem": "gfs2",
                     "mountPoint": mountRoot + "/" + volume['alias'],
-                    "datastoreName": volume['alias']
+                    "datastoreName": volume['alias'],
+                    "performanceProfile": "vmImages"
                 }
             else:
                 volume['datastoreInfo'] = {
@@ -892,6 +893,12 @@ def conifgure_volumes(config:dict)->bool:
     # If the volume is to be used as a datastore
     volumeKeys = config.get('multipathData', []).get('multipathVolumes', []).keys()
 
+    # The mount units are not enabled, hitachi-mount.service mounts the datastores at boot once DLM is ready
+    if any(config['multipathData']['multipathVolumes'][key]['volumeType'] == "datastore" for key in volumeKeys):
+        if not install_mount_service():
+            print("ERROR: Failed to install hitachi-mount.service")
+            return False
+
     for key in volumeKeys:
         volume = config['multipathData']['multipathVolumes'][key]
         
@@ -906,12 +913,22 @@ def conifgure_volumes(config:dict)->bool:
             if config['clusterConfig'].get('firstNode', '') == socket.gethostname() or not config['isClusterNode']:
                 command = ""
                 if config['isClusterNode']:
-                    # Create GFS2 file system on the volume
-                    command = f"mkfs.gfs2 -t {config['clusterConfig']['clusterName']}:{volume['datastoreInfo']['datastoreName']} " \
-                        f"-j {len(config['clusterConfig']['clusterNodes'])} -J 1024 /dev/mapper/{volume['alias']}"
+                    # Create GFS2 file system on the volume sized for the LUN and the cluster
+                    devicePath = f"/dev/mapper/{volume['alias']}"
+                    gfs2Params = calculate_gfs2_mkfs_parameters(
+                        get_block_device_size(devicePath),
+                        len(config['clusterConfig']['clusterNodes']),
+                        volume['datastoreInfo'].get('performanceProfile')
+                    )
+                    command = build_gfs2_mkfs_command(config['clusterConfig']['clusterName'],
+                        volume['datastoreInfo']['datastoreName'], devicePath, gfs2Params)
                 else:
-                    # Create XFS file system on the volume
-                    command = f"mkfs.xfs /dev/mapper/{volume['alias']}"
+                    # Create XFS file system on the volume aligned to the LUN topology and
+                    # keep the geometry in the config so alignment can be audited later
+                    devicePath = f"/dev/mapper/{volume['alias']}"
+                    xfsGeometry = calculate_xfs_geometry(read_queue_topology(devicePath))
+                    volume['datastoreInfo']['xfsGeometry'] = xfsGeometry
+                    command = build_xfs_mkfs_command(devicePath, xfsGeometry)
 
                 stdout, stderr, success = runCommand(command)
                 if not success:
@@ -930,19 +947,15 @@ def conifgure_volumes(config:dict)->bool:
             uuid = stdout
 
             # 4. Create systemd mount unit for the volume
-            systemd_content = "[Unit]\n" \
-                f"Description = Mount GFS2 Fibre Channel LUN {volume['alias']}\n" \
-                "Wants=multipathd.service dlm.service\n" \
-                "After=multipathd.service dlm.service\n" \
-                "\n" \
-                "[Mount]\n" \
-                f"What=/dev/disk/by-uuid/{uuid}\n" \
-                f"Where={volume['datastoreInfo']['mountPoint']}\n" \
-                f"Type={volume['datastoreInfo']['fileSystem']}\n" \
-                "Options=_netdev,acl\n" \
-                "\n" \
-                "[Install]\n" \
-                "WantedBy=multi-user.target"
+            if volume['datastoreInfo']['fileSystem'] == "gfs2":
+                mountOptions = get_gfs2_mount_options(volume['datastoreInfo'].get('performanceProfile'))
+            elif 'xfsGeometry' in volume['datastoreInfo']:
+                mountOptions = volume['datastoreInfo']['xfsGeometry']['mountOptions']
+            else:
+                mountOptions = "_netdev,acl"
+            # The unit waits for this LUN's multipath device, not for multipathd as a whole
+            systemd_content = build_mount_unit(volume['alias'], uuid, volume['datastoreInfo']['mountPoint'],
+                volume['datastoreInfo']['fileSystem'], mountOptions)
             
             mount_unit_path = ""
             
@@ -959,11 +972,11 @@ def conifgure_volumes(config:dict)->bool:
                 f.write(systemd_content)
             print(f"Created systemd mount unit at {str(mount_unit_path)}")
 
-            # 5. Enable and start the mount unit
-            command = f"systemctl enable {mount_unit_path.name}"
+            # 5. Start the mount unit. It is not enabled, hitachi-mount.service starts it at boot.
+            command = "systemctl daemon-reload"
             stdout, stderr, success = runCommand(command)
             if not success:
-                print(f"ERROR: Failed to enable mount unit {mount_unit_path.name}")
+                print("ERROR: Failed to reload systemd")
                 print(f"STDERR: {stderr}")
                 return False
 
@@ -1011,14 +1024,6 @@ def create_config_file(hostname:str, servertype:str, multipath_volumes:list, exc
         dict: "hitachi_config.json" for this server
     """
     
-    # Get config file path
-    scriptPath = Path(__file__).parent
-    configFilePath = scriptPath.parent / 'config' / 'hitachi_config.json'
-
-    # Create config directory if it doesn't exist
-    if not configFilePath.parent.exists():
-        configFilePath.parent.mkdir(parents=True, exist_ok=True)
-    
     # Begin creating config dictionary
     hitachi_config = {
         'serverName': hostname,
@@ -1074,12 +1079,29 @@ def create_config_file(hostname:str, servertype:str, multipath_volumes:list, exc
     hitachi_config['multipathData'] = multipathData
 
     # Write config to JSON file
-    with open(configFilePath, 'w') as f:
-        json.dump(hitachi_config, f, indent=4)
+    save_config_file(hitachi_config)
 
     # Return the created config
     return hitachi_config
 
+def save_config_file(hitachi_config:dict)->None:
+    """
+    Writes the Hitachi config to the JSON config file next to the install scripts
+
+    Args:
+        hitachi_config: (dict) "hitachi_config.json" for this server
+    """
+    # Get config file path
+    scriptPath = Path(__file__).parent
+    configFilePath = scriptPath.parent / 'config' / 'hitachi_config.json'
+
+    # Create config directory if it doesn't exist
+    if not configFilePath.parent.exists():
+        configFilePath.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(configFilePath, 'w') as f:
+        json.dump(hitachi_config, f, indent=4)
+
 def runCommand(command:str)->tuple:
     """
     Runs a shell command
@@ -0,0 +1,232 @@
+import os, sys, json, re, socket, argparse
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+from clusterInfo import PVE_DIR, parse_storage_cfg
+from glockStats import get_gfs2_datastores, collect_glock_stats, DEBUGFS_ROOT
+
+# Disk keys of QEMU and LXC guest configs. Detached (unusedN) disks do no I/O and are not counted.
+DISK_KEY = re.compile(r"^(ide|sata|scsi|virtio|efidisk|tpmstate|mp)\d+$|^rootfs$")
+
+# A node with at most this share of a datastore's disks is worth moving off it
+MINORITY_SHARE = 0.25
+
+# Glocks counted as contention for a datastore: the images and the allocation metadata they share
+CONTENTION_GLOCK_TYPES = ("inode", "rgrp")
+
+def parse_guest_disks(text:str) -> list:
+    """
+    Gets the disks of a QEMU or LXC guest config, snapshots sections are skipped
+
+    Args:
+        text (str): Content of <vmid>.conf
+
+    Returns:
+        list: [{'key': str, 'storage': str, 'volume': str}]
+    """
+    disks = []
+    for line in text.splitlines():
+        if line.startswith("["):
+            break
+        key, _, value = line.partition(":")
+        if not DISK_KEY.match(key.strip()):
+            continue
+        volume = value.strip().split(",")[0]
+        if ":" not in volume or volume.startswith("/"):
+            continue
+        storage, _, name = volume.partition(":")
+        disks.append({"key": key.strip(), "storage": storage, "volume": name})
+    return disks
+
+def get_guest_placement(pveDir:str=PVE_DIR) -> list:
+    """
+    Gets the node and the disks of every guest from the cluster file system
+
+    Args:
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        list: [{'vmid': str, 'node': str, 'type': str, 'disks': list}]
+    """
+    try:
+        with open(Path(pveDir) / ".vmlist", "r") as f:
+            vmList = json.load(f).get("ids", {})
+    except (OSError, ValueError):
+        return []
+
+    guests = []
+    for vmid, entry in sorted(vmList.items(), key=lambda item: int(item[0])):
+        configDir = "qemu-server" if entry.get("type") == "qemu" else "lxc"
+        try:
+            with open(Path(pveDir) / "nodes" / entry.get("node", "") / configDir / f"{vmid}.conf", "r") as f:
+                disks = parse_guest_disks(f.read())
+        except OSError:
+            continue
+        guests.append({"vmid": vmid, "node": entry.get("node", ""), "type": entry.get("type", ""), "disks": disks})
+    return guests
+
+def build_datastore_usage(datastores:list, storages:dict, guests:list) -> dict:
+    """
+    Works out which nodes use which datastore through the disks of their guests
+
+    Args:
+        datastores (list): From get_gfs2_datastores()
+        storages (dict): From parse_storage_cfg()
+        guests (list): From get_guest_placement()
+
+    Returns:
+        dict: {alias: {'datastore': dict, 'storeids': [str], 'nodes': {node: [{'vmid': str, 'key': str, 'volume': str}]}}}
+    """
+    usage = {}
+    byMountPoint = {}
+    for datastore in datastores:
+        usage[datastore["alias"]] = {"datastore": datastore, "storeids": [], "nodes": {}}
+        byMountPoint[os.path.normpath(datastore["mountPoint"])] = datastore["alias"]
+
+    storeToAlias = {}
+    for storeid, storage in storages.items():
+        alias = byMountPoint.get(os.path.normpath(storage.get("path", "")))
+        if alias:
+            storeToAlias[storeid] = alias
+            usage[alias]["storeids"].append(storeid)
+
+    for guest in guests:
+        for disk in guest["disks"]:
+            alias = storeToAlias.get(disk["storage"])
+            if alias:
+                usage[alias]["nodes"].setdefault(guest["node"], []).append(
+                    {"vmid": guest["vmid"], "key": disk["key"], "volume": disk["volume"]})
+    return usage
+
+def score_datastore(entry:dict, glocks:list=None) -> dict:
+    """
+    Scores a datastore for cross-node contention
+
+    Args:
+        entry (dict): Value of build_datastore_usage()
+        glocks (list): Glocks of the datastore from collect_glock_stats(), None if not measured
+
+    Returns:
+        dict: {'alias': str, 'score': int, 'diskCount': int, 'dominantNode': str,
+               'shares': {node: float}, 'glockWaitMs': float, 'contendedImages': [str]}.
+              score is the percentage of disks used from other nodes than the dominant one.
+    """
+    counts = {node: len(disks) for node, disks in entry["nodes"].items()}
+    total = sum(counts.values())
+    dominantNode = max(counts, key=counts.get) if counts else ""
+    result = {
+        "alias": entry["datastore"]["alias"],
+        "score": round(100 * (1 - counts[dominantNode] / total)) if total else 0,
+        "diskCount": total,
+        "dominantNode": dominantNode,
+        "shares": {node: round(count / total, 2) for node, count in sorted(counts.items())},
+        "glockWaitMs": None,
+        "contendedImages": []
+    }
+    if glocks is not None:
+        contended = [glock for glock in glocks if glock["type"] in CONTENTION_GLOCK_TYPES and glock["dlmRequests"]]
+        result["glockWaitMs"] = round(sum(glock["waitNs"] for glock in contended) / 1e6, 1)
+        result["contendedImages"] = sorted({glock["path"] for glock in contended if glock["path"]})
+    return result
+
+def suggest_changes(usage:dict, scores:dict) -> list:
+    """
+    Suggests guest migrations and disk moves that keep each datastore's writers on one node
+
+    Args:
+        usage (dict): From build_datastore_usage()
+        scores (dict): {alias: score_datastore()}
+
+    Returns:
+        list: [{'action': str, 'vmid': str, 'from': str, 'to': str, 'datastore': str, 'reason': str}],
+              action is migrate (the guest to another node), moveDisk (to another datastore) or split
+    """
+    # The datastore each node dominates, so disks can follow the node instead of the guest following the datastore
+    homeDatastores = {}
+    for alias, score in sorted(scores.items(), key=lambda item: -item[1]["diskCount"]):
+        if score["dominantNode"] and score["shares"][score["dominantNode"]] > 0.5:
+            homeDatastores.setdefault(score["dominantNode"], alias)
+
+    suggestions = []
+    for alias, score in sorted(scores.items(), key=lambda item: (-(item[1]["glockWaitMs"] or 0), -item[1]["score"])):
+        if len(score["shares"]) < 2:
+            continue
+        dominantNode = score["dominantNode"]
+        if score["shares"][dominantNode] <= 0.5:
+            suggestions.append({"action": "split", "vmid": "", "from": "", "to": "", "datastore": alias,
+                                "reason": f"no node has most of the disks ({', '.join(score['shares'])} share it), give each node its own datastore"})
+        for node, disks in sorted(usage[alias]["nodes"].items()):
+            if node == dominantNode or (score["shares"][node] > MINORITY_SHARE and score["shares"][dominantNode] > 0.5):
+                continue
+            home = homeDatastores.get(node)
+            for vmid in sorted({disk["vmid"] for disk in disks}, key=int):
+                if home and home != alias:
+                    suggestions.append({"action": "moveDisk", "vmid": vmid, "from": alias, "to": home, "datastore": alias,
+                                        "reason": f"{node} mostly writes to {home}"})
+                elif score["shares"][dominantNode] > 0.5:
+                    suggestions.append({"action": "migrate", "vmid": vmid, "from": node, "to": dominantNode, "datastore": alias,
+                                        "reason": f"{dominantNode} has {round(100 * score['shares'][dominantNode])}% of the disks"})
+    return suggestions
+
+def advise(configData:dict, pveDir:str=PVE_DIR, debugfsRoot:str=DEBUGFS_ROOT) -> dict:
+    """
+    Scores the GFS2 datastores for cross-node contention and suggests changes.
+    Glock statistics only cover the node this runs on and are left out where they can not be read.
+
+    Args:
+        configData (dict): Hitachi configuration
+        pveDir (str): Directory of the Proxmox cluster file system
+        debugfsRoot (str): debugfs mount point or a directory of captured glock files
+
+    Returns:
+        dict: {'node': str, 'datastores': [score_datastore()], 'suggestions': [suggest_changes()]}
+    """
+    try:
+        with open(Path(pveDir) / "storage.cfg", "r") as f:
+            storages = parse_storage_cfg(f.read())
+    except OSError:
+        storages = {}
+    usage = build_datastore_usage(get_gfs2_datastores(configData), storages, get_guest_placement(pveDir))
+
+    scores = {}
+    for alias, entry in usage.items():
+        try:
+            glocks = collect_glock_stats(entry["datastore"], debugfsRoot, top=None)
+        except OSError:
+            glocks = None
+        scores[alias] = score_datastore(entry, glocks)
+
+    return {
+        "node": socket.gethostname(),
+        "datastores": sorted(scores.values(), key=lambda score: (-(score["glockWaitMs"] or 0), -score["score"])),
+        "suggestions": suggest_changes(usage, scores)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scores GFS2 datastores for glock bouncing between nodes and suggests VM migrations or datastore splits.")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    parser.add_argument("--pve-dir", default=PVE_DIR, help="Directory of the Proxmox cluster file system")
+    parser.add_argument("--debugfs", default=DEBUGFS_ROOT, help="debugfs mount point, or a directory of captured gfs2/<cluster:fs>/ files")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    report = advise(readConfigFile(args.config), args.pve_dir, args.debugfs)
+    if args.json:
+        print(json.dumps(report, indent=4))
+        sys.exit(0)
+
+    print(f"{'Datastore':<24} {'Score':>5} {'Disks':>5} {'Glock wait ms':>13} Nodes")
+    for score in report["datastores"]:
+        wait = f"{score['glockWaitMs']:.1f}" if score["glockWaitMs"] is not None else "-"
+        shares = ", ".join(f"{node} {round(100 * share)}%" for node, share in score["shares"].items()) or "-"
+        print(f"{score['alias']:<24} {score['score']:>5} {score['diskCount']:>5} {wait:>13} {shares}")
+    if report["suggestions"]:
+        print()
+        print("Suggestions:")
+    for suggestion in report["suggestions"]:
+        if suggestion["action"] == "migrate":
+            print(f"  migrate {suggestion['vmid']} from {suggestion['from']} to {suggestion['to']} ({suggestion['datastore']}): {suggestion['reason']}")
+        elif suggestion["action"] == "moveDisk":
+            print(f"  move the disks of {suggestion['vmid']} from {suggestion['from']} to {suggestion['to']}: {suggestion['reason']}")
+        else:
+            print(f"  split {suggestion['datastore']}: {suggestion['reason']}")
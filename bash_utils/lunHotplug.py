@@ -0,0 +1,257 @@
+import os, sys, time, fcntl, argparse, subprocess
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+from hitachiInventory import scan_block_devices
+from hitachiNaa import get_serial_offsets, format_ldev
+from batchAddVolumes import add_multipath_entries, add_to_wwids_file, write_file_atomic, read_file, MULTIPATH_CONF, WWIDS_FILE
+from sharedConfig import set_volumes, CONFIG_PATH
+
+QUEUE_DIR = "/run/hitachi/hotplug"
+LOCK_PATH = "/run/hitachi/hotplug.lock"
+
+DEFAULT_HOTPLUG_SETTINGS = {
+    # Seconds without a new event before the batch is processed
+    "debounceSeconds": 5,
+    # Upper bound on the wait while events keep coming in
+    "maxDelaySeconds": 60
+}
+
+# Runs for every path of a new OPEN-V LUN; it only drops the WWID into the queue,
+# the path unit starts the service which waits for the burst to end
+UDEV_RULE = """# Queues newly presented Hitachi LUNs for hitachi-hotplug.service
+ACTION=="add", SUBSYSTEM=="block", ENV{{DEVTYPE}}=="disk", ENV{{ID_VENDOR}}=="HITACHI", ENV{{ID_MODEL}}=="OPEN-V*", ENV{{ID_SERIAL}}=="?*", RUN+="/bin/sh -c 'mkdir -p {queueDir} && touch {queueDir}/$env{{ID_SERIAL}}'"
+"""
+
+PATH_UNIT = """[Unit]
+Description=Queue of newly presented Hitachi LUNs
+
+[Path]
+DirectoryNotEmpty={queueDir}
+MakeDirectory=yes
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+SERVICE_UNIT = """[Unit]
+Description=Add newly presented Hitachi LUNs to multipath and the config
+After=multipathd.service
+
+[Service]
+Type=oneshot
+ExecStart=/usr/bin/python3 {script} --run
+"""
+
+def get_hotplug_settings(configData:dict) -> dict:
+    """
+    Builds the hotplug settings from the "hotplug" section of the config, filling in
+    defaults for anything that is not set
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        dict: Settings keyed like DEFAULT_HOTPLUG_SETTINGS
+
+    Raises:
+        ValueError: If a setting is unknown or not a positive number
+    """
+    settings = dict(DEFAULT_HOTPLUG_SETTINGS)
+    settings.update(configData.get("hotplug", {}))
+    for key, value in settings.items():
+        if key not in DEFAULT_HOTPLUG_SETTINGS:
+            raise ValueError(f"unknown setting '{key}'")
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{key} must be a positive number")
+    return settings
+
+def wait_for_quiet(queueDir:str, debounceSeconds:float, maxDelaySeconds:float) -> None:
+    """
+    Waits until no event was queued for debounceSeconds, or at most maxDelaySeconds
+
+    Args:
+        queueDir (str): Queue directory
+        debounceSeconds (float): Quiet time that ends a burst
+        maxDelaySeconds (float): Longest time to wait
+    """
+    deadline = time.time() + maxDelaySeconds
+    while True:
+        newest = 0
+        for entry in os.scandir(queueDir):
+            try:
+                newest = max(newest, entry.stat().st_mtime)
+            except OSError:
+                continue
+        now = time.time()
+        quietUntil = newest + debounceSeconds
+        if now >= quietUntil or now >= deadline:
+            return
+        time.sleep(min(quietUntil, deadline) - now)
+
+def drain_queue(queueDir:str) -> set:
+    """
+    Takes all queued WWIDs out of the queue
+
+    Args:
+        queueDir (str): Queue directory
+
+    Returns:
+        set: Queued WWIDs
+    """
+    wwids = set()
+    for entry in os.scandir(queueDir):
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            continue
+        wwids.add(entry.name)
+    return wwids
+
+def plan_new_volumes(wwids:set, luns:dict, configData:dict) -> dict:
+    """
+    Picks the queued LUNs that are visible, from Hitachi and not yet in the config
+
+    Args:
+        wwids (set): Queued WWIDs
+        luns (dict): From scan_block_devices()
+        configData (dict): Hitachi configuration
+
+    Returns:
+        dict: {wwid: volumeData} with volumeType unused
+    """
+    multipathData = configData.get("multipathData", {})
+    known = set(multipathData.get("multipathVolumes", {}))
+    for volume in multipathData.get("blacklistedVolumes", []):
+        known.add(volume.get("scsi_id", volume.get("wwid", "")))
+
+    volumes = {}
+    for wwid in sorted(wwids):
+        lun = luns.get(wwid)
+        if wwid in known or lun is None or not lun["isHitachi"]:
+            continue
+        if lun["ldevId"] is not None:
+            alias = f"hitachi-{lun['arraySerial']}-{format_ldev(lun['ldevId']).replace(':', '')}"
+        else:
+            alias = f"hitachi-{wwid[-6:]}"
+        # An operator assigns the volume type later
+        volumes[wwid] = {"scsi_id": wwid, "alias": alias, "volumeType": "unused"}
+    return volumes
+
+def process_batch(wwids:set, configPath:str=CONFIG_PATH, multipathConf:str=MULTIPATH_CONF, wwidsFile:str=WWIDS_FILE) -> bool:
+    """
+    Adds a batch of queued LUNs with one config update and one multipath reconciliation
+
+    Args:
+        wwids (set): Queued WWIDs
+        configPath (str): Path to Hitachi configuration JSON file
+        multipathConf (str): Path of multipath.conf
+        wwidsFile (str): Path of the multipath wwids file
+
+    Returns:
+        bool: True if the batch was added, False otherwise
+    """
+    configData = readConfigFile(configPath)
+    try:
+        serialOffsets = get_serial_offsets(configData)
+    except ValueError as e:
+        print(f"Warning: {e}")
+        serialOffsets = {}
+    volumes = plan_new_volumes(wwids, scan_block_devices(serialOffsets=serialOffsets), configData)
+    print(f"{len(wwids)} queued LUN(s), {len(volumes)} new")
+    if not volumes:
+        return True
+
+    aliases = {wwid: volume["alias"] for wwid, volume in volumes.items()}
+    multipathContent, _ = add_multipath_entries(read_file(multipathConf), aliases)
+    try:
+        write_file_atomic(multipathConf, multipathContent)
+        write_file_atomic(wwidsFile, add_to_wwids_file(read_file(wwidsFile), list(aliases)), backup=False)
+        set_volumes(volumes, configPath)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Could not add {len(volumes)} volume(s): {e}")
+        return False
+    for wwid, alias in aliases.items():
+        print(f"Added {wwid} as {alias} (unused)")
+
+    from multipathReconcile import reconcile
+    try:
+        return reconcile(readConfigFile(configPath), onlyWwids=aliases)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return False
+
+def run(configPath:str=CONFIG_PATH, queueDir:str=QUEUE_DIR) -> int:
+    """
+    Processes the queue until it is empty, one batch per burst of events
+
+    Args:
+        configPath (str): Path to Hitachi configuration JSON file
+        queueDir (str): Queue directory
+
+    Returns:
+        int: Exit code
+    """
+    try:
+        settings = get_hotplug_settings(readConfigFile(configPath))
+    except ValueError as e:
+        print(f"ERROR: Invalid hotplug section: {e}")
+        return 1
+
+    Path(LOCK_PATH).parent.mkdir(parents=True, exist_ok=True)
+    Path(queueDir).mkdir(parents=True, exist_ok=True)
+    with open(LOCK_PATH, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        success = True
+        while os.listdir(queueDir):
+            wait_for_quiet(queueDir, settings["debounceSeconds"], settings["maxDelaySeconds"])
+            # Let udev finish creating the paths before they are scanned
+            subprocess.run(["udevadm", "settle", "--timeout=30"], capture_output=True)
+            success = process_batch(drain_queue(queueDir), configPath) and success
+    return 0 if success else 1
+
+def install_units() -> bool:
+    """
+    Installs the udev rule and the systemd path and service units of the hotplug handler
+
+    Returns:
+        bool: True if the units were installed and started, False otherwise
+    """
+    unitDir = Path("/etc/systemd/system")
+    with open(unitDir / "hitachi-hotplug.service", "w") as f:
+        f.write(SERVICE_UNIT.format(script=os.path.realpath(__file__)))
+    with open(unitDir / "hitachi-hotplug.path", "w") as f:
+        f.write(PATH_UNIT.format(queueDir=QUEUE_DIR))
+    rulesPath = Path("/etc/udev/rules.d/99-hitachi-hotplug.rules")
+    with open(rulesPath, "w") as f:
+        f.write(UDEV_RULE.format(queueDir=QUEUE_DIR))
+    print(f"Created systemd units hitachi-hotplug.service and hitachi-hotplug.path in {unitDir} and {rulesPath}")
+
+    for command in [["systemctl", "daemon-reload"], ["systemctl", "enable", "--now", "hitachi-hotplug.path"],
+                    ["udevadm", "control", "--reload"]]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: '{' '.join(command)}' failed: {result.stderr.strip()}")
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adds newly presented Hitachi LUNs as unused volumes, one batch per burst of udev events.")
+    parser.add_argument("--run", action="store_true", help="Process the queued LUNs (run by hitachi-hotplug.service)")
+    parser.add_argument("--enqueue", nargs="+", metavar="WWID", help="Queue LUNs by hand, e.g. after a missed event")
+    parser.add_argument("--install", action="store_true", help="Install the udev rule and the systemd units")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    if args.install:
+        sys.exit(0 if install_units() else 1)
+    if args.enqueue:
+        if any("/" in wwid or wwid.startswith(".") for wwid in args.enqueue):
+            parser.error("not a WWID")
+        Path(QUEUE_DIR).mkdir(parents=True, exist_ok=True)
+        for wwid in args.enqueue:
+            (Path(QUEUE_DIR) / wwid).touch()
+        sys.exit(0)
+    if not args.run:
+        parser.error("one of --run, --enqueue or --install is required")
+    sys.exit(run(args.config))
@@ -0,0 +1,193 @@
+import os, sys, json, time, socket, argparse
+from pathlib import Path
+
+from hitachiInventory import scan_block_devices
+
+SNAPSHOT_DIR = "/var/lib/hitachi/snapshots"
+DEFAULT_KEEP = 100
+
+# A snapshot stores one row per LUN with these fields, so thousands of LUNs stay small
+SNAPSHOT_FIELDS = ["wwid", "sizeBytes", "paths", "runningPaths", "alias", "isHitachi"]
+
+def build_snapshot(luns:dict, nodeName:str=None, timestamp:float=None) -> dict:
+    """
+    Builds a compact snapshot of the LUN inventory
+
+    Args:
+        luns (dict): From scan_block_devices()
+        nodeName (str): Name of this node, defaults to the hostname
+        timestamp (float): Time of the snapshot, defaults to now
+
+    Returns:
+        dict: {'version': 1, 'node': str, 'time': float, 'fields': [str], 'luns': [[...]]}
+    """
+    rows = []
+    for wwid, lun in sorted(luns.items()):
+        runningPaths = len([path for path in lun["paths"] if path["state"] == "running"])
+        rows.append([wwid, lun["sizeBytes"], len(lun["paths"]), runningPaths, lun["alias"], lun["isHitachi"]])
+    return {
+        "version": 1,
+        "node": nodeName or socket.gethostname(),
+        "time": timestamp if timestamp is not None else time.time(),
+        "fields": SNAPSHOT_FIELDS,
+        "luns": rows
+    }
+
+def snapshot_luns(snapshot:dict) -> dict:
+    """
+    Expands the rows of a snapshot
+
+    Args:
+        snapshot (dict): From build_snapshot() or read_snapshot()
+
+    Returns:
+        dict: {wwid: {field: value}}
+    """
+    fields = snapshot.get("fields", SNAPSHOT_FIELDS)
+    return {row[0]: dict(zip(fields, row)) for row in snapshot.get("luns", [])}
+
+def diff_snapshots(old:dict, new:dict) -> dict:
+    """
+    Compares two snapshots. Every LUN is looked up once by WWID, so this is linear in the number of LUNs.
+
+    Args:
+        old (dict): Earlier snapshot
+        new (dict): Later snapshot
+
+    Returns:
+        dict: {'from': float, 'to': float,
+               'added': [lun], 'removed': [lun],
+               'resized': [{'wwid', 'alias', 'oldSizeBytes', 'newSizeBytes'}],
+               'pathsChanged': [{'wwid', 'alias', 'oldPaths', 'newPaths', 'oldRunningPaths', 'newRunningPaths'}]}
+    """
+    oldLuns = snapshot_luns(old)
+    newLuns = snapshot_luns(new)
+    diff = {"from": old.get("time"), "to": new.get("time"), "added": [], "removed": [], "resized": [], "pathsChanged": []}
+
+    for wwid, lun in newLuns.items():
+        before = oldLuns.get(wwid)
+        if before is None:
+            diff["added"].append(lun)
+            continue
+        if before["sizeBytes"] != lun["sizeBytes"]:
+            diff["resized"].append({"wwid": wwid, "alias": lun["alias"],
+                                    "oldSizeBytes": before["sizeBytes"], "newSizeBytes": lun["sizeBytes"]})
+        if before["paths"] != lun["paths"] or before["runningPaths"] != lun["runningPaths"]:
+            diff["pathsChanged"].append({"wwid": wwid, "alias": lun["alias"],
+                                         "oldPaths": before["paths"], "newPaths": lun["paths"],
+                                         "oldRunningPaths": before["runningPaths"], "newRunningPaths": lun["runningPaths"]})
+    diff["removed"] = [lun for wwid, lun in oldLuns.items() if wwid not in newLuns]
+    return diff
+
+def write_snapshot(snapshot:dict, snapshotDir:str=SNAPSHOT_DIR, keep:int=DEFAULT_KEEP) -> Path:
+    """
+    Saves a snapshot as snapshot-<UTC time>.<microseconds>Z.json and removes the oldest
+    beyond keep. A snapshot never replaces another one taken at the same time.
+
+    Args:
+        snapshot (dict): From build_snapshot()
+        snapshotDir (str): Directory of the snapshots
+        keep (int): Number of snapshots to keep
+
+    Returns:
+        Path: The snapshot file
+    """
+    directory = Path(snapshotDir)
+    directory.mkdir(parents=True, exist_ok=True)
+    seconds = int(snapshot["time"])
+    microseconds = int((snapshot["time"] - seconds) * 1000000)
+    tmpPath = directory / f".snapshot-{os.getpid()}.tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    try:
+        while True:
+            # Fixed width keeps the names sorted by time
+            # UTC, local time repeats an hour when DST ends and the names would sort out of order
+            name = time.strftime("snapshot-%Y%m%dT%H%M%S", time.gmtime(seconds + microseconds // 1000000))
+            path = directory / f"{name}.{microseconds % 1000000:06d}Z.json"
+            try:
+                # Unlike a rename, a link fails if the name is taken
+                os.link(tmpPath, path)
+                break
+            except FileExistsError:
+                microseconds += 1
+    finally:
+        tmpPath.unlink()
+
+    for oldPath in list_snapshots(snapshotDir)[:-keep] if keep > 0 else []:
+        oldPath.unlink()
+    return path
+
+def list_snapshots(snapshotDir:str=SNAPSHOT_DIR) -> list:
+    """
+    Lists the saved snapshots
+
+    Args:
+        snapshotDir (str): Directory of the snapshots
+
+    Returns:
+        list: [Path] oldest first
+    """
+    directory = Path(snapshotDir)
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob("snapshot-*.json"))
+
+def read_snapshot(path) -> dict:
+    """
+    Reads a saved snapshot
+
+    Args:
+        path (str): Snapshot file
+
+    Returns:
+        dict: The snapshot
+
+    Raises:
+        ValueError: If the file is not a snapshot
+    """
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or "luns" not in snapshot:
+        raise ValueError(f"{path} is not a LUN snapshot")
+    return snapshot
+
+def _resolve_snapshot(name:str, snapshotDir:str) -> dict:
+    """Reads a snapshot given as a path, as 'current' for a fresh scan, or as an index into the list (-1 is the latest)."""
+    if name == "current":
+        return build_snapshot(scan_block_devices())
+    if name.lstrip("-").isdigit():
+        snapshots = list_snapshots(snapshotDir)
+        try:
+            return read_snapshot(snapshots[int(name)])
+        except IndexError:
+            raise ValueError(f"there is no snapshot {name}, {len(snapshots)} saved")
+    return read_snapshot(name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Saves snapshots of the LUN inventory and reports added, removed, resized and path-changed LUNs between them.")
+    parser.add_argument("--take", action="store_true", help="Save a snapshot of the current inventory")
+    parser.add_argument("--list", action="store_true", help="List the saved snapshots")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two snapshots: a file, an index into --list (-1 is the latest) or 'current'")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="Directory of the snapshots")
+    parser.add_argument("--keep", type=int, default=DEFAULT_KEEP, help="Number of snapshots to keep")
+    args = parser.parse_args()
+
+    if not (args.take or args.list or args.diff):
+        # Default: what changed since the last snapshot, then remember the current state
+        args.diff = ["-1", "current"] if list_snapshots(args.snapshot_dir) else None
+        args.take = True
+
+    try:
+        if args.diff:
+            print(json.dumps(diff_snapshots(*[_resolve_snapshot(name, args.snapshot_dir) for name in args.diff]), indent=4))
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    if args.list:
+        for path in list_snapshots(args.snapshot_dir):
+            print(path)
+    if args.take:
+        path = write_snapshot(build_snapshot(scan_block_devices()), args.snapshot_dir, args.keep)
+        print(f"Saved {path}", file=sys.stderr)
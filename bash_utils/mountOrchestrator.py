@@ -0,0 +1,309 @@
+import os, sys, json, time, argparse, subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from addVolumeToConfig import readConfigFile
+from storageStatus import escape_unit_path, escape_mount_unit
+
+UNIT_DIR = "/etc/systemd/system"
+HISTORY_PATH = "/var/lib/hitachi/mount_history.json"
+HISTORY_RUNS = 20
+SERVICE_NAME = "hitachi-mount.service"
+
+# Seconds to wait for DLM and for each datastore's multipath device at boot
+DLM_TIMEOUT = 120
+DEVICE_TIMEOUT = 90
+MOUNT_RETRIES = 3
+MOUNT_RETRY_DELAY = 5
+
+SERVICE_UNIT = """[Unit]
+Description=Mount the Hitachi datastores in parallel
+Wants=dlm.service multipathd.service
+After=dlm.service multipathd.service
+Before=pve-guests.service
+
+[Service]
+Type=oneshot
+RemainAfterExit=yes
+ExecStart=/usr/bin/python3 {script} --boot
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+def build_mount_unit(alias:str, uuid:str, mountPoint:str, fileSystem:str, mountOptions:str) -> str:
+    """
+    Builds the mount unit of a datastore. It waits for the datastore's own multipath
+    device instead of multipathd as a whole, and only GFS2 waits for DLM. The unit has
+    no [Install] section: hitachi-mount.service starts it at boot once DLM is ready.
+
+    Args:
+        alias (str): Alias of the multipath device
+        uuid (str): File system UUID
+        mountPoint (str): Mount point
+        fileSystem (str): gfs2 or xfs
+        mountOptions (str): Mount options
+
+    Returns:
+        str: Unit file content
+    """
+    device = escape_unit_path(f"/dev/mapper/{alias}") + ".device"
+    after = [device]
+    wants = []
+    if fileSystem == "gfs2":
+        wants.append("dlm.service")
+        after.append("dlm.service")
+    return "[Unit]\n" \
+        f"Description = Mount {fileSystem.upper()} Fibre Channel LUN {alias}\n" \
+        f"Requires={device}\n" \
+        + (f"Wants={' '.join(wants)}\n" if wants else "") + \
+        f"After={' '.join(after)}\n" \
+        "\n" \
+        "[Mount]\n" \
+        f"What=/dev/disk/by-uuid/{uuid}\n" \
+        f"Where={mountPoint}\n" \
+        f"Type={fileSystem}\n" \
+        f"Options={mountOptions}\n"
+
+def parse_unit_file(text:str) -> dict:
+    """
+    Reads the key=value settings of a unit file, later keys win
+
+    Args:
+        text (str): Content of the unit file
+
+    Returns:
+        dict: {key: value}
+    """
+    settings = {}
+    for line in text.splitlines():
+        key, separator, value = line.partition("=")
+        if separator and not line.startswith(("#", ";", "[")):
+            settings[key.strip()] = value.strip()
+    return settings
+
+def get_datastores(configData:dict) -> list:
+    """
+    Gets the datastores of the config with their mount units
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        list: [{'alias': str, 'mountPoint': str, 'fileSystem': str, 'unit': str}]
+    """
+    datastores = []
+    for volume in configData.get("multipathData", {}).get("multipathVolumes", {}).values():
+        datastoreInfo = volume.get("datastoreInfo", {})
+        if volume.get("volumeType") != "datastore" or not datastoreInfo.get("mountPoint"):
+            continue
+        datastores.append({
+            "alias": volume.get("alias", volume.get("friendlyName", "")),
+            "mountPoint": datastoreInfo["mountPoint"],
+            "fileSystem": datastoreInfo.get("fileSystem", "gfs2"),
+            "unit": escape_mount_unit(datastoreInfo["mountPoint"])
+        })
+    return datastores
+
+def regenerate_units(configData:dict, unitDir:str=UNIT_DIR) -> int:
+    """
+    Rewrites the existing mount units of the datastores with per-device dependencies,
+    keeping their UUID and mount options. Units enabled by older installs are disabled,
+    otherwise systemd mounts them at boot without waiting for DLM.
+
+    Args:
+        configData (dict): Hitachi configuration
+        unitDir (str): Directory of the units
+
+    Returns:
+        int: Number of units rewritten
+    """
+    rewritten = 0
+    for datastore in get_datastores(configData):
+        unitPath = Path(unitDir) / datastore["unit"]
+        try:
+            current = unitPath.read_text()
+        except OSError:
+            print(f"Warning: {unitPath} does not exist, skipping {datastore['alias']}")
+            continue
+        settings = parse_unit_file(current)
+        uuid = settings.get("What", "").rpartition("/")[2]
+        content = build_mount_unit(datastore["alias"], uuid, datastore["mountPoint"],
+                                   settings.get("Type", datastore["fileSystem"]), settings.get("Options", "_netdev,acl"))
+        wantsLink = Path(unitDir) / "multi-user.target.wants" / datastore["unit"]
+        if wantsLink.is_symlink():
+            wantsLink.unlink()
+            print(f"Disabled {datastore['unit']}, {SERVICE_NAME} mounts it")
+        if content != current:
+            tmpPath = unitPath.with_name(f".{unitPath.name}.tmp")
+            tmpPath.write_text(content)
+            os.replace(tmpPath, unitPath)
+            print(f"Rewrote {unitPath}")
+            rewritten += 1
+    return rewritten
+
+def wait_for(check, timeout:float, interval:float=0.5) -> bool:
+    """
+    Waits until check() returns True
+
+    Args:
+        check (callable): Condition
+        timeout (float): Seconds to wait
+        interval (float): Seconds between checks
+
+    Returns:
+        bool: True if the condition was met in time
+    """
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def dlm_ready() -> bool:
+    """Checks that dlm_controld is up and can take lockspace joins."""
+    try:
+        return subprocess.run(["dlm_tool", "status"], capture_output=True, timeout=10).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+def mount_datastore(datastore:dict, dlmReady:bool) -> dict:
+    """
+    Waits for the datastore's device and starts its mount unit, retrying transient failures
+
+    Args:
+        datastore (dict): From get_datastores()
+        dlmReady (bool): DLM is up, GFS2 datastores are not mounted without it
+
+    Returns:
+        dict: {'alias': str, 'unit': str, 'mounted': bool, 'alreadyMounted': bool, 'seconds': float,
+               'deviceSeconds': float, 'attempts': int, 'error': str}
+    """
+    start = time.monotonic()
+    result = {"alias": datastore["alias"], "unit": datastore["unit"], "mounted": False, "alreadyMounted": False,
+              "seconds": 0.0, "deviceSeconds": 0.0, "attempts": 0, "error": ""}
+    if os.path.ismount(datastore["mountPoint"]):
+        # Mounted by someone else, there is no latency to record
+        result["mounted"] = True
+        result["alreadyMounted"] = True
+        return result
+    if datastore["fileSystem"] == "gfs2" and not dlmReady:
+        result["error"] = "DLM is not ready"
+        return result
+    if not wait_for(lambda: os.path.exists(f"/dev/mapper/{datastore['alias']}"), DEVICE_TIMEOUT):
+        result["error"] = f"/dev/mapper/{datastore['alias']} did not appear"
+        return result
+    result["deviceSeconds"] = round(time.monotonic() - start, 2)
+
+    for attempt in range(1, MOUNT_RETRIES + 1):
+        result["attempts"] = attempt
+        command = subprocess.run(["systemctl", "start", datastore["unit"]], capture_output=True, text=True)
+        if command.returncode == 0:
+            result["mounted"] = True
+            result["error"] = ""
+            break
+        result["error"] = command.stderr.strip()
+        if attempt < MOUNT_RETRIES:
+            # A GFS2 mount fails while another node is still recovering the lockspace
+            time.sleep(MOUNT_RETRY_DELAY)
+    result["seconds"] = round(time.monotonic() - start, 2)
+    return result
+
+def mount_all(configData:dict) -> list:
+    """
+    Mounts all datastores concurrently once DLM is ready
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        list: Results of mount_datastore()
+    """
+    datastores = get_datastores(configData)
+    if not datastores:
+        return []
+    dlmReady = True
+    if any(datastore["fileSystem"] == "gfs2" for datastore in datastores):
+        dlmReady = wait_for(dlm_ready, DLM_TIMEOUT, interval=1)
+        if not dlmReady:
+            print(f"ERROR: DLM not ready after {DLM_TIMEOUT}s, GFS2 datastores are not mounted")
+    with ThreadPoolExecutor(max_workers=len(datastores)) as executor:
+        return list(executor.map(lambda datastore: mount_datastore(datastore, dlmReady), datastores))
+
+def record_run(results:list, seconds:float, historyPath:str=HISTORY_PATH) -> None:
+    """
+    Appends a boot mount run to the history, keeping the last HISTORY_RUNS
+
+    Args:
+        results (list): From mount_all()
+        seconds (float): Duration of the whole run
+        historyPath (str): Path of the history file
+    """
+    path = Path(historyPath)
+    try:
+        history = json.loads(path.read_text())
+    except (OSError, ValueError):
+        history = []
+    history.append({"time": time.time(), "seconds": round(seconds, 2), "datastores": results})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmpPath = path.with_name(f".{path.name}.tmp")
+    tmpPath.write_text(json.dumps(history[-HISTORY_RUNS:], indent=4))
+    os.replace(tmpPath, path)
+
+def install_service() -> bool:
+    """
+    Installs and enables the boot mount service
+
+    Returns:
+        bool: True if the service was installed and enabled, False otherwise
+    """
+    unitPath = Path(UNIT_DIR) / SERVICE_NAME
+    with open(unitPath, "w") as f:
+        f.write(SERVICE_UNIT.format(script=os.path.realpath(__file__)))
+    print(f"Created systemd service unit at {unitPath}")
+
+    for command in [["systemctl", "daemon-reload"], ["systemctl", "enable", unitPath.name]]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: '{' '.join(command)}' failed: {result.stderr.strip()}")
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mounts the Hitachi datastores concurrently at boot and records how long each took.")
+    parser.add_argument("--boot", action="store_true", help="Mount all datastores (run by hitachi-mount.service)")
+    parser.add_argument("--regenerate", action="store_true", help="Rewrite the datastore mount units with per-device dependencies")
+    parser.add_argument("--history", action="store_true", help="Print the mount latency history")
+    parser.add_argument("--install", action="store_true", help="Install and enable the boot service")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    if args.history:
+        try:
+            print(Path(HISTORY_PATH).read_text())
+        except OSError:
+            print("[]")
+        sys.exit(0)
+    if not (args.boot or args.regenerate or args.install):
+        parser.error("one of --boot, --regenerate, --history or --install is required")
+
+    configData = readConfigFile(args.config)
+    if args.regenerate:
+        if regenerate_units(configData):
+            subprocess.run(["systemctl", "daemon-reload"], capture_output=True)
+    if args.install and not install_service():
+        sys.exit(1)
+    if args.boot:
+        start = time.monotonic()
+        results = mount_all(configData)
+        seconds = time.monotonic() - start
+        for result in results:
+            if result["alreadyMounted"]:
+                print(f"{result['alias']}: already mounted")
+                continue
+            state = "mounted" if result["mounted"] else f"FAILED: {result['error']}"
+            print(f"{result['alias']}: {state} in {result['seconds']}s (device after {result['deviceSeconds']}s, {result['attempts']} attempt(s))")
+        print(f"Mounted {len([result for result in results if result['mounted']])}/{len(results)} datastore(s) in {seconds:.1f}s")
+        record_run(results, seconds)
+        sys.exit(0 if all(result["mounted"] for result in results) else 1)
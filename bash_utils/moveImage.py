@@ -0,0 +1,256 @@
+import os, sys, json, errno, argparse, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from cloneImage import reflink_range, copy_range, iter_data_extents
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_THREADS = 4
+# Size of the buffer when the kernel can not copy between the two file systems
+BUFFER_SIZE = 4 * 1024 * 1024
+# Seconds between progress reports and state file updates
+REPORT_INTERVAL = 5
+
+# Errors meaning copy_file_range can not be used for this pair of files
+COPY_FILE_RANGE_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+class RateLimiter:
+    """
+    Token bucket shared by all copy threads. Allows bursts of up to one second
+    of traffic and otherwise holds callers to the configured rate.
+    """
+
+    def __init__(self, bytesPerSecond:int):
+        self.rate = bytesPerSecond
+        self.tokens = bytesPerSecond
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount:int) -> None:
+        """Blocks until amount bytes may be transferred. Does nothing without a limit."""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+def split_extents(extents, chunkSize:int) -> list:
+    """
+    Splits data extents into chunks of at most chunkSize bytes
+
+    Args:
+        extents (iterable): (offset, length) tuples
+        chunkSize (int): Maximum chunk size
+
+    Returns:
+        list: (offset, length) tuples
+    """
+    chunks = []
+    for offset, length in extents:
+        end = offset + length
+        while offset < end:
+            chunks.append((offset, min(chunkSize, end - offset)))
+            offset += chunkSize
+    return chunks
+
+def copy_chunk(srcFd:int, dstFd:int, offset:int, length:int, useCopyFileRange:bool=True) -> bool:
+    """
+    Copies a range to the same offset in the destination
+
+    Args:
+        srcFd (int): File descriptor of the source
+        dstFd (int): File descriptor of the destination
+        offset (int): Offset of the range
+        length (int): Bytes to copy
+        useCopyFileRange (bool): Try copy_file_range before falling back to read/write
+
+    Returns:
+        bool: True if copy_file_range was used, False if read/write was used
+    """
+    if useCopyFileRange:
+        try:
+            copy_range(srcFd, dstFd, offset, length)
+            return True
+        except OSError as e:
+            if e.errno not in COPY_FILE_RANGE_UNSUPPORTED:
+                raise
+
+    end = offset + length
+
+    # Different file system types, copy through user space but keep zero blocks as holes
+    while offset < end:
+        data = os.pread(srcFd, min(BUFFER_SIZE, end - offset), offset)
+        if not data:
+            break
+        if data.count(0) != len(data):
+            os.pwrite(dstFd, data, offset)
+        offset += len(data)
+    return False
+
+def _read_state(statePath:Path) -> dict:
+    """Reads the resume state of a move, empty if there is none."""
+    try:
+        with open(statePath, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_state(statePath:Path, state:dict) -> None:
+    """Writes the resume state of a move atomically."""
+    tmpPath = statePath.with_name(statePath.name + ".tmp")
+    with open(tmpPath, "w") as f:
+        json.dump(state, f)
+    os.replace(tmpPath, statePath)
+
+def move_image(source:str, target:str, bwlimitKiB:int=0, threads:int=DEFAULT_THREADS,
+               chunkSize:int=DEFAULT_CHUNK_SIZE, resume:bool=True, removeSource:bool=True) -> dict:
+    """
+    Moves an image between datastores copying only its data extents. Holes stay
+    holes on the target, chunks are copied in parallel and the copy is
+    throttled to the bandwidth limit. Progress is kept in <target>.move-state
+    so an interrupted move continues where it stopped.
+
+    Args:
+        source (str): Image to move
+        target (str): New location of the image
+        bwlimitKiB (int): Bandwidth limit in KiB/s like the storage's bwlimit option, 0 for none
+        threads (int): Number of parallel copy threads
+        chunkSize (int): Bytes per chunk
+        resume (bool): Continue an interrupted move of the same source
+        removeSource (bool): Remove the source once the target is complete
+
+    Returns:
+        dict: {
+            'sizeBytes': int,
+            'dataBytes': int,       # Allocated bytes of the source
+            'copiedBytes': int,     # Bytes copied by this run
+            'seconds': float,
+            'throughputMiBs': float,
+            'resumedChunks': int,
+            'method': str           # reflink, copy_file_range or read/write
+        }
+
+    Raises:
+        FileExistsError: If the target exists and is not an interrupted move of the source
+        OSError: If the copy failed. The state file is kept so the move can be resumed.
+    """
+    statePath = Path(target + ".move-state")
+    srcFd = os.open(source, os.O_RDONLY)
+    try:
+        srcStat = os.fstat(srcFd)
+        size = srcStat.st_size
+        chunks = split_extents(iter_data_extents(srcFd, size), chunkSize)
+        dataBytes = sum(length for _, length in chunks)
+
+        state = _read_state(statePath) if resume else {}
+        if state.get("source") != os.path.realpath(source) or state.get("sourceSize") != size \
+                or state.get("sourceMtimeNs") != srcStat.st_mtime_ns or state.get("chunkSize") != chunkSize:
+            if os.path.exists(target) and not statePath.exists():
+                raise FileExistsError(errno.EEXIST, "Target already exists", target)
+            state = {
+                "source": os.path.realpath(source),
+                "sourceSize": size,
+                "sourceMtimeNs": srcStat.st_mtime_ns,
+                "chunkSize": chunkSize,
+                "done": []
+            }
+            dstFd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, srcStat.st_mode & 0o777)
+        else:
+            dstFd = os.open(target, os.O_WRONLY)
+        done = set(state["done"])
+        lock = threading.Lock()
+        # Both datastores on one reflink capable file system, e.g. a rename across VM directories
+        sameFileSystem = os.fstat(dstFd).st_dev == srcStat.st_dev
+
+        try:
+            # Sets the size without allocating, everything not copied stays a hole
+            os.ftruncate(dstFd, size)
+            _write_state(statePath, state)
+
+            limiter = RateLimiter(bwlimitKiB * 1024)
+            progress = {"copied": 0, "lastReport": time.monotonic(), "method": "reflink" if sameFileSystem else "copy_file_range"}
+            start = time.monotonic()
+
+            def copy(index:int):
+                offset, length = chunks[index]
+                if sameFileSystem and reflink_range(srcFd, dstFd, offset, length, offset):
+                    method = "reflink"
+                else:
+                    limiter.consume(length)
+                    method = "copy_file_range" if copy_chunk(srcFd, dstFd, offset, length, progress["method"] != "read/write") else "read/write"
+                with lock:
+                    # Report the slowest method any chunk needed
+                    if method == "read/write" or progress["method"] == "reflink":
+                        progress["method"] = method
+                    progress["copied"] += length
+                    done.add(index)
+                    now = time.monotonic()
+                    if now - progress["lastReport"] >= REPORT_INTERVAL:
+                        progress["lastReport"] = now
+                        os.fdatasync(dstFd)
+                        state["done"] = sorted(done)
+                        _write_state(statePath, state)
+                        rate = progress["copied"] / (now - start) / 1024 / 1024
+                        print(f"{len(done)}/{len(chunks)} chunks, {progress['copied'] // (1024 * 1024)} MiB copied, {rate:.1f} MiB/s", flush=True)
+
+            pending = [index for index in range(len(chunks)) if index not in done]
+            with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+                futures = [executor.submit(copy, index) for index in pending]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            os.fsync(dstFd)
+        except BaseException:
+            with lock:
+                state["done"] = sorted(done)
+            _write_state(statePath, state)
+            raise
+        finally:
+            os.close(dstFd)
+    finally:
+        os.close(srcFd)
+
+    statePath.unlink()
+    if removeSource:
+        os.unlink(source)
+
+    seconds = time.monotonic() - start
+    return {
+        "sizeBytes": size,
+        "dataBytes": dataBytes,
+        "copiedBytes": progress["copied"],
+        "seconds": round(seconds, 3),
+        "throughputMiBs": round(progress["copied"] / seconds / 1024 / 1024, 1) if seconds > 0 else 0.0,
+        "resumedChunks": len(chunks) - len(pending),
+        "method": progress["method"]
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Moves a VM image between datastores, copying only its data extents.")
+    parser.add_argument("source", help="Image to move")
+    parser.add_argument("target", help="New location of the image")
+    parser.add_argument("--bwlimit", type=int, default=0, help="Bandwidth limit in KiB/s, 0 for none")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="Number of parallel copy threads")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024), help="Chunk size in MiB")
+    parser.add_argument("--no-resume", action="store_true", help="Start over even if an interrupted move of the source exists")
+    parser.add_argument("--keep-source", action="store_true", help="Copy only, do not remove the source")
+    args = parser.parse_args()
+
+    try:
+        result = move_image(args.source, args.target, args.bwlimit, args.threads, args.chunk_size * 1024 * 1024,
+                            not args.no_resume, not args.keep_source)
+    except (OSError, KeyboardInterrupt) as e:
+        print(f"ERROR: Move of {args.source} to {args.target} stopped: {e}")
+        print("Run the same command again to resume.")
+        sys.exit(1)
+    print(json.dumps(result, indent=4))
@@ -0,0 +1,205 @@
+import os, sys, json, argparse, subprocess
+
+from addVolumeToConfig import readConfigFile
+
+# Output format for "multipathd show paths raw format": WWID, device, map, checker state
+PATHS_FORMAT = "%w %d %m %T"
+
+def parse_maps_json(text:str) -> dict:
+    """
+    Parses the output of "multipathd show maps json"
+
+    Args:
+        text (str): JSON printed by multipathd
+
+    Returns:
+        dict: {wwid: {'name': str, 'sysfs': str, 'paths': [str]}}
+    """
+    maps = {}
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return maps
+    for entry in data.get("maps", []):
+        paths = []
+        for group in entry.get("path_groups", []):
+            paths.extend(path["dev"] for path in group.get("paths", []) if "dev" in path)
+        maps[entry.get("uuid", "")] = {"name": entry.get("name", ""), "sysfs": entry.get("sysfs", ""), "paths": paths}
+    return maps
+
+def parse_paths(text:str) -> dict:
+    """
+    Parses the output of "multipathd show paths raw format '%w %d %m %T'"
+
+    Args:
+        text (str): Output of multipathd
+
+    Returns:
+        dict: {wwid: [{'device': str, 'map': str, 'checker': str}]}, map is empty for orphan paths
+    """
+    paths = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or fields[1] == "dev":
+            continue
+        wwid, device, mapName, checker = fields[:4]
+        if mapName in ("[orphan]", "[undef]"):
+            mapName = ""
+        paths.setdefault(wwid, []).append({"device": device, "map": mapName, "checker": checker})
+    return paths
+
+def get_desired_maps(configData:dict) -> tuple:
+    """
+    Gets the maps the config asks for
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        tuple: ({wwid: alias} of the multipath volumes, set of blacklisted WWIDs)
+    """
+    multipathData = configData.get("multipathData", {})
+    desired = {}
+    for wwid, volume in multipathData.get("multipathVolumes", {}).items():
+        desired[wwid] = volume.get("alias", volume.get("friendlyName", ""))
+    blacklisted = set()
+    for volume in multipathData.get("blacklistedVolumes", []):
+        wwid = volume.get("scsi_id", volume.get("wwid", ""))
+        if wwid:
+            blacklisted.add(wwid)
+    return desired, blacklisted
+
+def plan_reconcile(desired:dict, blacklisted:set, maps:dict, paths:dict) -> list:
+    """
+    Works out the commands that bring the running maps in line with the config.
+    Only maps that differ are touched, nothing reloads multipathd as a whole.
+    Adds and renames run the multipath command for the single WWID, which
+    reads the alias from multipath.conf, so the conf has to be written first.
+
+    Args:
+        desired (dict): {wwid: alias} from get_desired_maps()
+        blacklisted (set): WWIDs that must not have a map
+        maps (dict): From parse_maps_json()
+        paths (dict): From parse_paths()
+
+    Returns:
+        list: [{'action': str, 'wwid': str, 'alias': str, 'reason': str, 'commands': [[str]]}],
+              action is add, rename, addPath, remove or skip
+    """
+    actions = []
+    for wwid, alias in sorted(desired.items()):
+        if wwid in blacklisted:
+            continue
+        current = maps.get(wwid)
+        wwidPaths = paths.get(wwid, [])
+        if current is None:
+            if not wwidPaths:
+                actions.append({"action": "skip", "wwid": wwid, "alias": alias, "reason": "no paths to the LUN", "commands": []})
+                continue
+            # multipath builds just this map; -a lets find_multipaths accept it afterwards
+            actions.append({"action": "add", "wwid": wwid, "alias": alias, "reason": f"{len(wwidPaths)} path(s) without a map",
+                            "commands": [["multipath", "-a", wwid], ["multipath", wwid]]})
+            continue
+
+        if alias and current["name"] != alias:
+            # multipath renames a single map in place when its alias changed, I/O keeps flowing
+            actions.append({"action": "rename", "wwid": wwid, "alias": alias, "reason": f"map is named {current['name']}",
+                            "commands": [["multipath", wwid]]})
+
+        for path in wwidPaths:
+            if not path["map"] and path["device"] not in current["paths"]:
+                actions.append({"action": "addPath", "wwid": wwid, "alias": alias, "reason": f"{path['device']} is not in the map",
+                                "commands": [["multipathd", "add", "path", path["device"]]]})
+
+    for wwid in sorted(blacklisted):
+        if wwid in maps:
+            actions.append({"action": "remove", "wwid": wwid, "alias": maps[wwid]["name"], "reason": "volume is blacklisted",
+                            "commands": [["multipathd", "del", "map", maps[wwid]["name"]], ["multipath", "-w", wwid]]})
+    return actions
+
+def run_actions(actions:list, dryRun:bool=False) -> bool:
+    """
+    Runs the commands of the planned actions
+
+    Args:
+        actions (list): From plan_reconcile()
+        dryRun (bool): Only print the commands
+
+    Returns:
+        bool: True if every command succeeded, False otherwise
+    """
+    success = True
+    for action in actions:
+        print(f"{action['action']:<8} {action['wwid']} ({action['alias']}): {action['reason']}")
+        for command in action["commands"]:
+            print(f"    {' '.join(command)}")
+            if dryRun:
+                continue
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"ERROR: '{' '.join(command)}' failed: {(result.stderr or result.stdout).strip()}")
+                success = False
+                break
+    return success
+
+def _multipathd(*args) -> str:
+    """Runs a multipathd command and returns its output."""
+    result = subprocess.run(["multipathd", *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"'multipathd {' '.join(args)}' failed: {result.stderr.strip()}")
+    return result.stdout
+
+def reconcile(configData:dict, dryRun:bool=False, mapsJson:str=None, pathsText:str=None, onlyWwids:dict=None) -> bool:
+    """
+    Reconciles the running multipath maps with the config
+
+    Args:
+        configData (dict): Hitachi configuration
+        dryRun (bool): Only print what would be done
+        mapsJson (str): Recorded "show maps json" output to use instead of asking multipathd
+        pathsText (str): Recorded "show paths" output to use instead of asking multipathd
+        onlyWwids (dict): Only reconcile these {wwid: alias}, taking the alias from here
+
+    Returns:
+        bool: True if the maps match the config, False if a command failed
+    """
+    if mapsJson is None:
+        mapsJson = _multipathd("show", "maps", "json")
+    if pathsText is None:
+        pathsText = _multipathd("show", "paths", "raw", "format", PATHS_FORMAT)
+
+    desired, blacklisted = get_desired_maps(configData)
+    if onlyWwids:
+        desired = {wwid: alias or desired.get(wwid, "") for wwid, alias in onlyWwids.items()}
+        blacklisted = blacklisted & set(onlyWwids)
+
+    actions = plan_reconcile(desired, blacklisted, parse_maps_json(mapsJson), parse_paths(pathsText))
+    if not [action for action in actions if action["action"] != "skip"]:
+        print("Multipath maps match the configuration")
+    return run_actions(actions, dryRun)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adds, removes and renames only the multipath maps that differ from hitachi_config.json, without reloading multipathd.")
+    parser.add_argument("--wwid", help="Only reconcile this WWID")
+    parser.add_argument("--alias", help="Alias for --wwid, instead of the one in the config")
+    parser.add_argument("--dry-run", action="store_true", help="Print the commands without running them")
+    parser.add_argument("--maps-json", help="Recorded 'multipathd show maps json' output to plan against")
+    parser.add_argument("--paths", help=f"Recorded \"multipathd show paths raw format '{PATHS_FORMAT}'\" output to plan against")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    mapsJson = pathsText = None
+    if args.maps_json:
+        with open(args.maps_json, "r") as f:
+            mapsJson = f.read()
+    if args.paths:
+        with open(args.paths, "r") as f:
+            pathsText = f.read()
+    onlyWwids = {args.wwid: args.alias or ""} if args.wwid else None
+
+    try:
+        success = reconcile(readConfigFile(args.config), args.dry_run, mapsJson, pathsText, onlyWwids)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    sys.exit(0 if success else 1)
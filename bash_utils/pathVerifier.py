@@ -0,0 +1,146 @@
+import os, sys, json, argparse
+
+from addVolumeToConfig import readConfigFile
+from fcHosts import read_fc_hosts, read_fc_remote_ports
+from hitachiInventory import scan_block_devices
+
+STATUS_CODES = {"ok": 0, "warning": 1, "critical": 2}
+
+def _count_by(paths:list, key:str) -> dict:
+    """Counts paths per value of key, skipping paths without one."""
+    counts = {}
+    for path in paths:
+        if path[key]:
+            counts[path[key]] = counts.get(path[key], 0) + 1
+    return counts
+
+def verify_lun_paths(lun:dict, fcHosts:dict, remotePorts:dict) -> dict:
+    """
+    Checks that a LUN has running paths through every online HBA and every
+    port of its array, spread evenly
+
+    Args:
+        lun (dict): LUN from scan_block_devices()
+        fcHosts (dict): From read_fc_hosts()
+        remotePorts (dict): From read_fc_remote_ports()
+
+    Returns:
+        dict: {
+            'wwid': str,
+            'alias': str,
+            'status': str,          # ok, warning or critical
+            'issues': [str],
+            'paths': int,
+            'runningPaths': int,
+            'pathsPerHost': {scsiHost: int},
+            'pathsPerPort': {wwpn: int}
+        }
+    """
+    issues = []
+    critical = False
+    running = [path for path in lun["paths"] if path["state"] == "running"]
+    pathsPerHost = _count_by(running, "scsiHost")
+    pathsPerRport = _count_by(running, "rport")
+    pathsPerPort = {}
+    for rport, count in pathsPerRport.items():
+        wwpn = remotePorts.get(rport, {}).get("wwpn") or rport
+        pathsPerPort[wwpn] = pathsPerPort.get(wwpn, 0) + count
+
+    if not lun["paths"]:
+        issues.append("LUN has no paths")
+        critical = True
+    elif not running:
+        issues.append(f"none of the {len(lun['paths'])} paths are running")
+        critical = True
+    elif len(running) < len(lun["paths"]):
+        issues.append(f"{len(lun['paths']) - len(running)} of {len(lun['paths'])} paths are not running")
+
+    # Only FC paths can be checked against the fabric
+    if running and pathsPerRport:
+        onlineHosts = [name for name, host in fcHosts.items() if host["portState"] == "Online"]
+        if len(onlineHosts) > 1 and len(pathsPerHost) == 1:
+            issues.append(f"all paths go through {next(iter(pathsPerHost))}")
+            critical = True
+        else:
+            for name in onlineHosts:
+                if name not in pathsPerHost:
+                    issues.append(f"no paths through {name}")
+
+        # Every HBA should reach the LUN through every port of the array it is logged in to
+        arrayNodes = {remotePorts[rport]["wwnn"] for rport in pathsPerRport if rport in remotePorts}
+        for rport, port in sorted(remotePorts.items()):
+            if port["wwnn"] in arrayNodes and port["portState"] == "Online" and "FCP Target" in port["roles"] \
+                    and port["scsiHost"] in pathsPerHost and rport not in pathsPerRport:
+                issues.append(f"no paths from {port['scsiHost']} through array port {port['wwpn']}")
+
+        if len(pathsPerHost) > 1 and max(pathsPerHost.values()) != min(pathsPerHost.values()):
+            counts = ", ".join(f"{name}={count}" for name, count in sorted(pathsPerHost.items()))
+            issues.append(f"paths are unevenly spread across HBAs ({counts})")
+        if len(pathsPerPort) > 1 and max(pathsPerPort.values()) != min(pathsPerPort.values()):
+            counts = ", ".join(f"{wwpn}={count}" for wwpn, count in sorted(pathsPerPort.items()))
+            issues.append(f"paths are unevenly spread across array ports ({counts})")
+
+    return {
+        "wwid": lun["wwid"],
+        "alias": lun["alias"],
+        "status": "critical" if critical else "warning" if issues else "ok",
+        "issues": issues,
+        "paths": len(lun["paths"]),
+        "runningPaths": len(running),
+        "pathsPerHost": pathsPerHost,
+        "pathsPerPort": pathsPerPort
+    }
+
+def verify_paths(configData:dict, sysfsRoot:str="/sys", allHitachi:bool=False) -> dict:
+    """
+    Verifies the path redundancy of the configured multipath volumes
+
+    Args:
+        configData (dict): Hitachi configuration
+        sysfsRoot (str): Root of the sysfs tree
+        allHitachi (bool): Check every Hitachi LUN instead of only the configured ones
+
+    Returns:
+        dict: {
+            'status': str,          # Worst status of all LUNs
+            'hosts': dict,          # From read_fc_hosts()
+            'luns': [dict]          # From verify_lun_paths()
+        }
+    """
+    luns = scan_block_devices(sysfsRoot)
+    fcHosts = read_fc_hosts(sysfsRoot)
+    remotePorts = read_fc_remote_ports(sysfsRoot)
+
+    volumes = configData.get("multipathData", {}).get("multipathVolumes", {})
+    if allHitachi:
+        wwids = sorted(set(volumes) | {wwid for wwid, lun in luns.items() if lun["isHitachi"]})
+    else:
+        wwids = sorted(volumes)
+
+    results = []
+    for wwid in wwids:
+        volume = volumes.get(wwid, {})
+        lun = luns.get(wwid)
+        if lun is None:
+            lun = {"wwid": wwid, "alias": "", "paths": []}
+        result = verify_lun_paths(lun, fcHosts, remotePorts)
+        result["alias"] = result["alias"] or volume.get("alias", volume.get("friendlyName", ""))
+        results.append(result)
+
+    status = "ok"
+    for result in results:
+        if STATUS_CODES[result["status"]] > STATUS_CODES[status]:
+            status = result["status"]
+    return {"status": status, "hosts": fcHosts, "luns": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifies that every Hitachi LUN has running paths spread across all HBAs and array ports. "
+                                                 "Exits with 0 if all is well, 1 on warnings and 2 if a LUN is at risk.")
+    parser.add_argument("--all", action="store_true", help="Check every Hitachi LUN, not only the configured ones")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    parser.add_argument("--sysfs", default="/sys", help="Root of the sysfs tree")
+    args = parser.parse_args()
+
+    report = verify_paths(readConfigFile(args.config), args.sysfs, args.all)
+    print(json.dumps(report, indent=4))
+    sys.exit(STATUS_CODES[report["status"]])
@@ -0,0 +1,206 @@
+import os, sys, json, fcntl, ctypes, ctypes.util, argparse, subprocess, time
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+from clusterInfo import PVE_DIR, parse_storage_cfg
+from fsTuning import MIB
+from moveImage import RateLimiter, iter_data_extents
+from trimScheduler import get_trim_settings, get_trim_targets
+
+# Directory below a storage's path that free_image renames deleted images into
+TRASH_DIR = ".trash"
+# Storage type of HITACHIPlugin.pm in storage.cfg
+STORAGE_TYPE = "hitachi-shared-dir"
+
+# From linux/falloc.h
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# Bytes deallocated per fallocate call. Each call holds the inode's glock on
+# GFS2, so ranges are kept small enough that other nodes are never held up for long.
+PUNCH_RANGE = 256 * MIB
+
+SERVICE_UNIT = """[Unit]
+Description=Reclaim deleted images on Hitachi datastores
+After=local-fs.target pve-cluster.service
+
+[Service]
+Type=oneshot
+ExecStart=/usr/bin/python3 {script} --run
+Nice=10
+IOSchedulingClass=idle
+"""
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+
+def punch_hole(fd:int, offset:int, length:int) -> None:
+    """
+    Deallocates a range of a file, which the file system passes to the array as UNMAP
+
+    Args:
+        fd (int): File descriptor of the file, open for writing
+        offset (int): Start of the range
+        length (int): Length of the range
+
+    Raises:
+        OSError: If the file system can not punch holes
+    """
+    if _libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+def reclaim_file(path:str, rateBytes:int, rangeBytes:int=PUNCH_RANGE) -> int:
+    """
+    Punches out the data extents of a deleted image in throttled ranges and
+    unlinks it. Another node or process reclaiming the same file is detected
+    with a lock on the file (cluster wide on GFS2) and the file is skipped.
+
+    Args:
+        path (str): Image in the trash directory
+        rateBytes (int): Maximum deallocated bytes per second
+        rangeBytes (int): Bytes deallocated per call
+
+    Returns:
+        int: Bytes deallocated, -1 if the file is being reclaimed elsewhere
+
+    Raises:
+        OSError: If the file could not be reclaimed
+    """
+    limiter = RateLimiter(rateBytes)
+    punched = 0
+    fd = os.open(path, os.O_RDWR)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return -1
+        size = os.fstat(fd).st_size
+        for offset, length in iter_data_extents(fd, size):
+            end = offset + length
+            while offset < end:
+                chunk = min(rangeBytes, end - offset)
+                limiter.consume(chunk)
+                punch_hole(fd, offset, chunk)
+                punched += chunk
+                offset += chunk
+        # Unlink while still holding the lock so nobody else starts on it
+        os.unlink(path)
+    finally:
+        os.close(fd)
+    return punched
+
+def get_trash_dirs(configData:dict, pveDir:str=PVE_DIR) -> list:
+    """
+    Gets the trash directories of the Hitachi storages. The plugin keeps the trash
+    below the storage path of storage.cfg, which may be a subdirectory of the
+    datastore's mount point, so those paths are used along with the mount points.
+
+    Args:
+        configData (dict): Hitachi configuration
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        list: Paths of the trash directories that exist
+    """
+    try:
+        with open(Path(pveDir) / "storage.cfg", "r") as f:
+            storages = parse_storage_cfg(f.read())
+    except OSError as e:
+        print(f"Warning: Could not read storage.cfg: {e}")
+        storages = {}
+    storagePaths = [storage["path"] for storage in storages.values() if storage["type"] == STORAGE_TYPE and storage.get("path")]
+    storagePaths.extend(target["mountPoint"] for target in get_trim_targets(configData))
+
+    trashDirs = []
+    for storagePath in storagePaths:
+        trashDir = os.path.normpath(Path(storagePath) / TRASH_DIR)
+        if trashDir not in trashDirs and os.path.isdir(trashDir):
+            trashDirs.append(trashDir)
+    return trashDirs
+
+def reclaim_trash(trashDirs:list, rateBytes:int) -> dict:
+    """
+    Reclaims everything in the trash directories. Images deleted while this
+    runs are picked up too, it only returns once the trash stays empty.
+
+    Args:
+        trashDirs (list): Trash directories to empty
+        rateBytes (int): Maximum deallocated bytes per second
+
+    Returns:
+        dict: {'files': int, 'reclaimedBytes': int, 'skipped': int, 'failed': int}
+    """
+    result = {"files": 0, "reclaimedBytes": 0, "skipped": 0, "failed": 0}
+    attempted = set()
+    while True:
+        pending = []
+        for trashDir in trashDirs:
+            try:
+                pending.extend(str(entry) for entry in sorted(Path(trashDir).iterdir())
+                               if entry.is_file() and str(entry) not in attempted)
+            except OSError as e:
+                print(f"Error reading {trashDir}: {e}")
+        if not pending:
+            return result
+
+        for path in pending:
+            attempted.add(path)
+            try:
+                punched = reclaim_file(path, rateBytes)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"ERROR: Could not reclaim {path}: {e}")
+                result["failed"] += 1
+                continue
+            if punched < 0:
+                result["skipped"] += 1
+            else:
+                print(f"Reclaimed {punched // MIB} MiB from {path}")
+                result["files"] += 1
+                result["reclaimedBytes"] += punched
+
+def install_service() -> bool:
+    """
+    Installs the systemd service the plugin starts after deleting an image
+
+    Returns:
+        bool: True if the service was installed, False otherwise
+    """
+    unitPath = Path("/etc/systemd/system/hitachi-reclaim.service")
+    with open(unitPath, "w") as f:
+        f.write(SERVICE_UNIT.format(script=os.path.realpath(__file__)))
+    print(f"Created systemd service unit at {unitPath}")
+
+    result = subprocess.run(["systemctl", "daemon-reload"], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"ERROR: 'systemctl daemon-reload' failed: {result.stderr.strip()}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Punches out and removes images deleted from the Hitachi datastores.")
+    parser.add_argument("--run", action="store_true", help="Empty the trash of every datastore")
+    parser.add_argument("--trash-dir", action="append", help="Only empty this trash directory (may be repeated)")
+    parser.add_argument("--install", action="store_true", help="Install the systemd service")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    if args.install:
+        sys.exit(0 if install_service() else 1)
+    if not args.run:
+        parser.error("one of --run or --install is required")
+
+    configData = readConfigFile(args.config)
+    try:
+        # Deallocation reaches the pool just like discards, so it shares their rate limit
+        settings = get_trim_settings(configData)
+    except ValueError as e:
+        print(f"ERROR: Invalid trim section: {e}")
+        sys.exit(1)
+
+    trashDirs = args.trash_dir or get_trash_dirs(configData)
+    result = reclaim_trash(trashDirs, int(settings["rateMiBs"] * MIB))
+    print(json.dumps(result, indent=4))
+    sys.exit(1 if result["failed"] else 0)
@@ -0,0 +1,363 @@
+import os, sys, json, copy, socket, argparse, subprocess, time
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile, writeConfigFile
+from clusterInfo import PVE_DIR
+
+CONFIG_PATH = "/opt/hitachi/etc/hitachi_config.json"
+
+# Shared document on the Proxmox cluster file system, relative to the pve directory
+SHARED_CONFIG_FILE = "hitachi/hitachi_config.json"
+# pmxcfs makes mkdir in priv/lock a cluster wide lock and expires it after 120 seconds
+LOCK_DIR = "priv/lock/hitachi-config"
+LOCK_TIMEOUT = 30
+STALE_LOCK_AGE = 120
+
+# Sections every node shares. Everything else (serverName, mountRoot, ...) is node local.
+SHARED_SECTIONS = ["clusterConfig", "multipathData", "blockTuning", "trim", "fcMonitor", "naa", "hotplug"]
+
+SERVICE_UNIT = """[Unit]
+Description=Sync the Hitachi config from the cluster
+After=pve-cluster.service
+
+[Service]
+Type=oneshot
+ExecStart=/usr/bin/python3 {script} --sync
+"""
+
+TIMER_UNIT = """[Unit]
+Description=Sync the Hitachi config from the cluster every minute
+
+[Timer]
+OnBootSec=30s
+OnUnitActiveSec=1min
+
+[Install]
+WantedBy=timers.target
+"""
+
+# Changes kept in the shared document. A node that is further behind reloads the whole document.
+MAX_CHANGES = 500
+
+def _sibling(configPath:str, name:str) -> Path:
+    """Path of a file next to the local config, e.g. hitachi_config.local.json."""
+    path = Path(configPath)
+    return path.with_name(path.stem + "." + name + path.suffix)
+
+def _read_json(path) -> dict:
+    """Reads a JSON file, empty if it does not exist or is not valid."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path, data:dict) -> None:
+    """Writes a JSON file atomically, pmxcfs supports the rename as well."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmpPath = path.with_name(f".{path.name}.tmp.{os.getpid()}")
+    with open(tmpPath, "w") as f:
+        f.write(json.dumps(data, indent=4))
+    os.replace(tmpPath, path)
+
+def deep_merge(base:dict, overrides:dict) -> dict:
+    """
+    Layers overrides on top of base. Nested dictionaries are merged, anything
+    else in overrides replaces the value in base.
+
+    Args:
+        base (dict): Base configuration
+        overrides (dict): Values to layer on top
+
+    Returns:
+        dict: New merged dictionary, the arguments are not changed
+    """
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def apply_change(document:dict, change:dict) -> None:
+    """
+    Applies one change of the shared change log to a document
+
+    Args:
+        document (dict): Document to change in place
+        change (dict): {'op': 'set' or 'delete', 'path': [str], 'value': Any}
+    """
+    parent = document
+    for key in change["path"][:-1]:
+        parent = parent.setdefault(key, {})
+    if change["op"] == "set":
+        parent[change["path"][-1]] = copy.deepcopy(change["value"])
+    else:
+        parent.pop(change["path"][-1], None)
+
+class ClusterLock:
+    """Cluster wide lock on the shared config, a directory in the pmxcfs lock area."""
+
+    def __init__(self, pveDir:str=PVE_DIR, timeout:float=LOCK_TIMEOUT):
+        self.path = Path(pveDir) / LOCK_DIR
+        self.timeout = timeout
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self.path.mkdir()
+                return self
+            except FileExistsError:
+                # pmxcfs expires old locks itself, a plain directory needs help
+                try:
+                    if time.time() - self.path.stat().st_mtime > STALE_LOCK_AGE:
+                        self.path.rmdir()
+                        continue
+                except OSError:
+                    continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"could not lock {self.path} within {self.timeout}s")
+            time.sleep(0.2)
+
+    def __exit__(self, *args):
+        try:
+            self.path.rmdir()
+        except OSError:
+            pass
+
+def shared_config_enabled(pveDir:str=PVE_DIR) -> bool:
+    """Returns whether the cluster shares its config through pmxcfs."""
+    return (Path(pveDir) / SHARED_CONFIG_FILE).exists()
+
+def read_shared_config(pveDir:str=PVE_DIR) -> dict:
+    """
+    Reads the shared config document
+
+    Args:
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        dict: {'version': int, 'config': dict, 'changes': [change]}, empty if the config is not shared
+    """
+    return _read_json(Path(pveDir) / SHARED_CONFIG_FILE)
+
+def update_shared_config(changes:list, pveDir:str=PVE_DIR, nodeName:str=None) -> int:
+    """
+    Applies changes to the shared config under the cluster lock. Every change
+    gets the next version number so nodes can catch up incrementally.
+
+    Args:
+        changes (list): [{'op': 'set' or 'delete', 'path': [str], 'value': Any}]
+        pveDir (str): Directory of the Proxmox cluster file system
+        nodeName (str): Node making the change, this host if not given
+
+    Returns:
+        int: Version of the shared config after the changes
+
+    Raises:
+        FileNotFoundError: If the config is not shared
+        TimeoutError: If the cluster lock could not be taken
+    """
+    with ClusterLock(pveDir):
+        shared = read_shared_config(pveDir)
+        if not shared:
+            raise FileNotFoundError(f"shared config {Path(pveDir) / SHARED_CONFIG_FILE} does not exist, run with --init first")
+        for change in changes:
+            if change["path"][0] not in SHARED_SECTIONS:
+                raise ValueError(f"'{change['path'][0]}' is not a shared section")
+            shared["version"] += 1
+            entry = {"version": shared["version"], "time": int(time.time()), "node": nodeName or socket.gethostname(),
+                     "op": change["op"], "path": list(change["path"])}
+            if change["op"] == "set":
+                entry["value"] = change["value"]
+            apply_change(shared["config"], entry)
+            shared["changes"].append(entry)
+        shared["changes"] = shared["changes"][-MAX_CHANGES:]
+        _write_json(Path(pveDir) / SHARED_CONFIG_FILE, shared)
+        return shared["version"]
+
+def seed_overrides(configPath:str=CONFIG_PATH) -> bool:
+    """
+    Creates the node local overrides file from the node local keys of the
+    current config, so the first sync of a node does not drop serverName,
+    mountRoot and the other settings that are not shared
+
+    Args:
+        configPath (str): Path to the local Hitachi configuration JSON file
+
+    Returns:
+        bool: True if the overrides file exists or there is no config to take it from,
+              False if the config could not be read
+    """
+    overridesPath = _sibling(configPath, "local")
+    if overridesPath.exists() or not Path(configPath).exists():
+        return True
+    try:
+        with open(configPath, "r") as f:
+            configData = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Could not read {configPath} to keep its node local settings: {e}")
+        return False
+    _write_json(overridesPath, {key: value for key, value in configData.items() if key not in SHARED_SECTIONS})
+    return True
+
+def init_shared_config(configPath:str=CONFIG_PATH, pveDir:str=PVE_DIR) -> int:
+    """
+    Publishes the shared sections of this node's config as the cluster config.
+    Node local settings of this node are moved to its overrides file.
+
+    Args:
+        configPath (str): Path to the local Hitachi configuration JSON file
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        int: Version of the shared config
+
+    Raises:
+        FileExistsError: If the cluster already shares a config
+    """
+    configData = readConfigFile(configPath)
+    with ClusterLock(pveDir):
+        if shared_config_enabled(pveDir):
+            raise FileExistsError(f"{Path(pveDir) / SHARED_CONFIG_FILE} already exists")
+        shared = {
+            "version": 1,
+            "config": {key: value for key, value in configData.items() if key in SHARED_SECTIONS},
+            "changes": []
+        }
+        _write_json(Path(pveDir) / SHARED_CONFIG_FILE, shared)
+
+    seed_overrides(configPath)
+    _write_json(_sibling(configPath, "shared"), shared["config"] | {"version": 1})
+    return 1
+
+def sync_config(configPath:str=CONFIG_PATH, pveDir:str=PVE_DIR) -> dict:
+    """
+    Brings the local config up to date with the shared config. Only the
+    changes since the last sync are applied to the local copy of the shared
+    config, then the node local overrides are layered on top and the result
+    is written to configPath for every other tool to read.
+
+    Args:
+        configPath (str): Path to the local Hitachi configuration JSON file
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        dict: {'version': int, 'applied': int, 'reloaded': bool, 'written': bool}
+    """
+    result = {"version": 0, "applied": 0, "reloaded": False, "written": False}
+    shared = read_shared_config(pveDir)
+    if not shared:
+        return result
+
+    cachePath = _sibling(configPath, "shared")
+    cache = _read_json(cachePath)
+    localVersion = cache.pop("version", 0)
+    changes = shared.get("changes", [])
+
+    if localVersion > shared["version"] or (changes and changes[0]["version"] > localVersion + 1) \
+            or (not changes and localVersion != shared["version"]):
+        # Too far behind for the change log, or the shared config was recreated
+        cache = copy.deepcopy(shared["config"])
+        result["reloaded"] = True
+    else:
+        for change in changes:
+            if change["version"] > localVersion:
+                apply_change(cache, change)
+                result["applied"] += 1
+    result["version"] = shared["version"]
+
+    if result["applied"] or result["reloaded"] or not Path(configPath).exists():
+        # Never replace the config with the shared sections alone
+        if not seed_overrides(configPath):
+            return result
+        _write_json(cachePath, cache | {"version": shared["version"]})
+        writeConfigFile(deep_merge(cache, _read_json(_sibling(configPath, "local"))), configPath)
+        result["written"] = True
+    return result
+
+def set_volumes(volumes:dict, configPath:str=CONFIG_PATH, pveDir:str=PVE_DIR) -> None:
+    """
+    Adds or replaces multipath volumes in one write, in the shared config if
+    the cluster shares one and otherwise in the local config
+
+    Args:
+        volumes (dict): {wwid: volume entry}
+        configPath (str): Path to the local Hitachi configuration JSON file
+        pveDir (str): Directory of the Proxmox cluster file system
+    """
+    if shared_config_enabled(pveDir):
+        update_shared_config([{"op": "set", "path": ["multipathData", "multipathVolumes", wwid], "value": volumeData}
+                              for wwid, volumeData in volumes.items()], pveDir)
+        sync_config(configPath, pveDir)
+    else:
+        configData = readConfigFile(configPath)
+        configData.setdefault("multipathData", {}).setdefault("multipathVolumes", {}).update(volumes)
+        writeConfigFile(configData, configPath)
+
+def set_volume(wwid:str, volumeData:dict, configPath:str=CONFIG_PATH, pveDir:str=PVE_DIR) -> None:
+    """
+    Adds or replaces a multipath volume, see set_volumes()
+
+    Args:
+        wwid (str): WWID of the volume
+        volumeData (dict): Volume entry
+        configPath (str): Path to the local Hitachi configuration JSON file
+        pveDir (str): Directory of the Proxmox cluster file system
+    """
+    set_volumes({wwid: volumeData}, configPath, pveDir)
+
+def install_timer() -> bool:
+    """
+    Installs and starts a systemd timer that syncs the local config every minute
+
+    Returns:
+        bool: True if the timer was installed and started, False otherwise
+    """
+    unitDir = Path("/etc/systemd/system")
+    with open(unitDir / "hitachi-config-sync.service", "w") as f:
+        f.write(SERVICE_UNIT.format(script=os.path.realpath(__file__)))
+    with open(unitDir / "hitachi-config-sync.timer", "w") as f:
+        f.write(TIMER_UNIT)
+    print(f"Created systemd units hitachi-config-sync.service and hitachi-config-sync.timer in {unitDir}")
+
+    for command in [["systemctl", "daemon-reload"], ["systemctl", "enable", "--now", "hitachi-config-sync.timer"]]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: '{' '.join(command)}' failed: {result.stderr.strip()}")
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shares hitachi_config.json across the Proxmox cluster through /etc/pve.")
+    parser.add_argument("--init", action="store_true", help="Publish this node's config as the cluster config")
+    parser.add_argument("--sync", action="store_true", help="Apply the shared changes since the last sync to the local config")
+    parser.add_argument("--status", action="store_true", help="Print the shared and local config versions")
+    parser.add_argument("--install", action="store_true", help="Install and start the systemd timer that syncs every minute")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to Hitachi configuration JSON file")
+    parser.add_argument("--pve-dir", default=PVE_DIR, help="Directory of the Proxmox cluster file system")
+    args = parser.parse_args()
+
+    try:
+        if args.install:
+            sys.exit(0 if install_timer() else 1)
+        elif args.init:
+            print(f"Published the cluster config at version {init_shared_config(args.config, args.pve_dir)}")
+        elif args.sync:
+            print(json.dumps(sync_config(args.config, args.pve_dir), indent=4))
+        elif args.status:
+            shared = read_shared_config(args.pve_dir)
+            print(json.dumps({
+                "shared": shared_config_enabled(args.pve_dir),
+                "sharedVersion": shared.get("version", 0),
+                "localVersion": _read_json(_sibling(args.config, "shared")).get("version", 0)
+            }, indent=4))
+        else:
+            parser.error("one of --init, --sync, --status or --install is required")
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
@@ -0,0 +1,342 @@
+import os, sys, re, json, time, queue, argparse, threading, subprocess
+from pathlib import Path
+
+from clusterInfo import PVE_DIR, read_vmlist
+from pathVerifier import STATUS_CODES
+
+CONFIG_PATH = "/opt/hitachi/etc/hitachi_config.json"
+
+# Seconds to wait for statvfs, a hung GFS2 or a LUN without paths blocks it forever
+STATVFS_TIMEOUT = 0.5
+STATVFS_THREADS = 16
+USAGE_WARNING_PERCENT = 90
+
+def parse_mountinfo(text:str) -> dict:
+    """
+    Parses /proc/self/mountinfo
+
+    Args:
+        text (str): Content of mountinfo
+
+    Returns:
+        dict: {mountPoint: {'device': str (major:minor), 'fsType': str, 'source': str, 'options': str}},
+              the last mount wins for stacked mount points
+    """
+    mounts = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if "-" not in fields:
+            continue
+        separator = fields.index("-")
+        if separator < 6 or len(fields) < separator + 3:
+            continue
+        # Spaces and other special characters are escaped as octal, e.g. \040
+        mountPoint = re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), fields[4])
+        mounts[mountPoint] = {"device": fields[2], "fsType": fields[separator + 1],
+                              "source": fields[separator + 2], "options": fields[5]}
+    return mounts
+
+def escape_unit_path(path:str) -> str:
+    """
+    Escapes a path for a unit name, like systemd-escape -p
+
+    Args:
+        path (str): Path
+
+    Returns:
+        str: Escaped path, e.g. dev-mapper-Proxmox\\x2dVol1 for /dev/mapper/Proxmox-Vol1
+    """
+    path = os.path.normpath(path).strip("/")
+    if not path:
+        return "-"
+    escaped = []
+    for index, char in enumerate(path):
+        if char == "/":
+            escaped.append("-")
+        elif char.isascii() and (char.isalnum() or char in ":_") or (char == "." and index > 0):
+            escaped.append(char)
+        else:
+            escaped.extend(f"\\x{byte:02x}" for byte in char.encode())
+    return "".join(escaped)
+
+def escape_mount_unit(path:str) -> str:
+    """
+    Gets the name of the mount unit of a path, like systemd-escape -p --suffix=mount
+
+    Args:
+        path (str): Mount point
+
+    Returns:
+        str: Unit name, e.g. mnt-Proxmox\\x2dVol1.mount
+    """
+    return escape_unit_path(path) + ".mount"
+
+def parse_systemctl_show(text:str) -> dict:
+    """
+    Parses "systemctl show --property=Id,ActiveState,SubState" for several units
+
+    Args:
+        text (str): Output of systemctl show
+
+    Returns:
+        dict: {unit: {'activeState': str, 'subState': str}}
+    """
+    units = {}
+    for block in text.split("\n\n"):
+        properties = dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+        if "Id" in properties:
+            units[properties["Id"]] = {"activeState": properties.get("ActiveState", ""), "subState": properties.get("SubState", "")}
+    return units
+
+def get_unit_states(units:list) -> dict:
+    """
+    Gets the state of many units with a single systemctl call
+
+    Args:
+        units (list): Unit names
+
+    Returns:
+        dict: From parse_systemctl_show(), empty if systemctl failed
+    """
+    if not units:
+        return {}
+    try:
+        result = subprocess.run(["systemctl", "show", "--property=Id,ActiveState,SubState", "--", *units],
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return {}
+    return parse_systemctl_show(result.stdout)
+
+def statvfs_all(mountPoints:list, timeout:float=STATVFS_TIMEOUT, threads:int=STATVFS_THREADS) -> dict:
+    """
+    Calls statvfs on many mount points in parallel. Daemon threads are used so a
+    mount point that hangs can not keep the process from exiting.
+
+    Args:
+        mountPoints (list): Mount points
+        timeout (float): Seconds to wait for all answers
+        threads (int): Number of worker threads
+
+    Returns:
+        dict: {mountPoint: {'sizeBytes': int, 'usedBytes': int, 'freeBytes': int, 'usedPercent': float}
+               or {'error': str}}, 'timeout' for the ones that did not answer in time
+    """
+    results = {}
+    pending = queue.Queue()
+    for mountPoint in mountPoints:
+        pending.put(mountPoint)
+    done = threading.Condition()
+
+    def worker():
+        while True:
+            try:
+                mountPoint = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                stat = os.statvfs(mountPoint)
+                size = stat.f_blocks * stat.f_frsize
+                free = stat.f_bavail * stat.f_frsize
+                used = size - stat.f_bfree * stat.f_frsize
+                result = {"sizeBytes": size, "usedBytes": used, "freeBytes": free,
+                          "usedPercent": round(100 * used / (used + free), 1) if used + free else 0.0}
+            except OSError as e:
+                result = {"error": e.strerror or str(e)}
+            with done:
+                results[mountPoint] = result
+                done.notify()
+
+    for _ in range(min(threads, len(mountPoints))):
+        threading.Thread(target=worker, daemon=True).start()
+
+    deadline = time.monotonic() + timeout
+    with done:
+        while len(results) < len(mountPoints):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not done.wait(remaining):
+                break
+        answered = dict(results)
+    return {mountPoint: answered.get(mountPoint, {"error": "timeout"}) for mountPoint in mountPoints}
+
+def get_rdm_attachments(volume:dict, pveDir:str=PVE_DIR, vmList:dict=None) -> list:
+    """
+    Checks the RDM attachments of a volume against the VM configs. The config does not
+    keep the node of a VM, it is looked up in .vmlist.
+
+    Args:
+        volume (dict): Volume of the config with rdmInfo
+        pveDir (str): Directory of the Proxmox cluster file system
+        vmList (dict): From read_vmlist(), read if not given
+
+    Returns:
+        list: [{'vmId': str, 'node': str, 'disk': str, 'attached': bool}]
+    """
+    if vmList is None:
+        vmList = read_vmlist(pveDir)
+    attachments = []
+    rdmInfo = volume.get("rdmInfo", {})
+    diskId = rdmInfo.get("diskId", "")
+    for vm in rdmInfo.get("vms", []):
+        vmId = str(vm.get("vmId", vm.get("vm_id", "")))
+        # install.py stores 'scsi2', older configs just the number
+        scsiId = str(vm.get("scsiId", ""))
+        disk = scsiId if not scsiId or scsiId.startswith("scsi") else f"scsi{scsiId}"
+        node = vmList.get(vmId, {}).get("node", "")
+        attached = False
+        try:
+            with open(Path(pveDir) / "nodes" / node / "qemu-server" / f"{vmId}.conf", "r") as f:
+                for line in f:
+                    if line.startswith("["):
+                        break
+                    key, _, value = line.partition(":")
+                    if key.strip() == disk and diskId and diskId in value:
+                        attached = True
+                        break
+        except OSError:
+            pass
+        attachments.append({"vmId": vmId, "node": node, "disk": disk, "attached": attached})
+    return attachments
+
+def build_status(configData:dict, luns:dict, mounts:dict, usage:dict, units:dict, pveDir:str=PVE_DIR) -> dict:
+    """
+    Combines the sources into the status of every configured volume
+
+    Args:
+        configData (dict): Hitachi configuration
+        luns (dict): From scan_block_devices() or the inventory service
+        mounts (dict): From parse_mountinfo()
+        usage (dict): From statvfs_all()
+        units (dict): From get_unit_states()
+        pveDir (str): Directory of the Proxmox cluster file system
+
+    Returns:
+        dict: {'status': str, 'problems': [str], 'volumes': [{'wwid', 'alias', 'volumeType', 'status', 'problems',
+               'dmDevice', 'paths', 'runningPaths', 'mountPoint', 'mounted', 'fsType', 'usage',
+               'unit', 'unitState', 'rdm'}]}. Without any configured volume the status is critical,
+              there is nothing to check.
+    """
+    volumes = configData.get("multipathData", {}).get("multipathVolumes", {})
+    if not volumes:
+        return {"status": "critical", "problems": ["no volumes configured, the config is missing, unreadable or empty"], "volumes": []}
+
+    vmList = read_vmlist(pveDir)
+    rows = []
+    for wwid, volume in sorted(volumes.items()):
+        lun = luns.get(wwid) or {"paths": [], "dmDevice": ""}
+        row = {
+            "wwid": wwid,
+            "alias": volume.get("alias", volume.get("friendlyName", "")),
+            "volumeType": volume.get("volumeType", ""),
+            "status": "ok",
+            "problems": [],
+            "dmDevice": lun["dmDevice"],
+            "paths": len(lun["paths"]),
+            "runningPaths": len([path for path in lun["paths"] if path["state"] == "running"]),
+            "mountPoint": "",
+            "mounted": False,
+            "fsType": "",
+            "usage": None,
+            "unit": "",
+            "unitState": "",
+            "rdm": []
+        }
+        problems = []
+        if not row["paths"]:
+            problems.append(("critical", "LUN not visible"))
+        elif not row["runningPaths"]:
+            problems.append(("critical", "no running paths"))
+        elif row["runningPaths"] < row["paths"]:
+            problems.append(("warning", f"{row['paths'] - row['runningPaths']} path(s) down"))
+        if row["paths"] and not row["dmDevice"]:
+            problems.append(("critical", "no multipath device"))
+
+        if row["volumeType"] == "datastore":
+            mountPoint = volume.get("datastoreInfo", {}).get("mountPoint", "")
+            mount = mounts.get(mountPoint)
+            row["mountPoint"] = mountPoint
+            row["mounted"] = mount is not None
+            row["fsType"] = mount["fsType"] if mount else ""
+            row["unit"] = escape_mount_unit(mountPoint) if mountPoint else ""
+            unitState = units.get(row["unit"])
+            row["unitState"] = f"{unitState['activeState']}/{unitState['subState']}" if unitState else ""
+            if not mount:
+                problems.append(("critical", "not mounted"))
+            else:
+                row["usage"] = usage.get(mountPoint)
+                if row["usage"] and "error" in row["usage"]:
+                    problems.append(("critical", f"statvfs: {row['usage']['error']}"))
+                elif row["usage"] and row["usage"]["usedPercent"] >= USAGE_WARNING_PERCENT:
+                    problems.append(("warning", f"{row['usage']['usedPercent']}% used"))
+            if unitState and unitState["activeState"] == "failed":
+                problems.append(("critical", f"{row['unit']} failed"))
+        elif row["volumeType"] == "rdm":
+            row["rdm"] = get_rdm_attachments(volume, pveDir, vmList)
+            for attachment in row["rdm"]:
+                if not attachment["attached"]:
+                    problems.append(("warning", f"not attached to VM {attachment['vmId']} as {attachment['disk']}"))
+
+        for severity, problem in problems:
+            if STATUS_CODES[severity] > STATUS_CODES[row["status"]]:
+                row["status"] = severity
+            row["problems"].append(problem)
+        rows.append(row)
+
+    status = max((row["status"] for row in rows), key=STATUS_CODES.get, default="ok")
+    return {"status": status, "problems": [], "volumes": rows}
+
+def collect_status(configData:dict, luns:dict=None, pveDir:str=PVE_DIR, statvfsTimeout:float=STATVFS_TIMEOUT) -> dict:
+    """
+    Collects the status of every configured volume in one pass over each source
+
+    Args:
+        configData (dict): Hitachi configuration
+        luns (dict): LUN inventory, from the inventory service or one sysfs scan if None
+        pveDir (str): Directory of the Proxmox cluster file system
+        statvfsTimeout (float): Seconds to wait for statvfs
+
+    Returns:
+        dict: From build_status()
+    """
+    if luns is None:
+        from hitachiInventory import query_inventory, scan_block_devices
+        luns = query_inventory("luns")
+        if luns is None:
+            luns = scan_block_devices()
+    with open("/proc/self/mountinfo", "r") as f:
+        mounts = parse_mountinfo(f.read())
+
+    mountPoints = []
+    for volume in configData.get("multipathData", {}).get("multipathVolumes", {}).values():
+        mountPoint = volume.get("datastoreInfo", {}).get("mountPoint", "") if volume.get("volumeType") == "datastore" else ""
+        if mountPoint:
+            mountPoints.append(mountPoint)
+    usage = statvfs_all([mountPoint for mountPoint in mountPoints if mountPoint in mounts], statvfsTimeout)
+    units = get_unit_states([escape_mount_unit(mountPoint) for mountPoint in mountPoints])
+    return build_status(configData, luns, mounts, usage, units, pveDir)
+
+def print_status(report:dict) -> None:
+    """Prints the status report as a table."""
+    print(f"{'Alias':<28} {'Type':<10} {'Status':<9} {'Paths':>7} {'Device':<8} {'Used':>6} Problems")
+    for row in report["volumes"]:
+        paths = f"{row['runningPaths']}/{row['paths']}"
+        used = f"{row['usage']['usedPercent']:.0f}%" if row["usage"] and "usedPercent" in row["usage"] else "-"
+        print(f"{row['alias']:<28} {row['volumeType']:<10} {row['status']:<9} {paths:>7} {row['dmDevice'] or '-':<8} {used:>6} "
+              f"{'; '.join(row['problems']) or '-'}")
+    for problem in report["problems"]:
+        print(f"ERROR: {problem}")
+    print(f"Overall: {report['status']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reports the health of every Hitachi volume of this node: paths, mounts, usage, mount units and RDM attachments.")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    parser.add_argument("--timeout", type=float, default=STATVFS_TIMEOUT, help="Seconds to wait for statvfs of the datastores")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    from addVolumeToConfig import readConfigFile
+    report = collect_status(readConfigFile(args.config), statvfsTimeout=args.timeout)
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_status(report)
+    sys.exit(STATUS_CODES[report["status"]])
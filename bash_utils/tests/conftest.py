@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The tools are flat scripts that import each other by module name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
@@ -0,0 +1,65 @@
+from conftest import FIXTURES
+from multipathReconcile import parse_maps_json, parse_paths, get_desired_maps, plan_reconcile
+
+VOL1 = "360060e8012345600504012340000a001"
+VOL2 = "360060e8012345600504012340000a002"
+VOL3 = "360060e8012345600504012340000a003"
+BLACKLISTED = "360060e8012345600504012340000a004"
+NO_PATHS = "360060e8012345600504012340000a005"
+
+def load_fixtures():
+    maps = parse_maps_json((FIXTURES / "multipathd_show_maps.json").read_text())
+    paths = parse_paths((FIXTURES / "multipathd_show_paths.txt").read_text())
+    return maps, paths
+
+def make_config(volumes, blacklisted=()):
+    return {"multipathData": {
+        "multipathVolumes": {wwid: {"scsi_id": wwid, "alias": alias, "volumeType": "datastore"} for wwid, alias in volumes.items()},
+        "blacklistedVolumes": [{"scsi_id": wwid} for wwid in blacklisted]
+    }}
+
+def plan(configData):
+    maps, paths = load_fixtures()
+    desired, blacklisted = get_desired_maps(configData)
+    return plan_reconcile(desired, blacklisted, maps, paths)
+
+def test_parse_recorded_output():
+    maps, paths = load_fixtures()
+
+    assert maps[VOL1] == {"name": "Proxmox-Vol1", "sysfs": "dm-0", "paths": ["sdb", "sdc"]}
+    assert set(maps) == {VOL1, VOL2, BLACKLISTED}
+    assert paths[VOL3] == [{"device": "sdf", "map": "", "checker": "ready"},
+                           {"device": "sdg", "map": "", "checker": "ready"}]
+
+def test_matching_map_is_left_alone():
+    assert plan(make_config({VOL1: "Proxmox-Vol1"})) == []
+
+def test_orphan_paths_get_a_map():
+    actions = plan(make_config({VOL3: "Proxmox-Vol3"}))
+
+    assert [(action["action"], action["wwid"]) for action in actions] == [("add", VOL3)]
+    assert actions[0]["commands"] == [["multipath", "-a", VOL3], ["multipath", VOL3]]
+
+def test_map_with_another_name_is_renamed():
+    actions = plan(make_config({VOL2: "Proxmox-Vol2"}))
+
+    assert [(action["action"], action["wwid"]) for action in actions] == [("rename", VOL2)]
+    assert actions[0]["commands"] == [["multipath", VOL2]]
+
+def test_blacklisted_map_is_removed():
+    actions = plan(make_config({VOL1: "Proxmox-Vol1"}, blacklisted=[BLACKLISTED]))
+
+    assert [(action["action"], action["wwid"]) for action in actions] == [("remove", BLACKLISTED)]
+    assert actions[0]["commands"] == [["multipathd", "del", "map", "mpathb"], ["multipath", "-w", BLACKLISTED]]
+
+def test_volume_without_paths_is_skipped():
+    actions = plan(make_config({NO_PATHS: "Proxmox-Vol5"}))
+
+    assert [(action["action"], action["commands"]) for action in actions] == [("skip", [])]
+
+def test_whole_host():
+    actions = plan(make_config({VOL1: "Proxmox-Vol1", VOL2: "Proxmox-Vol2", VOL3: "Proxmox-Vol3", NO_PATHS: "Proxmox-Vol5"},
+                               blacklisted=[BLACKLISTED]))
+
+    assert [(action["action"], action["wwid"]) for action in actions] == [
+        ("rename", VOL2), ("add", VOL3), ("skip", NO_PATHS), ("remove", BLACKLISTED)]
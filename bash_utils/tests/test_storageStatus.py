@@ -0,0 +1,69 @@
+import json
+
+from conftest import REPO_ROOT
+from storageStatus import build_status, get_rdm_attachments
+
+EXAMPLE_CONFIG = REPO_ROOT / "hitachi_storage_plugin" / "hitachi_config_single_example.json"
+RDM_WWID = "5678"
+DISK_ID = "scsi-360060e80289e1d0050809e1d00000079"
+
+def make_pve_dir(tmp_path, attachedVms):
+    """Builds a cluster file system with VM 103 on pve1 and VM 104 on pve2."""
+    vmList = {"103": {"node": "pve1", "type": "qemu", "version": 1}, "104": {"node": "pve2", "type": "qemu", "version": 2}}
+    (tmp_path / ".vmlist").write_text(json.dumps({"version": 2, "ids": vmList}))
+    disks = {"103": "scsi2", "104": "scsi3"}
+    for vmId, entry in vmList.items():
+        configDir = tmp_path / "nodes" / entry["node"] / "qemu-server"
+        configDir.mkdir(parents=True)
+        lines = ["scsi0: local:vm-disk-0,size=32G"]
+        if vmId in attachedVms:
+            lines.append(f"{disks[vmId]}: /dev/disk/by-id/{DISK_ID},backup=0")
+        (configDir / f"{vmId}.conf").write_text("\n".join(lines) + "\n")
+    return tmp_path
+
+def load_example():
+    return json.loads(EXAMPLE_CONFIG.read_text())
+
+def test_rdm_attachments_from_example_config(tmp_path):
+    pveDir = make_pve_dir(tmp_path, attachedVms={"103", "104"})
+    volume = load_example()["multipathData"]["multipathVolumes"][RDM_WWID]
+
+    attachments = get_rdm_attachments(volume, str(pveDir))
+
+    assert attachments == [
+        {"vmId": "103", "node": "pve1", "disk": "scsi2", "attached": True},
+        {"vmId": "104", "node": "pve2", "disk": "scsi3", "attached": True}
+    ]
+
+def test_rdm_detached_vm_is_reported(tmp_path):
+    pveDir = make_pve_dir(tmp_path, attachedVms={"103"})
+    volume = load_example()["multipathData"]["multipathVolumes"][RDM_WWID]
+
+    attachments = get_rdm_attachments(volume, str(pveDir))
+
+    assert [attachment["attached"] for attachment in attachments] == [True, False]
+
+def test_rdm_scsi_id_as_stored_by_install(tmp_path):
+    pveDir = make_pve_dir(tmp_path, attachedVms={"103"})
+    volume = {"rdmInfo": {"diskId": DISK_ID, "vms": [{"vmId": "103", "scsiId": "scsi2"}]}}
+
+    assert get_rdm_attachments(volume, str(pveDir))[0]["attached"]
+
+def test_attached_rdm_volume_is_ok(tmp_path):
+    pveDir = make_pve_dir(tmp_path, attachedVms={"103", "104"})
+    configData = load_example()
+    volumes = configData["multipathData"]["multipathVolumes"]
+    configData["multipathData"]["multipathVolumes"] = {RDM_WWID: volumes[RDM_WWID]}
+    luns = {RDM_WWID: {"dmDevice": "dm-1", "paths": [{"device": "sdb", "state": "running"},
+                                                     {"device": "sdc", "state": "running"}]}}
+
+    report = build_status(configData, luns, {}, {}, {}, str(pveDir))
+
+    assert report["status"] == "ok"
+    assert report["volumes"][0]["problems"] == []
+
+def test_no_volumes_is_critical():
+    report = build_status({}, {}, {}, {}, {})
+
+    assert report["status"] == "critical"
+    assert report["volumes"] == []
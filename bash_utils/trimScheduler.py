@@ -0,0 +1,354 @@
+import os, sys, json, zlib, errno, fcntl, struct, argparse, subprocess, time
+from pathlib import Path
+
+from addVolumeToConfig import readConfigFile
+from clusterInfo import get_cluster_info, PVE_DIR
+from fsTuning import MIB, GIB, HITACHI_PAGE_SIZE
+from moveImage import RateLimiter
+
+# From linux/fs.h, _IOWR('X', 121, struct fstrim_range)
+FITRIM = 0xc0185879
+
+HISTORY_PATH = "/var/lib/hitachi/trim_history.json"
+LOCK_PATH = "/run/hitachi/trim.lock"
+
+# Discards are cheap for the host but the pool reclaims pages synchronously,
+# so a run is split into ranges and held to a rate that running VMs do not notice
+DEFAULT_TRIM_SETTINGS = {
+    "rateMiBs": 512,
+    "rangeGiB": 8,
+    # Freed extents smaller than a pool page can not be reclaimed by the array.
+    # Lowered per file system when it is larger than a resource group, see trim_filesystem()
+    "minExtentBytes": HITACHI_PAGE_SIZE,
+    "historyRuns": 50
+}
+
+TRIM_FILESYSTEMS = ["gfs2", "xfs"]
+
+SERVICE_UNIT = """[Unit]
+Description=Trim Hitachi datastores
+After=local-fs.target pve-cluster.service
+
+[Service]
+Type=oneshot
+ExecStart=/usr/bin/python3 {script} --run
+Nice=10
+IOSchedulingClass=idle
+"""
+
+TIMER_UNIT = """[Unit]
+Description=Weekly trim of Hitachi datastores
+
+[Timer]
+OnCalendar=weekly
+RandomizedDelaySec=1h
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+"""
+
+def get_trim_settings(configData:dict) -> dict:
+    """
+    Builds the trim settings from the "trim" section of the config, filling in
+    defaults for anything that is not set
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        dict: Settings keyed like DEFAULT_TRIM_SETTINGS
+
+    Raises:
+        ValueError: If a setting is unknown or not a positive number
+    """
+    settings = dict(DEFAULT_TRIM_SETTINGS)
+    settings.update(configData.get("trim", {}))
+    for key, value in settings.items():
+        if key not in DEFAULT_TRIM_SETTINGS:
+            raise ValueError(f"unknown setting '{key}'")
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{key} must be a positive number")
+    return settings
+
+def get_trim_targets(configData:dict) -> list:
+    """
+    Gets the datastores of the config that can be trimmed
+
+    Args:
+        configData (dict): Hitachi configuration
+
+    Returns:
+        list: [{'wwid': str, 'alias': str, 'mountPoint': str, 'fileSystem': str}]
+    """
+    targets = []
+    volumes = configData.get("multipathData", {}).get("multipathVolumes", {})
+    for wwid, volume in volumes.items():
+        if volume.get("volumeType") != "datastore":
+            continue
+        datastoreInfo = volume.get("datastoreInfo", {})
+        if not datastoreInfo.get("mountPoint") or datastoreInfo.get("fileSystem") not in TRIM_FILESYSTEMS:
+            continue
+        targets.append({
+            "wwid": wwid,
+            "alias": volume.get("alias", volume.get("friendlyName", "")),
+            "mountPoint": datastoreInfo["mountPoint"],
+            "fileSystem": datastoreInfo["fileSystem"]
+        })
+    return targets
+
+def get_trim_owner(wwid:str, clusterInfo) -> str:
+    """
+    Picks the node that trims a LUN. Every node computes the same answer from
+    the online members, so a shared LUN is trimmed by exactly one node and the
+    LUNs are spread over the cluster.
+
+    Args:
+        wwid (str): WWID of the LUN
+        clusterInfo (ClusterInfo): Cluster information
+
+    Returns:
+        str: Name of the owning node, None if the cluster is not quorate
+    """
+    if not clusterInfo.isClusterNode:
+        return clusterInfo.localNode
+    if not clusterInfo.quorate:
+        return None
+    onlineNodes = sorted([node for node in clusterInfo.nodes if node.online], key=lambda node: node.nodeId)
+    if not onlineNodes:
+        return None
+    return onlineNodes[zlib.crc32(wwid.encode()) % len(onlineNodes)].nodeName
+
+def get_mounted_filesystems(mountsPath:str="/proc/self/mounts") -> dict:
+    """
+    Reads the mounted file systems
+
+    Args:
+        mountsPath (str): Path of the mount table
+
+    Returns:
+        dict: {mountPoint: fileSystemType}
+    """
+    mounts = {}
+    try:
+        with open(mountsPath, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    # Spaces in mount points are escaped as \040
+                    mounts[fields[1].replace("\\040", " ")] = fields[2]
+    except OSError as e:
+        print(f"Error reading {mountsPath}: {e}")
+    return mounts
+
+def fitrim(fd:int, start:int, length:int, minLength:int) -> int:
+    """
+    Discards the free space of a range of a mounted file system (FITRIM)
+
+    Args:
+        fd (int): File descriptor of the mount point
+        start (int): Start of the range in bytes
+        length (int): Length of the range in bytes
+        minLength (int): Free extents smaller than this are skipped
+
+    Returns:
+        int: Bytes the file system discarded
+    """
+    trimRange = bytearray(struct.pack("QQQ", start, length, minLength))
+    fcntl.ioctl(fd, FITRIM, trimRange)
+    return struct.unpack("QQQ", trimRange)[1]
+
+def trim_filesystem(mountPoint:str, rangeBytes:int, rateBytes:int, minLength:int) -> dict:
+    """
+    Trims a mounted file system in ranges of rangeBytes, limiting the discarded
+    bytes per second to rateBytes. The file system rejects a minimum length larger
+    than its resource group (GFS2) or allocation group (XFS) with EINVAL, e.g. the
+    32 MiB resource groups of small GFS2 LUNs, so it is halved until it is accepted.
+
+    Args:
+        mountPoint (str): Mount point of the file system
+        rangeBytes (int): Size of each FITRIM range
+        rateBytes (int): Maximum discarded bytes per second
+        minLength (int): Free extents smaller than this are skipped
+
+    Returns:
+        dict: {'reclaimedBytes': int, 'ranges': int, 'seconds': float, 'minExtentBytes': int}
+
+    Raises:
+        OSError: If the file system can not be trimmed
+    """
+    limiter = RateLimiter(rateBytes)
+    start = time.monotonic()
+    reclaimed = 0
+    ranges = 0
+    fd = os.open(mountPoint, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        stats = os.fstatvfs(fd)
+        size = stats.f_blocks * stats.f_frsize
+        offset = 0
+        while offset < size:
+            try:
+                trimmed = fitrim(fd, offset, rangeBytes, minLength)
+            except OSError as e:
+                if e.errno != errno.EINVAL or minLength <= stats.f_bsize:
+                    raise
+                minLength = max(minLength // 2, stats.f_bsize)
+                continue
+            # Pay for the discards after the fact, the next range waits until they are absorbed
+            limiter.consume(trimmed)
+            reclaimed += trimmed
+            ranges += 1
+            offset += rangeBytes
+    finally:
+        os.close(fd)
+    return {"reclaimedBytes": reclaimed, "ranges": ranges, "seconds": round(time.monotonic() - start, 3),
+            "minExtentBytes": minLength}
+
+def read_history(historyPath:str=HISTORY_PATH) -> dict:
+    """
+    Reads the trim history
+
+    Args:
+        historyPath (str): Path of the history file
+
+    Returns:
+        dict: {mountPoint: [run, ...]}, oldest run first
+    """
+    try:
+        with open(historyPath, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def record_run(run:dict, historyRuns:int, historyPath:str=HISTORY_PATH) -> None:
+    """
+    Appends a run to the trim history, keeping the last historyRuns runs per mount point
+
+    Args:
+        run (dict): Result of the run, must contain 'mountPoint'
+        historyRuns (int): Runs to keep per mount point
+        historyPath (str): Path of the history file
+    """
+    history = read_history(historyPath)
+    runs = history.setdefault(run["mountPoint"], [])
+    runs.append(run)
+    history[run["mountPoint"]] = runs[-int(historyRuns):]
+
+    path = Path(historyPath)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmpPath = path.with_name(path.name + ".tmp")
+    with open(tmpPath, "w") as f:
+        json.dump(history, f, indent=4)
+    os.replace(tmpPath, path)
+
+def run_trim(configData:dict, mountPoints:list=None, force:bool=False, pveDir:str=PVE_DIR,
+             historyPath:str=HISTORY_PATH) -> list:
+    """
+    Trims the datastores this node owns
+
+    Args:
+        configData (dict): Hitachi configuration
+        mountPoints (list): Only trim these mount points
+        force (bool): Trim even if another node owns the LUN
+        pveDir (str): Directory of the Proxmox cluster file system
+        historyPath (str): Path of the history file
+
+    Returns:
+        list: One result per datastore, with 'status' trimmed, skipped or failed
+    """
+    settings = get_trim_settings(configData)
+    clusterInfo = get_cluster_info(pveDir)
+    mounts = get_mounted_filesystems()
+    results = []
+
+    for target in get_trim_targets(configData):
+        if mountPoints and target["mountPoint"] not in mountPoints:
+            continue
+        result = dict(target)
+        result["node"] = clusterInfo.localNode
+        owner = get_trim_owner(target["wwid"], clusterInfo)
+        if not force and owner != clusterInfo.localNode:
+            result["status"] = "skipped"
+            result["reason"] = f"trimmed by {owner}" if owner else "cluster is not quorate"
+        elif mounts.get(target["mountPoint"]) != target["fileSystem"]:
+            result["status"] = "skipped"
+            result["reason"] = "not mounted"
+        else:
+            print(f"Trimming {target['mountPoint']} ({target['alias']})")
+            startTime = time.time()
+            try:
+                result.update(trim_filesystem(target["mountPoint"], int(settings["rangeGiB"] * GIB),
+                                              int(settings["rateMiBs"] * MIB), int(settings["minExtentBytes"])))
+                result["status"] = "trimmed"
+            except OSError as e:
+                result["status"] = "failed"
+                result["reason"] = str(e)
+            result["startTime"] = int(startTime)
+            record_run(result, settings["historyRuns"], historyPath)
+            if result["status"] == "trimmed":
+                print(f"Reclaimed {result['reclaimedBytes'] / GIB:.2f} GiB from {target['mountPoint']} in {result['seconds']}s")
+            else:
+                print(f"ERROR: Could not trim {target['mountPoint']}: {result['reason']}")
+        results.append(result)
+    return results
+
+def install_timer() -> bool:
+    """
+    Installs and starts a systemd timer that trims the datastores weekly
+
+    Returns:
+        bool: True if the timer was installed and started, False otherwise
+    """
+    unitDir = Path("/etc/systemd/system")
+    with open(unitDir / "hitachi-trim.service", "w") as f:
+        f.write(SERVICE_UNIT.format(script=os.path.realpath(__file__)))
+    with open(unitDir / "hitachi-trim.timer", "w") as f:
+        f.write(TIMER_UNIT)
+    print(f"Created systemd units hitachi-trim.service and hitachi-trim.timer in {unitDir}")
+
+    for command in [["systemctl", "daemon-reload"], ["systemctl", "enable", "--now", "hitachi-trim.timer"]]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ERROR: '{' '.join(command)}' failed: {result.stderr.strip()}")
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throttled FITRIM of the Hitachi datastores, one node per shared LUN.")
+    parser.add_argument("--run", action="store_true", help="Trim the datastores owned by this node")
+    parser.add_argument("--mount", action="append", help="Only trim this mount point (may be repeated)")
+    parser.add_argument("--force", action="store_true", help="Trim even if another node owns the LUN")
+    parser.add_argument("--history", action="store_true", help="Print the trim history")
+    parser.add_argument("--install", action="store_true", help="Install and start the weekly systemd timer")
+    parser.add_argument("--config", default="/opt/hitachi/etc/hitachi_config.json", help="Path to Hitachi configuration JSON file")
+    args = parser.parse_args()
+
+    if args.install:
+        sys.exit(0 if install_timer() else 1)
+    if args.history:
+        print(json.dumps(read_history(), indent=4))
+        sys.exit(0)
+    if not args.run:
+        parser.error("one of --run, --history or --install is required")
+
+    configData = readConfigFile(args.config)
+    if not configData:
+        print("ERROR: No Hitachi configuration found. Exiting...")
+        sys.exit(1)
+
+    # A second run on this node would just double the discard rate
+    Path(LOCK_PATH).parent.mkdir(parents=True, exist_ok=True)
+    lockFile = open(LOCK_PATH, "w")
+    try:
+        fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print("ERROR: Another trim run is active on this node. Exiting...")
+        sys.exit(1)
+
+    try:
+        results = run_trim(configData, args.mount, args.force)
+    except ValueError as e:
+        print(f"ERROR: Invalid trim section: {e}")
+        sys.exit(1)
+    print(json.dumps(results, indent=4))
+    sys.exit(1 if any(result["status"] == "failed" for result in results) else 0)
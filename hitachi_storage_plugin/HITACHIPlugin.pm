@@ -4,7 +4,11 @@ use strict;
 use warnings;
 use Carp qw( confess );
 use IO::File;
-use JSON::XS qw( decode_json );
+use IO::Socket::UNIX;
+use JSON::XS qw( decode_json encode_json );
+use POSIX qw( setsid );
+use File::Path qw( make_path );
+use File::Basename qw( basename dirname );
 use Data::Dumper;
 use REST::Client;
 use Storable qw(lock_store lock_retrieve);
@@ -15,6 +19,7 @@ use LINBIT::PluginHelper
   qw(valid_legacy_name valid_uuid_name valid_cloudinit_name valid_state_name valid_snap_name valid_pvc_name valid_fleece_name valid_name get_images);
 
 use PVE::Tools qw(run_command trim);
+use PVE::ProcFSTools;
 use PVE::INotify;
 use PVE::Storage;
 use PVE::Storage::Plugin;
@@ -43,6 +48,33 @@ my @clusterNodes = undef;
 my $clusterNodeCount = undef;
 my $friendlyName = undef;
 
+# Directory the Python helpers from bash_utils are installed to, install.py copies them
+# here (install_helpers). cloneImage.py and moveImage.py are run from it.
+my $helper_dir = "/opt/hitachi/bin";
+
+# Unix socket of the inventory service (bash_utils/hitachiInventory.py --serve)
+my $inventory_socket = "/run/hitachi/inventory.sock";
+my $inventory_timeout = 2;
+
+# Per storage index of the images directory, see get_image_index()
+my $image_index = {};
+# Directory below the storage path that deleted images are moved to, see free_image()
+my $trash_dir = ".trash";
+my $reclaim_service = "hitachi-reclaim.service";
+
+# Seconds an indexed image's size and usage are trusted before it is stat'ed again
+my $image_attr_ttl = 30;
+
+# Last known capacity of each storage, see status()
+my $status_cache = {};
+my $status_cache_dir = "/run/hitachi-plugin";
+# Seconds a status is served before a background refresh is started
+my $status_ttl = 10;
+# Seconds a single refresh may take before it counts as hung
+my $status_refresh_timeout = 5;
+# Upper limit of the back off between refreshes of a storage that keeps timing out
+my $status_max_backoff = 300;
+
 sub api {
     # PVE 5:   APIVER  2
     # PVE 6:   APIVER  3
@@ -170,7 +202,45 @@ sub options {
 }
 
 sub activate_storage {
+    my ($class, $storeid, $scfg, $cache) = @_;
+
+    my $path = $scfg->{path};
+    $cache->{mountdata} //= PVE::ProcFSTools::parse_proc_mounts();
+    die "storage '$storeid' is not mounted at '$path'\n"
+        if !path_is_mounted($path, $cache->{mountdata});
+
+    # Have a status ready before pvestatd asks for it
+    start_status_refresh($storeid, $path) if !read_status_cache($storeid);
+
+    return 1;
+}
+
+sub status {
+    my ($class, $storeid, $scfg, $cache) = @_;
+
+    my $path = $scfg->{path};
+    $cache->{mountdata} //= PVE::ProcFSTools::parse_proc_mounts();
+    return undef if !path_is_mounted($path, $cache->{mountdata});
+
+    my $entry = read_status_cache($storeid);
+    if (!$entry) {
+        # Nothing known yet, never ask a possibly hung file system from pvestatd itself;
+        # the refresher fills the cache for the next poll
+        start_status_refresh($storeid, $path);
+        return undef;
+    }
+
+    if (time() - ($entry->{lastAttempt} // $entry->{time}) >= status_refresh_interval($entry)) {
+        # Refresh in the background and keep serving what we know, even if the file system hangs
+        my $age = time() - $entry->{time};
+        warn "status of storage '$storeid' is stale, last refresh ${age}s ago\n"
+            if $age > $status_ttl + $status_refresh_timeout;
+        start_status_refresh($storeid, $path);
+    }
 
+    # Every refresh so far failed, the back off above still applies
+    return undef if !$entry->{total};
+    return ($entry->{total}, $entry->{avail}, $entry->{used}, 1);
 }
 
 sub deactivate_storage {
@@ -184,31 +254,169 @@ sub deactivate_storage {
 # * Volume Section *
 # ******************
 sub path {
+    my ($class, $scfg, $volname, $storeid, $snapname) = @_;
 
+    my ($vtype, $name, $vmid, undef, undef, undef, $format) = $class->parse_volname($volname);
+    my $dir = $class->get_subdir($scfg, $vtype);
+    my $path = $vtype eq 'images' ? "$dir/$vmid/$name" : "$dir/$name";
+
+    # Raw snapshots are reflinked copies next to the image, qcow2 snapshots live inside the image
+    $path = "$dir/$vmid/.snapshots/$snapname/$name" if $snapname && $vtype eq 'images' && $format eq 'raw';
+
+    return wantarray ? ($path, $vmid, $vtype) : $path;
 }
 
 sub list_images {
+    my ($class, $storeid, $scfg, $vmid, $vollist, $cache) = @_;
+
+    my $index = $class->get_image_index($storeid, $scfg, $vmid);
+    my %wanted = map { $_ => 1 } @{ $vollist // [] };
+
+    my $res = [];
+    foreach my $owner (sort keys %{ $index->{vmdirs} }) {
+        next if defined($vmid) && $owner ne $vmid;
+
+        my $images = $index->{vmdirs}->{$owner}->{images};
+        foreach my $name (sort keys %$images) {
+            my $image = $images->{$name};
+
+            my $volid = "$storeid:$owner/$name";
+            if (defined($image->{parent}) && $image->{parent} =~ m!^\.\./(\d+)/([^/]+)$!) {
+                # Linked clone, the volid carries its base image
+                $volid = "$storeid:$1/$2/$owner/$name";
+            }
+
+            next if $vollist && !$wanted{$volid};
+
+            push @$res, {
+                volid => $volid,
+                format => $image->{format},
+                size => $image->{size},
+                vmid => $owner,
+                used => $image->{used},
+                parent => $image->{parent},
+                ctime => $image->{ctime},
+            };
+        }
+    }
 
+    return $res;
 }
 
 sub create_image {
 
 }
 
+# *************************************************************************
+# Deletes an image by renaming it into the trash directory of the storage and
+# returns right away. Unlinking a large image on GFS2 frees every extent under
+# the inode's glock, so the reclaim service (bash_utils/reclaimTrash.py) punches
+# out the data in throttled ranges in the background and unlinks it after.
+# Raw snapshots of the image go to the trash with it.
+# Param:
+#   String: Storage ID
+#   HashRef: Storage configuration
+#   String: Volume name
+#   Boolean: Whether the volume is a base image
+#   String: Format of the volume
+# Returns:
+#   undef
+# *************************************************************************
 sub free_image {
+    my ($class, $storeid, $scfg, $volname, $isBase, $format) = @_;
+
+    my ($vtype, $name, $vmid) = $class->parse_volname($volname);
+    return $class->SUPER::free_image($storeid, $scfg, $volname, $isBase, $format)
+        if $vtype ne 'images' || $format eq 'subvol';
+
+    my $path = $class->path($scfg, $volname, $storeid);
+    my $trashdir = "$scfg->{path}/$trash_dir";
+    make_path($trashdir) if !-d $trashdir;
+
+    # Unique names, the same volume name can be created and deleted again before it is reclaimed
+    my $prefix = "$trashdir/" . time() . ".$$.$vmid";
+    foreach my $snappath (glob(dirname($path) . "/.snapshots/*/$name")) {
+        my $snapdir = dirname($snappath);
+        my $snap = basename($snapdir);
+        rename($snappath, "$prefix.$snap.$name") or die "could not delete snapshot '$snap' of '$volname': $!\n";
+        rmdir($snapdir);
+    }
+    rename($path, "$prefix.$name") or die "could not delete '$volname': $!\n";
 
+    invalidate_image_index($storeid, $vmid);
+    start_reclaim();
+
+    return undef;
 }
 
 sub clone_image {
+    my ($class, $scfg, $storeid, $volname, $vmid, $snap) = @_;
+
+    my ($vtype, undef, undef, undef, undef, undef, $format) = $class->parse_volname($volname);
+    die "clone_image on wrong vtype '$vtype'\n" if $vtype ne 'images';
+    die "cloning from a snapshot is only supported for raw images\n" if $snap && $format ne 'raw';
 
+    # A reflink clone shares the extents but does not depend on the base image,
+    # so the clone is a full image and not a qcow2 backing file chain
+    my $source = $class->path($scfg, $volname, $storeid, $snap);
+    my $imagedir = $class->get_subdir($scfg, 'images');
+    make_path("$imagedir/$vmid");
+
+    my $name = $class->find_free_diskname($storeid, $scfg, $vmid, $format, 1);
+    clone_image_file($source, "$imagedir/$vmid/$name");
+    invalidate_image_index($storeid, $vmid);
+
+    return "$vmid/$name";
 }
 
 sub resize_image {
 
 }
 
+# *************************************************************************
+# Moves an image to another Hitachi datastore with moveImage.py, which copies
+# only the allocated extents in parallel and keeps holes. The copy is held to
+# the 'move' bandwidth limit of both storages and resumes if it is retried
+# after an interruption.
+# Param:
+#   HashRef: Storage configuration
+#   String: Storage ID
+#   String: Volume name
+#   String: Target storage ID
+#   HashRef: Target storage configuration
+# Returns:
+#   String: Volume name on the target storage
+# *************************************************************************
 sub move_image {
-
+    my ($class, $scfg, $storeid, $volname, $target_storeid, $target_scfg) = @_;
+
+    my ($vtype, $name, $vmid, $basename, $basevmid, $isBase) = $class->parse_volname($volname);
+    die "move_image on wrong vtype '$vtype'\n" if $vtype ne 'images';
+    die "moving base images is not supported\n" if $isBase;
+    # The copy keeps the relative backing file, which does not exist on the target storage
+    die "image '$volname' is a linked clone of '$basevmid/$basename', moving linked clones is not supported\n"
+        if $basename;
+
+    # Raw snapshots live next to the image and would be left behind
+    my $source = $class->path($scfg, $volname, $storeid);
+    my $snapdir = dirname($source) . "/.snapshots";
+    die "image '$volname' has snapshots, delete them before moving it\n"
+        if grep { -e "$_/$name" } glob("$snapdir/*");
+
+    my $targetdir = $class->get_subdir($target_scfg, 'images') . "/$vmid";
+    my $target = "$targetdir/$name";
+    die "volume '$vmid/$name' already exists on storage '$target_storeid'\n"
+        if -e $target && !-e "$target.move-state";
+    make_path($targetdir);
+
+    my $bwlimit = PVE::Storage::get_bandwidth_limit('move', [$storeid, $target_storeid]) // 0;
+    run_command(['/usr/bin/python3', "$helper_dir/moveImage.py", '--bwlimit', $bwlimit, $source, $target],
+        errmsg => "could not move '$volname' to storage '$target_storeid'");
+
+    invalidate_image_index($storeid, $vmid);
+    invalidate_image_index($target_storeid, $vmid);
+
+    return "$vmid/$name";
 }
 
 
@@ -218,19 +426,71 @@ sub move_image {
 # * Snapshot Section *
 # ********************
 sub volume_snapshot {
+    my ($class, $scfg, $storeid, $volname, $snap) = @_;
+
+    my (undef, undef, undef, undef, undef, undef, $format) = $class->parse_volname($volname);
+    return $class->SUPER::volume_snapshot($scfg, $storeid, $volname, $snap) if $format ne 'raw';
+
+    my $path = $class->path($scfg, $volname, $storeid);
+    my $snappath = $class->path($scfg, $volname, $storeid, $snap);
+    die "snapshot '$snap' of '$volname' already exists\n" if -e $snappath;
 
+    make_path(dirname($snappath));
+    clone_image_file($path, $snappath);
+
+    return undef;
 }
 
 sub volume_snapshot_rollback {
+    my ($class, $scfg, $storeid, $volname, $snap) = @_;
+
+    my (undef, undef, $vmid, undef, undef, undef, $format) = $class->parse_volname($volname);
+    return $class->SUPER::volume_snapshot_rollback($scfg, $storeid, $volname, $snap) if $format ne 'raw';
+
+    my $path = $class->path($scfg, $volname, $storeid);
+    my $snappath = $class->path($scfg, $volname, $storeid, $snap);
+    die "snapshot '$snap' of '$volname' does not exist\n" if !-e $snappath;
+
+    # Clone next to the image and swap it in, so a failed rollback leaves the image untouched
+    my $tmppath = "$path.rollback.$$";
+    clone_image_file($snappath, $tmppath);
+    if (!rename($tmppath, $path)) {
+        my $err = $!;
+        unlink($tmppath);
+        die "rollback of '$volname' to snapshot '$snap' failed: $err\n";
+    }
+    invalidate_image_index($storeid, $vmid);
 
+    return undef;
 }
 
 sub volume_snapshot_delete {
+    my ($class, $scfg, $storeid, $volname, $snap, $running) = @_;
+
+    my (undef, undef, undef, undef, undef, undef, $format) = $class->parse_volname($volname);
+    return $class->SUPER::volume_snapshot_delete($scfg, $storeid, $volname, $snap, $running) if $format ne 'raw';
 
+    my $snappath = $class->path($scfg, $volname, $storeid, $snap);
+    if (-e $snappath) {
+        unlink($snappath) or die "could not delete snapshot '$snap' of '$volname': $!\n";
+    }
+    # Only succeeds once the last image's snapshot with this name is gone
+    rmdir(dirname($snappath));
+
+    return undef;
 }
 
-sub volume_has_features {
+sub volume_has_feature {
+    my ($class, $scfg, $feature, $storeid, $volname, $snapname, $running, $opts) = @_;
+
+    my (undef, undef, undef, undef, undef, $isBase, $format) = $class->parse_volname($volname);
+    if ($format eq 'raw' && !$isBase) {
+        # Raw snapshots are reflinked copies, which are only consistent while the VM is stopped
+        return 1 if $feature eq 'snapshot' && !$running;
+        return 1 if ($feature eq 'copy' || $feature eq 'clone') && $snapname;
+    }
 
+    return $class->SUPER::volume_has_feature($scfg, $feature, $storeid, $volname, $snapname, $running, $opts);
 }
 
 
@@ -240,7 +500,10 @@ sub volume_has_features {
 # = Utility Functions =
 # =====================
 sub parse_volname {
+    my ($class, $volname) = @_;
 
+    # Hitachi datastores use the same layout as a directory storage
+    return $class->SUPER::parse_volname($volname);
 }
 
 sub get_sudir {
@@ -248,13 +511,379 @@ sub get_sudir {
 }
 
 sub volume_size_info {
+    my ($class, $scfg, $storeid, $volname, $timeout) = @_;
+
+    my ($vtype, $name, $vmid) = $class->parse_volname($volname);
+    return $class->SUPER::volume_size_info($scfg, $storeid, $volname, $timeout) if $vtype ne 'images';
+
+    my $index = $class->get_image_index($storeid, $scfg, $vmid);
+    my $vmdir = $index->{vmdirs}->{$vmid};
+    die "volume '$volname' does not exist\n" if !$vmdir || !$vmdir->{images}->{$name};
+
+    # Callers act on the size (resize, migration), so never answer from a stale entry
+    my $image = refresh_image_attributes("$index->{imagedir}/$vmid", $name, $vmdir->{images}->{$name}, 0, $timeout);
+    die "volume '$volname' does not exist\n" if !$image;
+
+    return wantarray
+        ? ($image->{size}, $image->{format}, $image->{used}, $image->{parent}, $image->{ctime})
+        : $image->{size};
+}
+
+# *************************************************************************
+# Clones an image file through the cloneImage.py helper. The helper uses a
+# reflink (FICLONE) when the file system supports it, so cloning even a
+# large template on an XFS datastore is near instant. Otherwise it falls
+# back to copy_file_range.
+# Param:
+#   String: Path of the source image
+#   String: Path of the new image, must not exist
+# Returns:
+#   String: Method the helper used, "reflink" or "copy_file_range"
+# *************************************************************************
+sub clone_image_file {
+    my ($source, $target) = @_;
+
+    my $method = '';
+    run_command(['/usr/bin/python3', "$helper_dir/cloneImage.py", $source, $target],
+        outfunc => sub { $method = trim(shift) },
+        errmsg => "could not clone '$source'");
+
+    return $method;
+}
+
+# *************************************************************************
+# Starts the reclaim service without waiting for it. A running service
+# rescans the trash after every pass and picks up the new image.
+# *************************************************************************
+sub start_reclaim {
+    eval {
+        run_command(['systemctl', 'start', '--no-block', $reclaim_service],
+            errmsg => "could not start $reclaim_service");
+    };
+    if (my $err = $@) {
+        chomp($err);
+        warn "$err, deleted images stay in the trash until it runs\n";
+    }
+}
+
+# *************************************************************************
+# Gets the image index of a storage, refreshing only what changed since the
+# last call. pvestatd and the GUI list content every few seconds. A full
+# readdir/stat walk of a GFS2 datastore takes a glock for every directory and
+# image across the cluster, so a VM directory is only read again when its
+# mtime changes and an image is only stat'ed again after $image_attr_ttl.
+# Param:
+#   String: Storage ID
+#   HashRef: Storage configuration
+#   String (optional): Only refresh the directory of this VM ID
+# Returns:
+#   HashRef: { imagedir => String, mtime => Int,
+#              vmdirs => { vmid => { mtime => Int, images => { name => HashRef } } } }
+# *************************************************************************
+sub get_image_index {
+    my ($class, $storeid, $scfg, $vmid) = @_;
+
+    my $imagedir = $class->get_subdir($scfg, 'images');
+    my $index = $image_index->{$storeid};
+    if (!$index || $index->{imagedir} ne $imagedir) {
+        $index = $image_index->{$storeid} = { imagedir => $imagedir, mtime => -1, vmdirs => {} };
+    }
+
+    my $mtime = (stat($imagedir))[9];
+    if (!defined($mtime)) {
+        # Nothing was created on this storage yet
+        $index->{vmdirs} = {};
+        return $index;
+    }
+
+    if ($mtime != $index->{mtime}) {
+        # VM directories were added or removed
+        my $dh;
+        if (!opendir($dh, $imagedir)) {
+            warn "Could not read $imagedir: $!\n";
+            return $index;
+        }
+        my %seen;
+        while (defined(my $entry = readdir($dh))) {
+            next if $entry !~ m/^(\d+)$/;
+            $seen{$1} = 1;
+            $index->{vmdirs}->{$1} //= { mtime => -1, images => {} };
+        }
+        closedir($dh);
+        foreach my $owner (keys %{ $index->{vmdirs} }) {
+            delete $index->{vmdirs}->{$owner} if !$seen{$owner};
+        }
+        $index->{mtime} = index_mtime($mtime);
+    }
 
+    my @owners = defined($vmid) ? ($vmid) : keys %{ $index->{vmdirs} };
+    foreach my $owner (@owners) {
+        next if !$index->{vmdirs}->{$owner};
+        refresh_vmdir_index("$imagedir/$owner", $index->{vmdirs}->{$owner});
+    }
+
+    return $index;
+}
+
+# *************************************************************************
+# Drops cached entries so the next lookup reads them from disk again.
+# Must be called after an image is created, removed or resized.
+# Param:
+#   String: Storage ID
+#   String (optional): VM ID, the whole storage is dropped if not given
+# *************************************************************************
+sub invalidate_image_index {
+    my ($storeid, $vmid) = @_;
+
+    my $index = $image_index->{$storeid} or return;
+    if (defined($vmid)) {
+        $index->{mtime} = -1;
+        delete $index->{vmdirs}->{$vmid};
+    } else {
+        delete $image_index->{$storeid};
+    }
+}
+
+# *************************************************************************
+# Returns the mtime to remember for a directory. Directory mtimes have a
+# one second granularity, so a directory changed within the current second
+# is not trusted and will be read again on the next call.
+# Param:
+#   Int: mtime of the directory
+# Returns:
+#   Int: mtime to store in the index
+# *************************************************************************
+sub index_mtime {
+    my ($mtime) = @_;
+    return (time() - $mtime > 1) ? $mtime : -1;
+}
+
+# *************************************************************************
+# Refreshes the images of one VM directory in the index
+# Param:
+#   String: Path of the VM directory
+#   HashRef: Index entry of the VM directory
+# *************************************************************************
+sub refresh_vmdir_index {
+    my ($dir, $vmdir) = @_;
+
+    my $mtime = (stat($dir))[9];
+    if (!defined($mtime)) {
+        $vmdir->{images} = {};
+        return;
+    }
+
+    if ($mtime != $vmdir->{mtime}) {
+        my $dh;
+        if (!opendir($dh, $dir)) {
+            warn "Could not read $dir: $!\n";
+            return;
+        }
+        my %seen;
+        while (defined(my $entry = readdir($dh))) {
+            next if $entry !~ m/^((?:base|vm|subvol)-\d+-\S+\.(?:raw|qcow2|vmdk|subvol))$/;
+            $seen{$1} = 1;
+            $vmdir->{images}->{$1} //= { checked => 0 };
+        }
+        closedir($dh);
+        foreach my $name (keys %{ $vmdir->{images} }) {
+            delete $vmdir->{images}->{$name} if !$seen{$name};
+        }
+        $vmdir->{mtime} = index_mtime($mtime);
+    }
+
+    foreach my $name (keys %{ $vmdir->{images} }) {
+        my $image = refresh_image_attributes($dir, $name, $vmdir->{images}->{$name}, $image_attr_ttl);
+        delete $vmdir->{images}->{$name} if !$image;
+    }
+}
+
+# *************************************************************************
+# Refreshes size, usage and format of an indexed image. The image header is
+# only read again (qemu-img) when the file's mtime or size changed.
+# Param:
+#   String: Path of the VM directory
+#   String: Image file name
+#   HashRef: Index entry of the image
+#   Int: Seconds the entry is trusted without a stat
+#   Int (optional): Timeout for reading the image header
+# Returns:
+#   HashRef|undef: The updated entry, undef if the image is gone
+# *************************************************************************
+sub refresh_image_attributes {
+    my ($dir, $name, $image, $ttl, $timeout) = @_;
+
+    my $now = time();
+    return $image if $image->{checked} && $now - $image->{checked} < $ttl;
+
+    my $path = "$dir/$name";
+    my @st = stat($path) or return undef;
+    my ($fsize, $blocks, $mtime, $ctime) = @st[7, 12, 9, 10];
+
+    my ($format) = $name =~ m/\.(raw|qcow2|vmdk|subvol)$/;
+    if ($format eq 'raw') {
+        $image->{size} = $fsize;
+        $image->{parent} = undef;
+    } elsif (!defined($image->{mtime}) || $image->{mtime} != $mtime || $image->{fsize} != $fsize) {
+        my ($size, undef, undef, $parent) = PVE::Storage::Plugin::file_size_info($path, $timeout // 10);
+        $image->{size} = $size // 0;
+        $image->{parent} = $parent;
+    }
+
+    $image->{format} = $format;
+    $image->{used} = $blocks * 512;
+    $image->{ctime} = $ctime;
+    $image->{mtime} = $mtime;
+    $image->{fsize} = $fsize;
+    $image->{checked} = $now;
+
+    return $image;
 }
 
 sub check_connection {
 
 }
 
+# *************************************************************************
+# Checks if the given path is a mount point without touching the file
+# system itself, so it can not block on a sick LUN
+# Param:
+#   String: Path to check
+#   ArrayRef: Parsed /proc/mounts from PVE::ProcFSTools::parse_proc_mounts()
+# Returns:
+#   Int: 1 (true) if the path is mounted, 0 (false) otherwise
+# *************************************************************************
+sub path_is_mounted {
+    my ($path, $mountdata) = @_;
+
+    $path =~ s!/+$!!;
+    foreach my $mount (@$mountdata) {
+        return 1 if $mount->[1] eq $path;
+    }
+    return 0;
+}
+
+# *************************************************************************
+# Gets the seconds between status refreshes of a storage. Every refresh in
+# a row that timed out doubles the interval, so a hung LUN does not pile
+# up processes stuck in statvfs.
+# Param:
+#   HashRef: Status cache entry
+# Returns:
+#   Int: Seconds between refreshes
+# *************************************************************************
+sub status_refresh_interval {
+    my ($entry) = @_;
+
+    my $interval = $status_ttl * (2 ** ($entry->{timeouts} // 0));
+    return $interval > $status_max_backoff ? $status_max_backoff : $interval;
+}
+
+# *************************************************************************
+# Gets the last known status of a storage. The in-memory copy is used
+# unless the background refresher wrote a newer file.
+# Param:
+#   String: Storage ID
+# Returns:
+#   HashRef|undef: { total, avail, used, time, lastAttempt, timeouts }
+# *************************************************************************
+sub read_status_cache {
+    my ($storeid) = @_;
+
+    my $file = "$status_cache_dir/status-$storeid.json";
+    my $mtime = (stat($file))[9];
+    my $entry = $status_cache->{$storeid};
+    return $entry if !defined($mtime) || ($entry && $entry->{fileMtime} && $entry->{fileMtime} >= $mtime);
+
+    my $fh = IO::File->new($file, '<') or return $entry;
+    my $json_text = do { local $/; <$fh> };
+    $fh->close;
+
+    my $data = eval { decode_json($json_text) };
+    return $entry if !$data;
+
+    $data->{fileMtime} = $mtime;
+    return $status_cache->{$storeid} = $data;
+}
+
+# *************************************************************************
+# Stores the status of a storage in memory and in the cache file shared
+# with the background refresher
+# Param:
+#   String: Storage ID
+#   HashRef: Status cache entry
+# *************************************************************************
+sub write_status_cache {
+    my ($storeid, $entry) = @_;
+
+    $status_cache->{$storeid} = $entry;
+
+    make_path($status_cache_dir) if !-d $status_cache_dir;
+    my $file = "$status_cache_dir/status-$storeid.json";
+    my $tmp = "$file.tmp.$$";
+    my %data = map { $_ => $entry->{$_} } qw(total avail used time lastAttempt timeouts);
+    eval {
+        PVE::Tools::file_set_contents($tmp, encode_json(\%data));
+        rename($tmp, $file) or die "rename failed: $!\n";
+    };
+    warn "Could not write status cache of storage '$storeid': $@" if $@;
+}
+
+# *************************************************************************
+# Starts a detached process that refreshes the status of a storage and
+# writes it to the cache file. Only one refresher runs per storage; if the
+# previous one is still alive (e.g. stuck during DLM recovery) no new one
+# is started and the last known value keeps being served.
+# Param:
+#   String: Storage ID
+#   String: Mount point of the storage
+# *************************************************************************
+sub start_status_refresh {
+    my ($storeid, $path) = @_;
+
+    make_path($status_cache_dir) if !-d $status_cache_dir;
+    my $pidfile = "$status_cache_dir/status-$storeid.pid";
+    if (my $fh = IO::File->new($pidfile, '<')) {
+        my $pid = <$fh>;
+        $fh->close;
+        return if defined($pid) && $pid =~ m/^(\d+)$/ && kill(0, $1);
+    }
+
+    my $child = fork();
+    if (!defined($child)) {
+        warn "Could not fork status refresh of storage '$storeid': $!\n";
+        return;
+    }
+    if ($child) {
+        # The intermediate child exits right away, the refresher is reparented to init
+        waitpid($child, 0);
+        return;
+    }
+
+    setsid();
+    my $refresher = fork();
+    POSIX::_exit(0) if !defined($refresher) || $refresher;
+
+    eval {
+        PVE::Tools::file_set_contents($pidfile, "$$\n");
+
+        my $entry = read_status_cache($storeid) // { timeouts => 0 };
+        my $res = PVE::Tools::df($path, $status_refresh_timeout);
+        if ($res->{total}) {
+            $entry = { total => $res->{total}, avail => $res->{avail}, used => $res->{used},
+                       time => time(), lastAttempt => time(), timeouts => 0 };
+        } else {
+            # Timed out or failed, keep the old values and back off
+            $entry->{timeouts} = ($entry->{timeouts} // 0) + 1;
+            $entry->{lastAttempt} = time();
+            $entry->{time} //= 0;
+        }
+        write_status_cache($storeid, $entry);
+        unlink($pidfile);
+    };
+    POSIX::_exit($@ ? 1 : 0);
+}
+
 # ************************************************************************
 # This will install the needed packages to support Hitachi storage and 
 # cluster file system
@@ -407,27 +1036,71 @@ sub print_multipath_volumes {
     print ""
 }
 
-sub get_hitachi_disks {
-    my $cmd = "lsblk -ndo NAME,SIZE,WWN,MODEL | grep 'OPEN-V'";
-    my $output = system($cmd)
+# *************************************************************************
+# Asks the inventory service a question. The service keeps the device,
+# cluster and config inventory in memory, so this replaces forking lsblk
+# and pvecm on every plugin callback.
+# Param:
+#   String: Query name (ping, refresh, luns, lun, disks, cluster, config, all)
+#   HashRef (optional): Extra query arguments
+# Returns:
+#   Any|undef: Decoded answer, undef if the service is not running or
+#              failed to answer
+# *************************************************************************
+sub inventory_query {
+    my ($query, $args) = @_;
 
-    my @disks;
+    my $sock = IO::Socket::UNIX->new(Type => SOCK_STREAM(), Peer => $inventory_socket)
+        or return undef;
 
-    foreach my $line (@output) {
-        chomp $line;
+    # run_with_timeout keeps any alarm pvestatd or pvedaemon has pending
+    my $answer = eval {
+        PVE::Tools::run_with_timeout($inventory_timeout, sub {
+            print $sock encode_json({ %{ $args // {} }, query => $query }) . "\n";
+            my $line = <$sock>;
+            die "no answer\n" if !defined($line);
+            return decode_json($line);
+        });
+    };
+    close($sock);
 
-        # Split by whitespace
-        my ($device, $size, $wwid, $model) = split /\s+/, $line;
+    if (!$answer || !$answer->{ok}) {
+        warn "inventory query '$query' failed: " . ($@ || $answer->{error}) . "\n";
+        return undef;
+    }
+    return $answer->{data};
+}
 
-        # Store as a hash reference
-        push @disks, {
-            device => $device,
-            size   => $size,
-            wwid   => $wwid,
-            model  => $model,
-        };
+# *************************************************************************
+# Gets the sd paths of the Hitachi LUNs from the inventory service, or from
+# lsblk if it is not running. Both return the same shape.
+# Returns:
+#   Array: { device, size (bytes), wwid (as scsi_id prints it), model } per path
+# *************************************************************************
+sub get_hitachi_disks {
+    if (my $disks = inventory_query('disks', { hitachiOnly => JSON::XS::true })) {
+        return map {
+            { device => $_->{device}, size => $_->{sizeBytes}, wwid => $_->{wwid}, model => $_->{model} }
+        } @$disks;
     }
 
+    my @disks;
+    eval {
+        run_command(['lsblk', '--bytes', '--nodeps', '--noheadings', '--pairs', '--output', 'NAME,SIZE,WWN,MODEL'],
+            timeout => 10,
+            outfunc => sub {
+                my ($line) = @_;
+                my %field = $line =~ m/(\w+)="([^"]*)"/g;
+                return if ($field{MODEL} // '') !~ m/^OPEN-V/;
+
+                # lsblk prints the NAA identifier as 0x6..., scsi_id and the inventory as 36...
+                my $wwid = $field{WWN} // '';
+                $wwid = '3' . lc(substr($wwid, 2)) if $wwid =~ m/^0x/i;
+                push @disks, { device => $field{NAME}, size => int($field{SIZE} // 0), wwid => $wwid, model => $field{MODEL} };
+            });
+    };
+    warn "could not list the Hitachi disks: $@" if $@;
+
     return @disks;
 }
 
@@ -464,6 +1137,10 @@ sub get_this_server_name {
 #   of a cluster
 # *************************************************************************
 sub is_in_cluster {
+    if (my $cluster = inventory_query('cluster')) {
+        return $cluster->{isClusterNode} ? 1 : 0;
+    }
+
     my $output = `pvecm status 2>&1`;  # capture stdout and stderr
 
     # Look for a line starting with "Name:"
@@ -481,6 +1158,10 @@ sub is_in_cluster {
 #   Array(Hash): Nodes with attributes "Node"
 # *************************************************************************
 sub get_cluster_nodes {
+    if (my $cluster = inventory_query('cluster')) {
+        return map { { nodeId => $_->{nodeId}, nodeName => $_->{nodeName} } } @{ $cluster->{nodes} };
+    }
+
     my @nodes;
     my $cmd = "pvecm nodes";
     my $result = system($cmd);
@@ -512,6 +1193,10 @@ sub get_cluster_nodes {
 #   String: Name of the PVE Cluster
 # **********************************************************
 sub get_cluster_name {
+    if (my $cluster = inventory_query('cluster')) {
+        return $cluster->{clusterName} ne '' ? $cluster->{clusterName} : undef;
+    }
+
     $cmd = "pvecm status";
     $output = system($cmd);
     my ($temp_cluster_name) = $output =~ /^Name:\s+(\S+)/m;